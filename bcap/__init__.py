@@ -1,2 +1,15 @@
 from .b_cap_client import BCapClient
+from .b_cap_async_client import AsyncBCapClient
 from .b_cap_exception import BCapException
+from .b_cap_sampler import BCapSampler, BCapSample
+from .b_cap_handle_cache import BCapHandleCache
+from .b_cap_client_pool import BCapClientPool
+from .b_cap_fleet import BCapFleet, BCapFleetResult
+from .b_cap_file_transfer import BCapFileTransfer
+from .b_cap_converter import BCapArrayView
+from .b_cap_metrics import BCapMetrics
+from .b_cap_emulator import BCapEmulator
+from .b_cap_recorder import BCapRecorder, BCapReplayer, BCapRecord
+from .b_cap_capture import BCapCapture
+from .b_cap_slave_stream import BCapSlaveStream
+from .b_cap_prepared import BCapPreparedRequest
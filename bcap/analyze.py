@@ -0,0 +1,75 @@
+# Usage: python -m bcap.analyze CAPTURE [options]
+#
+# Indexes a capture written by BCapRecorder and prints the latency of each
+# b-CAP function. The frames can be decoded on all CPUs and exported.
+#
+#   --csv FILE       write every frame with its decoded value
+#   --json FILE      write the latency table
+#   --workers N      decode with N processes instead of one per CPU
+import argparse
+import json
+import sys
+import time
+from .b_cap_capture import BCapCapture
+
+
+def print_table(table: dict) -> None:
+    columns = ("calls", "errors", "p50 ms", "p90 ms", "p99 ms", "p99.9 ms", "max ms")
+    header = "{:>8} {:<36}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}"
+    print(header.format("func_id", "function", *columns))
+    for func_id, entry in table.items():
+        summary = entry["latency"]
+        values = list(summary["quantiles"].values()) + [summary["max"]]
+        print(
+            "{:>8} {:<36}{:>10}{:>8}".format(
+                func_id, entry["name"], entry["calls"], entry["errors"]
+            )
+            + "".join(
+                "{:>10}".format("-" if v is None else "{:.3f}".format(v * 1e3))
+                for v in values
+            )
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Analyze a b-CAP capture written by BCapRecorder."
+    )
+    parser.add_argument("capture")
+    parser.add_argument("--csv")
+    parser.add_argument("--json")
+    parser.add_argument("--workers", type=int)
+    arguments = parser.parse_args()
+
+    started = time.perf_counter()
+    capture = BCapCapture(arguments.capture)
+    print(
+        "{} frames in {} sessions, {} dropped, indexed in {:.2f} s".format(
+            len(capture),
+            len(capture.protocols),
+            capture.dropped,
+            time.perf_counter() - started,
+        )
+    )
+    print()
+
+    table = capture.get_latency_table()
+    print_table(table)
+
+    if arguments.json:
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(table, f, indent=1, sort_keys=True)
+
+    if arguments.csv:
+        started = time.perf_counter()
+        rows = capture.export_csv(arguments.csv, arguments.workers)
+        print()
+        print(
+            "{} rows written in {:.2f} s".format(rows, time.perf_counter() - started)
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
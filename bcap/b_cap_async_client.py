@@ -0,0 +1,476 @@
+from typing import Union, Optional
+from .b_cap_async_tcp import AsyncBCapTcp
+from .b_cap_async_udp import AsyncBCapUdp
+
+
+class AsyncBCapClient:
+    def __init__(self, protocol: str, should_return_hr: bool = False):
+        _protocol = protocol.lower()
+        if _protocol == "tcp":
+            self._b_cap_socket = AsyncBCapTcp(should_return_hr)
+        elif _protocol == "udp":
+            self._b_cap_socket = AsyncBCapUdp(should_return_hr)
+        else:
+            raise NotImplementedError()
+
+    async def connect(self, endpoint: str, timeout: float, retry=1) -> None:
+        await self._b_cap_socket.connect(endpoint, timeout, retry)
+
+    async def disconnect(self) -> None:
+        try:
+            await self.service_stop()
+        except Exception:
+            pass
+
+        await self._b_cap_socket.disconnect()
+
+    def set_timeout(self, timeout: float) -> None:
+        self._b_cap_socket.set_timeout(timeout)
+
+    def get_timeout(self) -> float:
+        return self._b_cap_socket.get_timeout()
+
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        self._b_cap_socket.set_compression(enable, level, threshold, adaptive)
+
+    def get_compression_statistics(self) -> dict:
+        return self._b_cap_socket.get_compression_statistics()
+
+    def set_array_type(self, array_type: str) -> None:
+        self._b_cap_socket.set_array_type(array_type)
+
+    async def request(self, func_id: int, args: list) -> any:
+        return await self._b_cap_socket.request(func_id, args)
+
+    async def service_start(self, option="") -> Optional[int]:
+        return await self._b_cap_socket.request(1, [option])
+
+    async def service_stop(self) -> Optional[int]:
+        return await self._b_cap_socket.request(2, [])
+
+    async def controller_connect(
+        self, name: str, provider: str, machine: str, option: str
+    ) -> Union[int, any]:
+        return await self._b_cap_socket.request(3, [name, provider, machine, option])
+
+    async def controller_disconnect(self, handle: int) -> Optional[int]:
+        return await self._b_cap_socket.request(4, [handle])
+
+    async def controller_get_extension(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return await self._b_cap_socket.request(5, [handle, name, option])
+
+    async def controller_get_file(self, handle: int, name: str, option="") -> Union[int, any]:
+        return await self._b_cap_socket.request(6, [handle, name, option])
+
+    async def controller_get_robot(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return await self._b_cap_socket.request(7, [handle, name, option])
+
+    async def controller_get_task(self, handle: int, name: str, option="") -> Union[int, any]:
+        return await self._b_cap_socket.request(8, [handle, name, option])
+
+    async def controller_get_variable(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return await self._b_cap_socket.request(9, [handle, name, option])
+
+    async def controller_get_command(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return await self._b_cap_socket.request(10, [handle, name, option])
+
+    async def controller_get_extension_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(11, [handle, option])
+
+    async def controller_get_file_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(12, [handle, option])
+
+    async def controller_get_robot_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(13, [handle, option])
+
+    async def controller_get_task_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(14, [handle, option])
+
+    async def controller_get_variable_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(15, [handle, option])
+
+    async def controller_get_command_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(16, [handle, option])
+
+    async def controller_execute(self, handle: int, command: str, param=None) -> any:
+        return await self._b_cap_socket.request(17, [handle, command, param])
+
+    async def controller_get_message(self, handle: int) -> Union[str, any]:
+        return await self._b_cap_socket.request(18, [handle])
+
+    async def controller_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(19, [handle])
+
+    async def controller_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(20, [handle])
+
+    async def controller_get_name(self, handle: int) -> Union[str, any]:
+        return await self._b_cap_socket.request(21, [handle])
+
+    async def controller_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(22, [handle])
+
+    async def controller_put_tag(self, handle: int, new_val) -> any:
+        return await self._b_cap_socket.request(23, [handle, new_val])
+
+    async def controller_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(24, [handle])
+
+    async def controller_put_id(self, handle: int, new_val) -> any:
+        return await self._b_cap_socket.request(25, [handle, new_val])
+
+    async def extension_get_variable(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return await self._b_cap_socket.request(26, [handle, name, option])
+
+    async def extension_get_variable_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(27, [handle, option])
+
+    async def extension_execute(self, handle: int, command: str, param=None) -> any:
+        return await self._b_cap_socket.request(28, [handle, command, param])
+
+    async def extension_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(29, [handle])
+
+    async def extension_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(30, [handle])
+
+    async def extension_get_name(self, handle: int) -> Union[str, any]:
+        return await self._b_cap_socket.request(31, [handle])
+
+    async def extension_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(32, [handle])
+
+    async def extension_put_tag(self, handle: int, new_val) -> any:
+        return await self._b_cap_socket.request(33, [handle, new_val])
+
+    async def extension_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(34, [handle])
+
+    async def extension_put_id(self, handle: int, new_val) -> any:
+        return await self._b_cap_socket.request(35, [handle, new_val])
+
+    async def extension_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(36, [handle])
+
+    async def file_get_file(self, handle: int, name: str, option="") -> Union[int, any]:
+        return await self._b_cap_socket.request(37, [handle, name, option])
+
+    async def file_get_variable(self, handle: int, name: str, option="") -> Union[int, any]:
+        return await self._b_cap_socket.request(38, [handle, name, option])
+
+    async def file_get_file_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(39, [handle, option])
+
+    async def file_get_variable_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(40, [handle, option])
+
+    async def file_execute(self, handle: int, command: str, param=None) -> any:
+        return await self._b_cap_socket.request(41, [handle, command, param])
+
+    async def file_copy(self, handle: int, name: str, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(42, [handle, name, option])
+
+    async def file_delete(self, handle: int, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(43, [handle, option])
+
+    async def file_move(self, handle: int, name: str, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(44, [handle, name, option])
+
+    async def file_run(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(45, [handle, option])
+
+    async def file_get_date_created(self, handle: int) -> any:
+        return await self._b_cap_socket.request(46, [handle])
+
+    async def file_get_date_last_accessed(self, handle: int) -> any:
+        return await self._b_cap_socket.request(47, [handle])
+
+    async def file_get_date_last_modified(self, handle: int) -> any:
+        return await self._b_cap_socket.request(48, [handle])
+
+    async def file_get_path(self, handle: int) -> any:
+        return await self._b_cap_socket.request(49, [handle])
+
+    async def file_get_size(self, handle: int) -> any:
+        return await self._b_cap_socket.request(50, [handle])
+
+    async def file_get_type(self, handle: int) -> any:
+        return await self._b_cap_socket.request(51, [handle])
+
+    async def file_get_value(self, handle: int) -> any:
+        return await self._b_cap_socket.request(52, [handle])
+
+    async def file_put_value(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(53, [handle, new_val])
+
+    async def file_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(54, [handle])
+
+    async def file_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(55, [handle])
+
+    async def file_get_name(self, handle: int) -> any:
+        return await self._b_cap_socket.request(56, [handle])
+
+    async def file_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(57, [handle])
+
+    async def file_put_tag(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(58, [handle, new_val])
+
+    async def file_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(59, [handle])
+
+    async def file_put_id(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(60, [handle, new_val])
+
+    async def file_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(61, [handle])
+
+    async def robot_get_variable(self, handle: int, name: str, option="") -> Union[int, any]:
+        return await self._b_cap_socket.request(62, [handle, name, option])
+
+    async def robot_get_variable_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(63, [handle, option])
+
+    async def robot_execute(self, handle: int, command: str, param=None) -> any:
+        return await self._b_cap_socket.request(64, [handle, command, param])
+
+    async def robot_accelerate(
+        self, handle: int, axis: int, accel: float, decel: float
+    ) -> Optional[any]:
+        return await self._b_cap_socket.request(65, [handle, axis, accel, decel])
+
+    async def robot_change(self, handle: int, name: str) -> Optional[any]:
+        return await self._b_cap_socket.request(66, [handle, name])
+
+    async def robot_chuck(self, handle: int, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(67, [handle, option])
+
+    async def robot_drive(
+        self, handle: int, axis: int, mov: float, option=""
+    ) -> Optional[any]:
+        return await self._b_cap_socket.request(68, [handle, axis, mov, option])
+
+    async def robot_go_home(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(69, [handle])
+
+    async def robot_halt(self, handle: int, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(70, [handle, option])
+
+    async def robot_hold(self, handle: int, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(71, [handle, option])
+
+    async def robot_move(self, handle: int, comp: int, pose: any, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(72, [handle, comp, pose, option])
+
+    async def robot_rotate(
+        self, handle: int, rotation_surface: any, degree: float, pivot: any, option=""
+    ) -> Optional[any]:
+        return await self._b_cap_socket.request(
+            73, [handle, rotation_surface, degree, pivot, option]
+        )
+
+    async def robot_speed(self, handle: int, axis: int, speed: float) -> Optional[any]:
+        return await self._b_cap_socket.request(74, [handle, axis, speed])
+
+    async def robot_unchuck(self, handle: int, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(75, [handle, option])
+
+    async def robot_unhold(self, handle: int, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(76, [handle, option])
+
+    async def robot_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(77, [handle])
+
+    async def robot_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(78, [handle])
+
+    async def robot_get_name(self, handle: int) -> any:
+        return await self._b_cap_socket.request(79, [handle])
+
+    async def robot_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(80, [handle])
+
+    async def robot_put_tag(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(81, [handle, new_val])
+
+    async def robot_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(82, [handle])
+
+    async def robot_put_id(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(83, [handle, new_val])
+
+    async def robot_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(84, [handle])
+
+    async def task_get_variable(self, handle: int, name: str, option="") -> Union[int, any]:
+        return await self._b_cap_socket.request(85, [handle, name, option])
+
+    async def task_get_variable_names(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(86, [handle, option])
+
+    async def task_execute(self, handle: int, command: str, param=None) -> any:
+        return await self._b_cap_socket.request(87, [handle, command, param])
+
+    async def task_start(self, handle: int, mode, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(88, [handle, mode, option])
+
+    async def task_stop(self, handle: int, mode, option="") -> Optional[any]:
+        return await self._b_cap_socket.request(89, [handle, mode, option])
+
+    async def task_delete(self, handle: int, option="") -> any:
+        return await self._b_cap_socket.request(90, [handle, option])
+
+    async def task_get_file_name(self, handle: int) -> any:
+        return await self._b_cap_socket.request(91, [handle])
+
+    async def task_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(92, [handle])
+
+    async def task_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(93, [handle])
+
+    async def task_get_name(self, handle: int) -> any:
+        return await self._b_cap_socket.request(94, [handle])
+
+    async def task_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(95, [handle])
+
+    async def task_put_tag(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(96, [handle, new_val])
+
+    async def task_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(97, [handle])
+
+    async def task_put_id(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(98, [handle, new_val])
+
+    async def task_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(99, [handle])
+
+    async def variable_get_date_time(self, handle: int) -> any:
+        return await self._b_cap_socket.request(100, [handle])
+
+    async def variable_get_value(self, handle: int) -> Union[int, any]:
+        return await self._b_cap_socket.request(101, [handle])
+
+    async def variable_put_value(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(102, [handle, new_val])
+
+    async def variable_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(103, [handle])
+
+    async def variable_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(104, [handle])
+
+    async def variable_get_name(self, handle: int) -> any:
+        return await self._b_cap_socket.request(105, [handle])
+
+    async def variable_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(106, [handle])
+
+    async def variable_put_tag(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(107, [handle, new_val])
+
+    async def variable_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(108, [handle])
+
+    async def variable_put_id(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(109, [handle, new_val])
+
+    async def variable_get_microsecond(self, handle: int) -> any:
+        return await self._b_cap_socket.request(110, [handle])
+
+    async def variable_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(111, [handle])
+
+    async def command_execute(self, handle: int, mode) -> Optional[any]:
+        return await self._b_cap_socket.request(112, [handle, mode])
+
+    async def command_cancel(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(113, [handle])
+
+    async def command_get_timeout(self, handle: int) -> any:
+        return await self._b_cap_socket.request(114, [handle])
+
+    async def command_put_timeout(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(115, [handle, new_val])
+
+    async def command_get_state(self, handle: int) -> any:
+        return await self._b_cap_socket.request(116, [handle])
+
+    async def command_get_parameters(self, handle: int) -> any:
+        return await self._b_cap_socket.request(117, [handle])
+
+    async def command_put_parameters(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(118, [handle, new_val])
+
+    async def command_get_result(self, handle: int) -> any:
+        return await self._b_cap_socket.request(119, [handle])
+
+    async def command_get_attribute(self, handle: int) -> any:
+        return await self._b_cap_socket.request(120, [handle])
+
+    async def command_get_help(self, handle: int) -> any:
+        return await self._b_cap_socket.request(121, [handle])
+
+    async def command_get_name(self, handle: int) -> any:
+        return await self._b_cap_socket.request(122, [handle])
+
+    async def command_get_tag(self, handle: int) -> any:
+        return await self._b_cap_socket.request(123, [handle])
+
+    async def command_put_tag(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(124, [handle, new_val])
+
+    async def command_get_id(self, handle: int) -> any:
+        return await self._b_cap_socket.request(125, [handle])
+
+    async def command_put_id(self, handle: int, new_val) -> Optional[any]:
+        return await self._b_cap_socket.request(126, [handle, new_val])
+
+    async def command_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(127, [handle])
+
+    async def message_reply(self, handle: int, data) -> Optional[any]:
+        return await self._b_cap_socket.request(128, [handle, data])
+
+    async def message_clear(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(129, [handle])
+
+    async def message_get_date_time(self, handle: int) -> any:
+        return await self._b_cap_socket.request(130, [handle])
+
+    async def message_get_description(self, handle: int) -> any:
+        return await self._b_cap_socket.request(131, [handle])
+
+    async def message_get_destination(self, handle: int) -> any:
+        return await self._b_cap_socket.request(132, [handle])
+
+    async def message_get_number(self, handle: int) -> any:
+        return await self._b_cap_socket.request(133, [handle])
+
+    async def message_get_serial_number(self, handle: int) -> any:
+        return await self._b_cap_socket.request(134, [handle])
+
+    async def message_get_source(self, handle: int) -> any:
+        return await self._b_cap_socket.request(135, [handle])
+
+    async def message_get_value(self, handle: int) -> any:
+        return await self._b_cap_socket.request(136, [handle])
+
+    async def message_release(self, handle: int) -> Optional[any]:
+        return await self._b_cap_socket.request(137, [handle])
@@ -0,0 +1,151 @@
+import asyncio
+from typing import Tuple
+from .b_cap_exception import HResult
+from .b_cap_converter import BCapConverter
+
+
+def fail_frame(pending: dict, frame: bytes, error: Exception) -> None:
+    # Fails the future awaiting a frame that could not be deserialized.
+    future = pending.get(BCapConverter.peek_serial(frame))
+    if future is not None and not future.done():
+        future.set_exception(error)
+
+
+class _BCapTcpProtocol(asyncio.Protocol):
+    def __init__(self, bcap_converter: BCapConverter):
+        self._bcap_converter = bcap_converter
+        self._recv_buffer = bytearray()
+        self.pending = {}
+        self.keepalives = {}
+
+    def connection_lost(self, exc: Exception) -> None:
+        if exc is None:
+            exc = ConnectionResetError("The b-CAP server closed the connection.")
+
+        pending = self.pending
+        self.pending = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def data_received(self, data: bytes) -> None:
+        self._recv_buffer += data
+        for frame in BCapConverter.extract_frames(self._recv_buffer):
+            self._frame_received(frame)
+
+    def _frame_received(self, frame: bytes) -> None:
+        try:
+            (
+                recv_serial,
+                version,
+                hr,
+                deserialized_args,
+            ) = self._bcap_converter.deserialize(frame)
+        except Exception as e:
+            # Only the request of the frame fails, the stream is still in step.
+            fail_frame(self.pending, frame, e)
+            return
+
+        future = self.pending.get(recv_serial)
+        if future is None or future.done():
+            return
+
+        if hr == HResult.S_EXECUTING:
+            self.keepalives[recv_serial] = self.keepalives.get(recv_serial, 0) + 1
+            return
+
+        if deserialized_args is None:
+            future.set_result((hr, None))
+        else:
+            future.set_result((hr, deserialized_args[0]))
+
+
+class AsyncBCapTcp:
+    def __init__(self, should_return_hr: bool):
+        self._version = 1
+        self._serial = 1
+        self._timeout = None
+        self._transport = None
+        self._protocol = None
+        self._bcap_converter = BCapConverter(True, should_return_hr)
+
+    async def connect(self, endpoint: str, timeout: float, retry: int) -> None:
+        try:
+            await self.disconnect()
+            host, port = BCapConverter.parse_endpoint(endpoint)
+            loop = asyncio.get_running_loop()
+            self._transport, self._protocol = await asyncio.wait_for(
+                loop.create_connection(
+                    lambda: _BCapTcpProtocol(self._bcap_converter), host, port
+                ),
+                timeout,
+            )
+            self.set_timeout(timeout)
+        except Exception as e:
+            await self.disconnect()
+            raise e
+
+    async def disconnect(self) -> None:
+        self._serial = 1
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+            self._protocol = None
+
+    def set_timeout(self, timeout: float) -> None:
+        self._timeout = timeout
+
+    def get_timeout(self) -> float:
+        return self._timeout
+
+    def set_retry(self, retry: int) -> None:
+        raise NotImplementedError()
+
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        self._bcap_converter.set_compression_parameters(
+            enable, level, threshold, adaptive
+        )
+
+    def get_compression_statistics(self) -> dict:
+        return self._bcap_converter.get_compression_statistics()
+
+    def set_array_type(self, array_type: str) -> None:
+        self._bcap_converter.set_array_type(array_type)
+
+    async def request(self, func_id: int, args: list) -> any:
+        serial = self._serial
+        if self._serial >= 0xFFFF:
+            self._serial = 1
+        else:
+            self._serial += 1
+
+        protocol = self._protocol
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[serial] = future
+        try:
+            self._transport.write(
+                self._bcap_converter.serialize(serial, self._version, func_id, args)
+            )
+            (hr, deserialized_result) = await self._wait(protocol, serial, future)
+        finally:
+            protocol.pending.pop(serial, None)
+            protocol.keepalives.pop(serial, None)
+
+        return self._bcap_converter.create_response_object(hr, deserialized_result)
+
+    async def _wait(
+        self, protocol: _BCapTcpProtocol, serial: int, future: asyncio.Future
+    ) -> Tuple[int, any]:
+        # Like the blocking socket timeout, the timeout is restarted whenever
+        # the server reports S_EXECUTING for this request.
+        keepalives = 0
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=self._timeout)
+            if done:
+                return future.result()
+
+            if protocol.keepalives.get(serial, 0) == keepalives:
+                raise asyncio.TimeoutError()
+            keepalives = protocol.keepalives[serial]
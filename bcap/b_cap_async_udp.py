@@ -0,0 +1,160 @@
+import asyncio
+from typing import Tuple
+from .b_cap_exception import HResult, BCapException
+from .b_cap_converter import BCapConverter
+from .b_cap_async_tcp import fail_frame
+
+
+class _BCapUdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, bcap_converter: BCapConverter, address: Tuple[str, int]):
+        self._bcap_converter = bcap_converter
+        self._address = address
+        self.pending = {}
+        self.keepalives = {}
+
+    def connection_lost(self, exc: Exception) -> None:
+        if exc is None:
+            exc = ConnectionAbortedError("Disconnected.")
+
+        pending = self.pending
+        self.pending = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        if address[0] != self._address[0] or address[1] != self._address[1]:
+            return
+
+        try:
+            (
+                recv_serial,
+                version,
+                hr,
+                deserialized_args,
+            ) = self._bcap_converter.deserialize(data)
+        except Exception as e:
+            fail_frame(self.pending, data, e)
+            return
+
+        future = self.pending.get(recv_serial)
+        if future is None or future.done():
+            return
+
+        if hr == HResult.S_EXECUTING:
+            self.keepalives[recv_serial] = self.keepalives.get(recv_serial, 0) + 1
+            return
+
+        if deserialized_args is None:
+            future.set_result((hr, None))
+        else:
+            future.set_result((hr, deserialized_args[0]))
+
+
+class AsyncBCapUdp:
+
+    _RETRY_MIN = 1
+    _RETRY_MAX = 7
+    _MAX_PACKET_SIZE = 504
+
+    def __init__(self, should_return_hr: bool):
+        self._serial = 1
+        self._retry = 1
+        self._timeout = None
+        self._transport = None
+        self._protocol = None
+        self._bcap_converter = BCapConverter(False, should_return_hr)
+
+    async def connect(self, endpoint: str, timeout: float, retry: int) -> None:
+        try:
+            await self.disconnect()
+            address = BCapConverter.parse_endpoint(endpoint)
+            loop = asyncio.get_running_loop()
+            self._transport, self._protocol = await loop.create_datagram_endpoint(
+                lambda: _BCapUdpProtocol(self._bcap_converter, address),
+                remote_addr=address,
+            )
+            self.set_timeout(timeout)
+            self.set_retry(retry)
+        except Exception as e:
+            await self.disconnect()
+            raise e
+
+    async def disconnect(self) -> None:
+        self._serial = 1
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+            self._protocol = None
+
+    def set_timeout(self, timeout: float) -> None:
+        self._timeout = timeout
+
+    def get_timeout(self) -> float:
+        return self._timeout
+
+    def set_retry(self, retry: int) -> None:
+        if retry < AsyncBCapUdp._RETRY_MIN or retry > AsyncBCapUdp._RETRY_MAX:
+            raise ValueError()
+        self._retry = retry
+
+    def set_compression(self, enable: bool, level=-1, threshold=0, adaptive=False):
+        raise NotImplementedError()
+
+    def get_compression_statistics(self) -> dict:
+        raise NotImplementedError()
+
+    def set_array_type(self, array_type: str) -> None:
+        self._bcap_converter.set_array_type(array_type)
+
+    async def request(self, func_id: int, args: list) -> any:
+        serial = self._serial
+        if self._serial >= 0xFFFF:
+            self._serial = 1
+        else:
+            self._serial += 1
+
+        protocol = self._protocol
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[serial] = future
+        try:
+            # A retransmission reuses the serial number, so a late reply to an
+            # earlier attempt still completes the request.
+            retry_count = 0
+            keepalives = 0
+            self._send(serial, retry_count, func_id, args)
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=self._timeout)
+                if done:
+                    (hr, deserialized_result) = future.result()
+                    return self._bcap_converter.create_response_object(
+                        hr, deserialized_result
+                    )
+
+                if protocol.keepalives.get(serial, 0) != keepalives:
+                    # The server is still executing the request.
+                    keepalives = protocol.keepalives[serial]
+                    continue
+
+                retry_count += 1
+                if retry_count > self._retry:
+                    break
+                self._send(serial, retry_count, func_id, args)
+        finally:
+            protocol.pending.pop(serial, None)
+            protocol.keepalives.pop(serial, None)
+
+        raise BCapException(HResult.E_FAIL, "The number of retries has been exceeded.")
+
+    def _send(self, serial: int, retry: int, func_id: int, args: list) -> None:
+        serialized_packet = self._bcap_converter.serialize(serial, retry, func_id, args)
+        message_length = len(serialized_packet)
+        if message_length > AsyncBCapUdp._MAX_PACKET_SIZE:
+            raise BCapException(
+                HResult.E_INVALID_PACKET,
+                "Serialized packet size is {0} bytes. In the case of UDP, the maximum value is {1} bytes".format(
+                    message_length, AsyncBCapUdp._MAX_PACKET_SIZE
+                ),
+            )
+
+        self._transport.sendto(serialized_packet)
@@ -0,0 +1,338 @@
+import csv
+import io
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, Optional, Union
+from .b_cap_converter import BCapConverter
+from .b_cap_exception import HResult
+from .b_cap_functions import FUNCTION_NAMES
+from .b_cap_metrics import BCapMetrics, _Histogram
+from .b_cap_recorder import BCapRecorder
+
+# The columns of export_csv.
+# time : Seconds from the first record of the capture
+# latency : Seconds from the request to its response, on responses
+# value : The arguments of a request or the result of a response, as JSON
+_CSV_COLUMNS = (
+    "time",
+    "session",
+    "direction",
+    "serial",
+    "func_id",
+    "function",
+    "hr",
+    "latency",
+    "value",
+)
+
+# The columns of the index sent to the workers.
+_CHUNK_COLUMNS = (
+    "offsets",
+    "lengths",
+    "sessions",
+    "directions",
+    "serials",
+    "func_ids",
+    "hrs",
+    "latencies",
+)
+
+# i : Function ID of a request or return code of a response - 4bytes(int)
+_STRUCT_CODE = struct.Struct("<i")
+# Compressed bytes inflated to find the code of a compressed frame
+_CODE_INPUT_SIZE = 1024
+
+
+class BCapCapture:
+    # A capture written by BCapRecorder, memory-mapped and indexed by one
+    # scan. The index keeps a column per field of the frames, so a capture
+    # of millions of frames costs tens of bytes per frame, and decoding the
+    # arguments is fanned out to processes by ranges of the index.
+
+    # Frames decoded by a worker task
+    _CHUNK_SIZE = 50000
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self._path = os.fspath(path)
+        # Per session
+        self.protocols = []
+        self.endpoints = []
+        # Per frame
+        self.offsets = array("q")
+        self.lengths = array("I")
+        self.times = array("q")
+        self.sessions = array("I")
+        self.directions = array("B")
+        self.serials = array("H")
+        # The version, or on UDP the retry count
+        self.versions = array("H")
+        # The function ID of requests, of responses the function ID of the
+        # request they answer, or -1 if the request is not in the capture.
+        self.func_ids = array("i")
+        # The return code of responses, 0 on requests.
+        self.hrs = array("i")
+        # The nanoseconds from the request to the final response, -1 on
+        # requests and S_EXECUTING responses.
+        self.latencies = array("q")
+        self.dropped = 0
+        self._index()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get_latency_table(self) -> dict:
+        # Returns {function ID: summary} of the final responses with the
+        # function name, the number of calls, errors and keepalives, and the
+        # latency summary in seconds.
+        histograms = {}
+        entries = {}
+        for i in range(len(self.offsets)):
+            if self.directions[i] != BCapRecorder.RECEIVED:
+                continue
+
+            func_id = self.func_ids[i]
+            entry = entries.get(func_id)
+            if entry is None:
+                entry = {"calls": 0, "errors": 0, "keepalives": 0}
+                entries[func_id] = entry
+                histograms[func_id] = _Histogram()
+
+            if self.hrs[i] == HResult.S_EXECUTING:
+                entry["keepalives"] += 1
+                continue
+            entry["calls"] += 1
+            entry["errors"] += self.hrs[i] < 0
+            if self.latencies[i] >= 0:
+                histograms[func_id].record(self.latencies[i])
+
+        table = {}
+        for func_id, entry in sorted(entries.items()):
+            entry["name"] = FUNCTION_NAMES.get(func_id, "func_{}".format(func_id))
+            entry["latency"] = BCapMetrics._summarize(histograms[func_id])
+            table[func_id] = entry
+        return table
+
+    def decode(
+        self, start: int = 0, end: Optional[int] = None, workers: Optional[int] = None
+    ) -> list:
+        # Returns the decoded arguments of requests and results of responses
+        # of the frames from start to end, as JSON, in order. workers
+        # processes decode a chunk of the index each, or one per CPU if
+        # workers is None.
+        end = len(self.offsets) if end is None else min(end, len(self.offsets))
+        values = []
+        for chunk in self._map_chunks(_decode_chunk, start, end, workers):
+            values.extend(chunk)
+        return values
+
+    def export_csv(self, destination: any, workers: Optional[int] = None) -> int:
+        # Writes the frames with _CSV_COLUMNS to destination, a path or a
+        # text file object. Returns the number of rows. The workers format
+        # the rows too, so only the writes are left to this process.
+        if isinstance(destination, (str, os.PathLike)):
+            with open(destination, "w", encoding="utf-8", newline="") as f:
+                return self.export_csv(f, workers)
+
+        csv.writer(destination).writerow(_CSV_COLUMNS)
+        for text in self._map_chunks(_format_chunk, 0, len(self.offsets), workers):
+            destination.write(text)
+        return len(self.offsets)
+
+    def _map_chunks(
+        self, function: Callable, start: int, end: int, workers: Optional[int]
+    ) -> Iterator:
+        # A worker is sent the columns of its range of the index and maps the
+        # capture itself.
+        is_tcp = [protocol == "tcp" for protocol in self.protocols]
+        first = self.times[0] if self.times else 0
+        chunks = []
+        for i in range(start, end, BCapCapture._CHUNK_SIZE):
+            j = min(i + BCapCapture._CHUNK_SIZE, end)
+            columns = {
+                "is_tcp": array("B", (is_tcp[s] for s in self.sessions[i:j])),
+                "time": self.times[i:j],
+                "first": first,
+            }
+            for name in _CHUNK_COLUMNS:
+                columns[name] = getattr(self, name)[i:j]
+            chunks.append(columns)
+
+        if len(chunks) <= 1 or workers == 1:
+            for columns in chunks:
+                yield function(self._path, columns)
+            return
+
+        with ProcessPoolExecutor(workers) as executor:
+            yield from executor.map(function, [self._path] * len(chunks), chunks)
+
+    def _index(self) -> None:
+        with open(self._path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("Not a b-CAP capture.")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if m[: len(BCapRecorder.MAGIC)] != BCapRecorder.MAGIC:
+                    raise ValueError("Not a b-CAP capture.")
+                self._scan(m)
+        self._match()
+
+    def _scan(self, m: mmap.mmap) -> None:
+        unpack_record = BCapRecorder._STRUCT_RECORD.unpack_from
+        header_size = BCapRecorder._STRUCT_RECORD.size
+        unpack_header = BCapConverter._STRUCT_RECV_HEADER.unpack_from
+        body = BCapConverter._STRUCT_RECV_HEADER.size
+        unpack_code = _STRUCT_CODE.unpack_from
+        sessions = {}
+        is_tcp = []
+        size = len(m)
+        position = len(BCapRecorder.MAGIC)
+        while position + header_size <= size:
+            (record_type, session, timestamp, length) = unpack_record(m, position)
+            start = position + header_size
+            position = start + length
+            if position > size:
+                # A capture cut off while it was written ends here.
+                break
+
+            if record_type == BCapRecorder.SESSION:
+                (protocol, _, endpoint) = (
+                    m[start:position].decode("utf-8").partition(" ")
+                )
+                sessions[session] = len(self.protocols)
+                self.protocols.append(protocol)
+                self.endpoints.append(endpoint)
+                is_tcp.append(protocol == "tcp")
+                continue
+            elif record_type == BCapRecorder.DROPPED:
+                (dropped,) = BCapRecorder._STRUCT_DROPPED.unpack_from(m, start)
+                self.dropped += dropped
+                continue
+            elif session not in sessions or length < body + 4:
+                continue
+
+            index = sessions[session]
+            (_, _, serial, version) = unpack_header(m, start)
+            if is_tcp[index] and m[position - 2] == 1:
+                # The code is the first field of the compressed data, which
+                # comes after the uncompressed data length.
+                data = start + body + 4
+                code = _decompress_code(
+                    m[data : min(data + _CODE_INPUT_SIZE, position - 2)]
+                )
+            else:
+                (code,) = unpack_code(m, start + body)
+
+            self.offsets.append(start)
+            self.lengths.append(length)
+            self.times.append(timestamp)
+            self.sessions.append(index)
+            self.directions.append(record_type)
+            self.serials.append(serial)
+            self.versions.append(version)
+            self.func_ids.append(code if record_type == BCapRecorder.SENT else -1)
+            self.hrs.append(0 if record_type == BCapRecorder.SENT else code)
+
+    def _match(self) -> None:
+        # A response answers the last request of its session with its serial
+        # number. A retransmitted request keeps the time of the first one.
+        latencies = array("q", [-1]) * len(self.offsets)
+        waiting = {}
+        for i in range(len(self.offsets)):
+            key = (self.sessions[i], self.serials[i])
+            if self.directions[i] == BCapRecorder.SENT:
+                is_retry = (
+                    self.protocols[self.sessions[i]] == "udp" and self.versions[i] > 0
+                )
+                if not is_retry or key not in waiting:
+                    waiting[key] = i
+                continue
+
+            request = waiting.get(key)
+            if request is None:
+                continue
+            self.func_ids[i] = self.func_ids[request]
+            if self.hrs[i] != HResult.S_EXECUTING:
+                latencies[i] = self.times[i] - self.times[request]
+                del waiting[key]
+        self.latencies = latencies
+
+
+def _decompress_code(data: bytes) -> int:
+    try:
+        head = zlib.decompressobj().decompress(data, _STRUCT_CODE.size)
+        (code,) = _STRUCT_CODE.unpack(head)
+    except (zlib.error, struct.error):
+        return -1
+    return code
+
+
+def _decode_chunk(path: str, columns: dict) -> list:
+    # Runs in a worker process. Returns the arguments of requests and the
+    # result of responses as JSON, or the error of frames that can not be
+    # decoded.
+    converters = [BCapConverter(False, False), BCapConverter(True, False)]
+    values = []
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for offset, length, is_tcp, direction in zip(
+                columns["offsets"],
+                columns["lengths"],
+                columns["is_tcp"],
+                columns["directions"],
+            ):
+                try:
+                    (_, _, _, args) = converters[is_tcp].deserialize(
+                        m[offset : offset + length]
+                    )
+                    if direction == BCapRecorder.RECEIVED:
+                        args = args[0] if args else None
+                    values.append(json.dumps(args, default=_to_json))
+                except Exception as e:
+                    values.append(json.dumps({"error": str(e)}))
+    return values
+
+
+def _format_chunk(path: str, columns: dict) -> str:
+    # Runs in a worker process. Returns the CSV rows of the frames.
+    directions = {BCapRecorder.SENT: "sent", BCapRecorder.RECEIVED: "received"}
+    first = columns["first"]
+    stream = io.StringIO()
+    writer = csv.writer(stream)
+    for row in zip(
+        columns["time"],
+        columns["sessions"],
+        columns["directions"],
+        columns["serials"],
+        columns["func_ids"],
+        columns["hrs"],
+        columns["latencies"],
+        _decode_chunk(path, columns),
+    ):
+        (timestamp, session, direction, serial, func_id, hr, latency, value) = row
+        writer.writerow(
+            (
+                (timestamp - first) / 1e9,
+                session,
+                directions[direction],
+                serial,
+                func_id,
+                FUNCTION_NAMES.get(func_id, ""),
+                hr,
+                "" if latency < 0 else latency / 1e9,
+                value,
+            )
+        )
+    return stream.getvalue()
+
+
+def _to_json(value: any) -> any:
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    elif hasattr(value, "tolist"):
+        # array and numpy arrays
+        return value.tolist()
+    return str(value)
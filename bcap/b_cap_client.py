@@ -1,6 +1,11 @@
-from typing import Union, Optional
+from concurrent.futures import Future
+from typing import Callable, Union, Optional
 from .b_cap_tcp import BCapTcp
 from .b_cap_udp import BCapUdp
+from .b_cap_hybrid import BCapHybrid
+from .b_cap_metrics import BCapMetrics
+from .b_cap_prepared import BCapPreparedRequest
+from .b_cap_recorder import BCapRecorder
 
 
 class BCapClient:
@@ -10,6 +15,8 @@ class BCapClient:
             self._b_cap_socket = BCapTcp(should_return_hr)
         elif _protocol == "udp":
             self._b_cap_socket = BCapUdp(should_return_hr)
+        elif _protocol == "auto":
+            self._b_cap_socket = BCapHybrid(should_return_hr)
         else:
             raise NotImplementedError()
 
@@ -33,8 +40,57 @@ class BCapClient:
     def get_timeout(self) -> float:
         return self._b_cap_socket.get_timeout()
 
-    def set_compression(self, enable: bool, level: int = -1) -> None:
-        self._b_cap_socket.set_compression(enable, level)
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        self._b_cap_socket.set_compression(enable, level, threshold, adaptive)
+
+    def get_compression_statistics(self) -> dict:
+        return self._b_cap_socket.get_compression_statistics()
+
+    def set_array_type(self, array_type: str) -> None:
+        self._b_cap_socket.set_array_type(array_type)
+
+    def set_pipelining(self, enable: bool, window: int = 8) -> None:
+        self._b_cap_socket.set_pipelining(enable, window)
+
+    def set_metrics(self, metrics: Optional[BCapMetrics]) -> None:
+        # Requests are recorded to metrics, which may be shared by clients.
+        # None stops recording.
+        self._b_cap_socket.set_metrics(metrics)
+
+    def set_recorder(self, recorder: Optional[BCapRecorder]) -> None:
+        # The frames sent and received are recorded to recorder, which may be
+        # shared by clients. None stops recording.
+        self._b_cap_socket.set_recorder(recorder)
+
+    def set_max_message_size(self, size: Optional[int]) -> None:
+        self._b_cap_socket.set_max_message_size(size)
+
+    def get_retry_statistics(self) -> dict:
+        return self._b_cap_socket.get_retry_statistics()
+
+    def get_route_statistics(self) -> dict:
+        return self._b_cap_socket.get_route_statistics()
+
+    def submit(self, func_id: int, args: list) -> Future:
+        return self._b_cap_socket.submit(func_id, args)
+
+    def execute_many(self, requests: list) -> list:
+        return self._b_cap_socket.execute_many(requests)
+
+    def serialize_request(self, func_id: int, args: list) -> tuple:
+        # Returns the transport and the packet of the request, to be sent
+        # with transport.request_serialized(func_id, packet) after its
+        # argument values are patched in place.
+        return self._b_cap_socket.serialize_request(func_id, args)
+
+    def prepare(self, func_id: int, args_template: list) -> BCapPreparedRequest:
+        # Serializes a request once for calls with the same arguments. The
+        # arguments given as ... are slots, filled by the values passed to
+        # request of the returned object, as in
+        # prepare(64, [robot, "CurJnt", ...]).request(option).
+        return BCapPreparedRequest(self._b_cap_socket, func_id, args_template)
 
     def service_start(self, option="") -> Optional[int]:
         return self._b_cap_socket.request(1, [option])
@@ -207,6 +263,17 @@ class BCapClient:
     def file_put_value(self, handle: int, new_val) -> Optional[any]:
         return self._b_cap_socket.request(53, [handle, new_val])
 
+    def file_get_value_into(self, handle: int, sink: Callable[[any], None]) -> any:
+        return self._b_cap_socket.request_into(52, [handle], sink)
+
+    def file_put_value_from(
+        self,
+        handle: int,
+        buffer: any,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> Optional[any]:
+        return self._b_cap_socket.request_from(53, [handle], buffer, progress)
+
     def file_get_attribute(self, handle: int) -> any:
         return self._b_cap_socket.request(54, [handle])
 
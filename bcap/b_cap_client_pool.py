@@ -0,0 +1,214 @@
+import inspect
+import queue
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Optional
+from .b_cap_client import BCapClient
+from .b_cap_exception import BCapException, HResult
+from .b_cap_functions import GETTER_TO_RELEASE
+
+
+class _PooledSession:
+    def __init__(self, index: int):
+        self.index = index
+        self.client = None
+        self.handles = set()
+        self.last_used = time.monotonic()
+        self.is_broken = True
+
+
+class BCapPoolLease:
+    def __init__(self, pool: "BCapClientPool", session: _PooledSession):
+        self._pool = pool
+        self._session = session
+
+    @property
+    def session_index(self) -> int:
+        return self._session.index
+
+    def __getattr__(self, name: str) -> any:
+        if name.startswith("_") or name not in BCapClientPool._CLIENT_METHODS:
+            raise AttributeError(name)
+
+        session = self._session
+        if session is None:
+            raise RuntimeError("The lease has already been returned.")
+
+        method = getattr(session.client, name)
+
+        def call(*args, **kwargs):
+            if name in BCapClientPool._HANDLE_METHODS:
+                handle = args[0] if args else kwargs.get("handle")
+                if handle is not None:
+                    self._pool._check_owner(session, handle)
+            else:
+                handle = None
+
+            try:
+                result = method(*args, **kwargs)
+            except BCapException:
+                raise
+            except Exception:
+                # A transport error leaves the session in an unknown state, so
+                # it is reconnected before it is leased again.
+                session.is_broken = True
+                raise
+
+            if name in BCapClientPool._ACQUIRE_METHODS:
+                if isinstance(result, tuple):
+                    if result[0] >= 0:
+                        self._pool._add_owner(session, result[1])
+                else:
+                    self._pool._add_owner(session, result)
+            elif name in BCapClientPool._RELEASE_METHODS:
+                self._pool._remove_owner(session, handle)
+
+            return result
+
+        return call
+
+
+class BCapClientPool:
+
+    _CLIENT_METHODS = {
+        name
+        for name, _ in inspect.getmembers(BCapClient, inspect.isfunction)
+        if not name.startswith("_")
+        and name not in ("connect", "disconnect", "set_pipelining")
+    }
+
+    # Methods that take a handle as their first argument.
+    _HANDLE_METHODS = {
+        name
+        for name, function in inspect.getmembers(BCapClient, inspect.isfunction)
+        if list(inspect.signature(function).parameters)[1:2] == ["handle"]
+    }
+
+    _ACQUIRE_METHODS = {"controller_connect"} | set(GETTER_TO_RELEASE)
+
+    _RELEASE_METHODS = {"controller_disconnect"} | set(GETTER_TO_RELEASE.values())
+
+    def __init__(
+        self,
+        endpoint: str,
+        size: int,
+        timeout: float,
+        service_option: str = "",
+        should_return_hr: bool = False,
+        idle_time: float = 30.0,
+        health_check: Optional[Callable[[BCapClient], None]] = None,
+    ):
+        if size < 1:
+            raise ValueError()
+
+        self._endpoint = endpoint
+        self._timeout = timeout
+        self._service_option = service_option
+        self._should_return_hr = should_return_hr
+        self._idle_time = idle_time
+        # Sessions idle for idle_time are checked with health_check before
+        # they are leased, by default with a service_start round trip.
+        if health_check is None:
+            health_check = self._probe
+        self._health_check = health_check
+        self._lock = Lock()
+        self._sessions = [_PooledSession(index) for index in range(size)]
+        self._idle_sessions = queue.LifoQueue()
+        for session in self._sessions:
+            self._idle_sessions.put(session)
+
+    def connect(self) -> None:
+        for session in self._sessions:
+            self._reconnect(session)
+
+    def disconnect(self) -> None:
+        for session in self._sessions:
+            if session.client is not None:
+                session.client.disconnect()
+                session.client = None
+            with self._lock:
+                session.handles.clear()
+            session.is_broken = True
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        try:
+            session = self._idle_sessions.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No b-CAP session became available.")
+
+        try:
+            self._prepare(session)
+        except Exception:
+            session.is_broken = True
+            self._idle_sessions.put(session)
+            raise
+
+        lease = BCapPoolLease(self, session)
+        try:
+            yield lease
+        finally:
+            lease._session = None
+            session.last_used = time.monotonic()
+            self._idle_sessions.put(session)
+
+    def get_owner(self, handle: int) -> list:
+        with self._lock:
+            return [
+                session.index
+                for session in self._sessions
+                if handle in session.handles
+            ]
+
+    def _prepare(self, session: _PooledSession) -> None:
+        if not session.is_broken:
+            if time.monotonic() - session.last_used > self._idle_time:
+                try:
+                    self._health_check(session.client)
+                except Exception:
+                    session.is_broken = True
+
+        if session.is_broken:
+            self._reconnect(session)
+
+    def _probe(self, client: BCapClient) -> None:
+        # Starting the service again is the request every session of the pool
+        # is known to accept, and it changes nothing on the server.
+        result = client.service_start(self._service_option)
+        if self._should_return_hr and result[0] < 0:
+            raise BCapException(result[0])
+
+    def _reconnect(self, session: _PooledSession) -> None:
+        if session.client is not None:
+            session.client.disconnect()
+
+        # Handles of the old connection are meaningless on the new one.
+        with self._lock:
+            session.handles.clear()
+
+        session.client = BCapClient("tcp", self._should_return_hr)
+        session.client.connect(self._endpoint, self._timeout)
+        session.client.service_start(self._service_option)
+        session.is_broken = False
+        session.last_used = time.monotonic()
+
+    def _check_owner(self, session: _PooledSession, handle: int) -> None:
+        with self._lock:
+            if handle in session.handles:
+                return
+
+            for other in self._sessions:
+                if other is not session and handle in other.handles:
+                    raise BCapException(
+                        HResult.E_HANDLE,
+                        "Handle {} belongs to session {}.".format(handle, other.index),
+                    )
+
+    def _add_owner(self, session: _PooledSession, handle: int) -> None:
+        with self._lock:
+            session.handles.add(handle)
+
+    def _remove_owner(self, session: _PooledSession, handle: int) -> None:
+        with self._lock:
+            session.handles.discard(handle)
@@ -1,12 +1,21 @@
+import array
+import codecs
 import ctypes
-import io
 import struct
+import sys
+import time
 import zlib
 from datetime import datetime
-from typing import Union, Tuple
+from collections.abc import Sequence
+from typing import Callable, Optional, Union, Tuple
 from urllib.parse import urlsplit
 from .b_cap_exception import BCapException, HResult
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class VarType:
     VT_EMPTY = 0
@@ -63,6 +72,261 @@ class VarType:
     VT_TYPEMASK = 0x0FFF
 
 
+_IS_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _find_typecode(typecodes: str, itemsize: int) -> str:
+    # The item sizes of array.array are platform dependent, so pick the
+    # typecode that matches the b-CAP element size.
+    for typecode in typecodes:
+        if array.array(typecode).itemsize == itemsize:
+            return typecode
+
+    raise NotImplementedError()
+
+
+class _ArrayData(str):
+    # A pad format in a serialize plan that stands for the data of an array.
+    # struct only packs bytes objects, so the data is copied into the packet
+    # from the memory of the array after the rest is packed.
+    def __new__(cls, view: memoryview) -> "_ArrayData":
+        data = super().__new__(cls, "%dx" % len(view))
+        data.view = view
+        return data
+
+
+class _BufferReader:
+    # A minimal read-only stream over a memoryview. Unlike io.BytesIO it does
+    # not copy the buffer, and read() returns views into it.
+
+    def __init__(self, buffer: memoryview):
+        self._buffer = buffer
+        self._position = 0
+
+    def read(self, size: int) -> memoryview:
+        start = self._position
+        self._position += size
+        return self._buffer[start : self._position]
+
+    def readinto(self, buffer: any) -> int:
+        view = memoryview(buffer).cast("B")
+        data = self.read(len(view))
+        if len(data) < len(view):
+            # A frame shorter than its data fails as struct.unpack would.
+            raise struct.error(
+                "unpack requires a buffer of {} bytes".format(len(view))
+            )
+        view[:] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self._position = offset
+        elif whence == 1:
+            self._position += offset
+        else:
+            self._position = len(self._buffer) + offset
+
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+class _ChunkReader:
+    # A read-only stream over data that is pulled from a source one chunk at
+    # a time, only as far as it is read. It has the same interface as
+    # _BufferReader. source returns the next chunk, or an empty buffer at the
+    # end of the data, and a chunk may be reused by the source once the next
+    # one is requested.
+
+    def __init__(self, source: Callable[[], any]):
+        self._source = source
+        self._buffer = b""
+        self._offset = 0
+        self._position = 0
+
+    def read(self, size: int) -> any:
+        end = self._offset + size
+        if end <= len(self._buffer):
+            data = self._buffer[self._offset : end]
+            self._offset = end
+            self._position += size
+            return data
+
+        data = bytearray(size)
+        self.readinto(data)
+        return bytes(data)
+
+    def readinto(self, buffer: any) -> int:
+        view = memoryview(buffer).cast("B")
+        position = 0
+
+        def write(chunk: any) -> None:
+            nonlocal position
+            view[position : position + len(chunk)] = chunk
+            position += len(chunk)
+
+        self.copy_to(write, len(view))
+        return len(view)
+
+    def copy_to(self, sink: Callable[[any], None], size: int) -> None:
+        # Passes the next size bytes to sink chunk by chunk without joining
+        # them. A chunk is only valid during the call.
+        written = min(len(self._buffer) - self._offset, size)
+        if written > 0:
+            sink(self._buffer[self._offset : self._offset + written])
+        self._offset += written
+        while written < size:
+            self._buffer = self._next()
+            self._offset = min(len(self._buffer), size - written)
+            if self._offset > 0:
+                sink(self._buffer[: self._offset])
+            written += self._offset
+
+        self._position += size
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # Only forward seeks are supported, as the data is read once.
+        if whence == 0:
+            offset -= self._position
+        elif whence != 1 or offset < 0:
+            raise ValueError()
+
+        self.read(offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        # No data may follow what has been read.
+        if self._offset < len(self._buffer) or self._source():
+            raise ValueError("The stream has extra data.")
+
+    def _next(self) -> any:
+        data = self._source()
+        if not data:
+            raise EOFError("The stream is truncated.")
+        return data
+
+
+class _InflateReader(_ChunkReader):
+    # A _ChunkReader over zlib data, decompressed only as far as it is read.
+
+    # Upper bound of the data decompressed at once.
+    _CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, source: Callable[[], any]):
+        super().__init__(source)
+        self._decompressor = zlib.decompressobj()
+
+    def close(self) -> None:
+        # The end of the zlib stream is read, so its checksum is verified, and
+        # no data may follow it.
+        while not self._decompressor.eof:
+            if self._next():
+                raise ValueError("The zlib stream has extra data.")
+
+        if self._decompressor.unused_data:
+            raise ValueError("The zlib stream has extra data.")
+        super().close()
+
+    def _next(self) -> bytes:
+        decompressor = self._decompressor
+        data = decompressor.unconsumed_tail
+        if not data:
+            if decompressor.eof:
+                raise EOFError("The zlib stream has ended.")
+            data = super()._next()
+
+        return decompressor.decompress(data, _InflateReader._CHUNK_SIZE)
+
+
+class BCapArrayView(Sequence):
+    # A read-only sequence over an array in a received frame, returned when
+    # the array type is "view". An element is decoded on its first access and
+    # kept, and nested arrays are views too. to_list converts the whole array
+    # to the objects returned when the array type is "list", with bytes in
+    # place of memoryview.
+
+    def __init__(
+        self,
+        converter: "BCapConverter",
+        buffer: memoryview,
+        offset: int,
+        var_type: int,
+        number_of_elements: int,
+    ):
+        self._converter = converter
+        self._buffer = buffer
+        self._var_type = var_type
+        self._length = number_of_elements
+        self._values = None
+        if var_type in (VarType.VT_VARIANT, VarType.VT_BSTR):
+            # The elements have variable sizes, so their offsets are found one
+            # after another, only as far as they are accessed.
+            self._offsets = [offset]
+            self._element_size = None
+        else:
+            self._offsets = None
+            self._offset = offset
+            self._element_size = BCapConverter._DICT_VT_TO_TYPE[var_type][1]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice]) -> any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("BCapArrayView index out of range")
+
+        if self._values is None:
+            self._values = [BCapArrayView._NOT_DECODED] * self._length
+        value = self._values[index]
+        if value is BCapArrayView._NOT_DECODED:
+            value = self._decode(index)
+            self._values[index] = value
+
+        return value
+
+    def __repr__(self) -> str:
+        return "BCapArrayView({!r})".format(self.to_list())
+
+    def to_list(self) -> list:
+        return [BCapArrayView._to_object(e) for e in self]
+
+    def _decode(self, index: int) -> any:
+        stream = _BufferReader(self._buffer)
+        if self._element_size is not None:
+            stream.seek(self._offset + index * self._element_size)
+            return self._converter._deserialize_element(stream, self._var_type)
+
+        offsets = self._offsets
+        while len(offsets) <= index:
+            offsets.append(
+                BCapConverter._skip_element(self._buffer, offsets[-1], self._var_type)
+            )
+        stream.seek(offsets[index])
+        if self._var_type == VarType.VT_VARIANT:
+            return self._converter._deserialize_args(stream)
+        return self._converter._deserialize_element(stream, self._var_type)
+
+    @staticmethod
+    def _to_object(value: any) -> any:
+        if isinstance(value, BCapArrayView):
+            return value.to_list()
+        elif isinstance(value, memoryview):
+            return value.tobytes()
+        return value
+
+    _NOT_DECODED = object()
+
+
 class BCapConverter:
     BCAP_SOH = b"\x01"
     BCAP_EOT = b"\x04"
@@ -91,6 +355,100 @@ class BCapConverter:
         ctypes.c_wchar_p: (VarType.VT_BSTR, "I%ds", True),
     }
 
+    _DICT_VT_TO_SIZE = {
+        VarType.VT_I2: 2,
+        VarType.VT_I4: 4,
+        VarType.VT_R4: 4,
+        VarType.VT_R8: 8,
+        VarType.VT_DATE: 8,
+        VarType.VT_BOOL: 2,
+        VarType.VT_UI1: 1,
+        VarType.VT_UI2: 2,
+        VarType.VT_UI4: 4,
+        VarType.VT_I8: 8,
+        VarType.VT_UI8: 8,
+    }
+
+    _DICT_VT_TO_TYPECODE = {
+        VarType.VT_I2: _find_typecode("h", 2),
+        VarType.VT_I4: _find_typecode("il", 4),
+        VarType.VT_R4: _find_typecode("f", 4),
+        VarType.VT_R8: _find_typecode("d", 8),
+        VarType.VT_CY: _find_typecode("qli", 8),
+        VarType.VT_DATE: _find_typecode("d", 8),
+        VarType.VT_ERROR: _find_typecode("il", 4),
+        VarType.VT_BOOL: _find_typecode("h", 2),
+        VarType.VT_UI2: _find_typecode("H", 2),
+        VarType.VT_UI4: _find_typecode("IL", 4),
+        VarType.VT_I8: _find_typecode("qli", 8),
+        VarType.VT_UI8: _find_typecode("QLI", 8),
+    }
+
+    _DICT_TYPECODE_TO_VT = {
+        typecode: var_type
+        for (typecode, var_type) in (
+            (_find_typecode("h", 2), VarType.VT_I2),
+            (_find_typecode("il", 4), VarType.VT_I4),
+            (_find_typecode("qli", 8), VarType.VT_I8),
+            (_find_typecode("B", 1), VarType.VT_UI1),
+            (_find_typecode("H", 2), VarType.VT_UI2),
+            (_find_typecode("IL", 4), VarType.VT_UI4),
+            (_find_typecode("QLI", 8), VarType.VT_UI8),
+            (_find_typecode("f", 4), VarType.VT_R4),
+            (_find_typecode("d", 8), VarType.VT_R8),
+        )
+    }
+
+    _DICT_VT_TO_DTYPE = {
+        VarType.VT_I2: "<i2",
+        VarType.VT_I4: "<i4",
+        VarType.VT_R4: "<f4",
+        VarType.VT_R8: "<f8",
+        VarType.VT_CY: "<i8",
+        VarType.VT_ERROR: "<i4",
+        VarType.VT_BOOL: "<i2",
+        VarType.VT_UI2: "<u2",
+        VarType.VT_UI4: "<u4",
+        VarType.VT_I8: "<i8",
+        VarType.VT_UI8: "<u8",
+    }
+
+    _DICT_DTYPE_TO_VT = {
+        ("i", 2): VarType.VT_I2,
+        ("i", 4): VarType.VT_I4,
+        ("i", 8): VarType.VT_I8,
+        ("u", 1): VarType.VT_UI1,
+        ("u", 2): VarType.VT_UI2,
+        ("u", 4): VarType.VT_UI4,
+        ("u", 8): VarType.VT_UI8,
+        ("f", 4): VarType.VT_R4,
+        ("f", 8): VarType.VT_R8,
+    }
+
+    _SOH = BCAP_SOH[0]
+    _EOT = BCAP_EOT[0]
+    # SOH and message length
+    _FRAME_HEADER_SIZE = 1 + 4
+    # Header, serial, version, return code, number of args and EOT
+    _MIN_MESSAGE_SIZE = 1 + 4 + 2 + 2 + 4 + 2 + 1
+    _STRUCT_LENGTH = struct.Struct("<I")
+    _STRUCT_RECV_HEADER = struct.Struct("<bIHH")
+    _STRUCT_FUNC_INFO = struct.Struct("<iH")
+    _STRUCT_ARG_TYPE = struct.Struct("<HI")
+
+    # Compiled packet layouts keyed by their struct format.
+    _STRUCT_CACHE = {}
+    _STRUCT_CACHE_SIZE = 256
+
+    # In adaptive mode compression is skipped while the compressed body is
+    # larger than this ratio of the uncompressed body.
+    _COMPRESS_POOR_RATIO = 0.9
+    # In adaptive mode one in this many skipped bodies is compressed to check
+    # whether the data became compressible.
+    _COMPRESS_PROBE_INTERVAL = 32
+    # Weight of the latest ratio in its exponential moving average.
+    _COMPRESS_RATIO_ALPHA = 0.25
+
     _DICT_VT_TO_TYPE = {
         VarType.VT_I2: ("h", 2),
         VarType.VT_I4: ("i", 4),
@@ -141,145 +499,394 @@ class BCapConverter:
         self._should_return_hr = should_return_hr
         self._is_comress = False
         self._compress_level = -1
+        self._compress_threshold = 0
+        self._is_adaptive_compress = False
+        self._compressors = {}
+        self._compress_ratio = None
+        self._compress_skipped = 0
+        self._compress_statistics = {
+            "packets": 0,
+            "compressed": 0,
+            "skipped": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "time": 0.0,
+        }
+        self._array_type = "list"
+        # Whether the plan being serialized has _ArrayData
+        self._has_array_data = False
 
-    def set_compression_parameters(self, is_compress: bool, level=-1) -> None:
-        self._is_comress = is_compress
-        if level < -1 or level > 9:
+    def set_compression_parameters(
+        self, is_compress: bool, level=-1, threshold=0, adaptive=False
+    ) -> None:
+        if level < -1 or level > 9 or threshold < 0:
             raise ValueError()
 
+        self._is_comress = is_compress
         self._compress_level = level
+        self._compress_threshold = threshold
+        self._is_adaptive_compress = adaptive
+        self._compressors = {}
+        self._compress_ratio = None
+        self._compress_skipped = 0
 
-    def serialize(
-        self, serial: int, version_or_retry: int, func_id: int, args: any
-    ) -> bytes:
+    def get_compression_statistics(self) -> dict:
+        statistics = dict(self._compress_statistics)
+        statistics["bytes_saved"] = statistics["bytes_in"] - statistics["bytes_out"]
+        statistics["ratio"] = self._compress_ratio
+        return statistics
 
-        stream = io.BytesIO()
+    def set_array_type(self, array_type: str) -> None:
+        # "view" returns arrays as BCapArrayView and byte arrays as memoryview,
+        # decoding elements only when they are accessed.
+        if array_type not in ("list", "array", "numpy", "view"):
+            raise ValueError()
 
-        # b : Header - 1byte(signed char)
-        stream.write(BCapConverter.BCAP_SOH)
+        if array_type == "numpy" and numpy is None:
+            raise ImportError("numpy is not installed.")
+
+        self._array_type = array_type
+
+    def serialize(
+        self, serial: int, version_or_retry: int, func_id: int, args: any
+    ) -> bytearray:
 
+        # The whole packet is described by one struct format and one list of
+        # values, so it is packed in a single pass into a preallocated buffer
+        # and no length has to be patched afterwards.
         # < : Use little endian at b-CAP.
-        # I : Message length(calculate later) - 4bytes(unsigned int)
+        # b : Header - 1byte(signed char)
+        # I : Message length - 4bytes(unsigned int)
         # H : Serial number - 2bytes(unsigned short)
         # h : Version(TCP) or retry(UDP) - 2bytes(short)
-        stream.write(
-            struct.pack(
-                "<IHh",
-                0,
-                serial,
-                version_or_retry,
-            )
-        )
+        formats = ["<BIHh"]
+        values = [1, 0, serial, version_or_retry]
+        self._has_array_data = False
 
+        compressed_data = None
         if self._is_comress and self._is_tcp:
-            func_info_and_arg_stream = io.BytesIO()
-            self._serialize_func_info_and_arg(func_info_and_arg_stream, func_id, args)
-            uncompressed_data_length = func_info_and_arg_stream.tell()
-            compressed_data = zlib.compress(
-                func_info_and_arg_stream.getvalue(), self._compress_level
+            body_formats = ["<"]
+            body_values = []
+            body_length = self._plan_func_info_and_arg(
+                body_formats, body_values, func_id, args
             )
-            # I : Uncompressed data length - 4bytes(unsigned int)
-            stream.write(struct.pack("<I", uncompressed_data_length))
-            stream.write(compressed_data)
+            if self._should_compress(body_length):
+                body = bytearray(body_length)
+                BCapConverter._get_struct("".join(body_formats)).pack_into(
+                    body, 0, *body_values
+                )
+                if self._has_array_data:
+                    BCapConverter._copy_array_data(body_formats, body)
+                compressed_data = self._compress(body)
+
+            if compressed_data is None:
+                # The mode byte is per packet, so this one is sent as is.
+                formats.extend(body_formats[1:])
+                values.extend(body_values)
+            else:
+                # I : Uncompressed data length - 4bytes(unsigned int)
+                formats.append("I%ds" % len(compressed_data))
+                values.append(body_length)
+                values.append(compressed_data)
         else:
-            self._serialize_func_info_and_arg(stream, func_id, args)
+            self._plan_func_info_and_arg(formats, values, func_id, args)
 
         if self._is_tcp:
             # b : Mode - 1byte(signed char)
-            if self._is_comress is True:
-                stream.write(b"\x01")
+            formats.append("B")
+            if compressed_data is not None:
+                values.append(1)
             else:
-                stream.write(b"\x00")
-        else:
-            pass
+                values.append(0)
 
         # b : Footer - 1byte(signed char)
-        stream.write(BCapConverter.BCAP_EOT)
+        formats.append("B")
+        values.append(4)
 
-        packet_length = stream.tell()
-        stream.seek(1)
-        stream.write(struct.pack("<I", packet_length))
+        packer = BCapConverter._get_struct("".join(formats))
+        values[1] = packer.size
+        packet = bytearray(packer.size)
+        packer.pack_into(packet, 0, *values)
+        if self._has_array_data:
+            BCapConverter._copy_array_data(formats, packet)
 
-        return stream.getvalue()
+        return packet
 
-    def _serialize_func_info_and_arg(
-        self, stream: io.BytesIO, func_id: int, args: any
-    ) -> None:
+    def serialize_with_payload(
+        self,
+        serial: int,
+        version_or_retry: int,
+        func_id: int,
+        args: any,
+        payload_length: int,
+    ) -> Tuple[bytearray, bytes]:
+
+        # Serializes a packet whose last argument is a byte array of
+        # payload_length bytes, without the payload itself. The packet is
+        # the returned head, the payload and the returned tail, so a large
+        # payload can be sent from its own buffer without being copied. The
+        # packet is never compressed.
+        formats = ["<BIHh"]
+        values = [1, 0, serial, version_or_retry]
+        self._has_array_data = False
+        index = len(values) + 1
+        self._plan_func_info_and_arg(formats, values, func_id, args)
+        values[index] += 1
+
+        # I : Argument length(without itself) - 4bytes(unsigned int)
+        # H : Variant type - 2bytes(unsigned short)
+        # I : The number of elements - 4bytes(unsigned int)
+        formats.append("IHI")
+        values.append(2 + 4 + payload_length)
+        values.append(VarType.VT_ARRAY | VarType.VT_UI1)
+        values.append(payload_length)
+
+        if self._is_tcp:
+            # b : Mode - 1byte(signed char)
+            # b : Footer - 1byte(signed char)
+            tail = b"\x00\x04"
+        else:
+            # b : Footer - 1byte(signed char)
+            tail = BCapConverter.BCAP_EOT
+
+        packer = BCapConverter._get_struct("".join(formats))
+        values[1] = packer.size + payload_length + len(tail)
+        head = bytearray(packer.size)
+        packer.pack_into(head, 0, *values)
+        if self._has_array_data:
+            BCapConverter._copy_array_data(formats, head)
+
+        return (head, tail)
+
+    def _should_compress(self, body_length: int) -> bool:
+        statistics = self._compress_statistics
+        statistics["packets"] += 1
+        if body_length < self._compress_threshold:
+            statistics["skipped"] += 1
+            return False
+
+        if (
+            self._is_adaptive_compress
+            and self._compress_ratio is not None
+            and self._compress_ratio > BCapConverter._COMPRESS_POOR_RATIO
+        ):
+            self._compress_skipped += 1
+            if self._compress_skipped < BCapConverter._COMPRESS_PROBE_INTERVAL:
+                statistics["skipped"] += 1
+                return False
+            self._compress_skipped = 0
+
+        return True
+
+    def _compress(self, body: bytearray) -> Optional[bytes]:
+        # Setting up a deflate state costs more than compressing a small body,
+        # and most of it is proportional to the window and the hash table. A
+        # window just large enough for the body compresses as well as the
+        # default one, and any inflater accepts it. One compressor per window
+        # size is kept as a template and copied for each body.
+        started = time.perf_counter()
+        body_length = len(body)
+        window_bits = min(max((body_length - 1).bit_length(), 9), 15)
+        compressor = self._compressors.get(window_bits)
+        if compressor is None:
+            compressor = zlib.compressobj(
+                self._compress_level, zlib.DEFLATED, window_bits, window_bits - 7
+            )
+            self._compressors[window_bits] = compressor
+
+        compressor = compressor.copy()
+        compressed_data = compressor.compress(body) + compressor.flush()
+
+        # The uncompressed data length is sent along with the compressed body.
+        compressed_length = 4 + len(compressed_data)
+        ratio = compressed_length / body_length
+        if self._compress_ratio is None:
+            self._compress_ratio = ratio
+        else:
+            self._compress_ratio += BCapConverter._COMPRESS_RATIO_ALPHA * (
+                ratio - self._compress_ratio
+            )
+
+        statistics = self._compress_statistics
+        statistics["time"] += time.perf_counter() - started
+        if self._is_adaptive_compress and compressed_length >= body_length:
+            statistics["skipped"] += 1
+            return None
+
+        statistics["compressed"] += 1
+        statistics["bytes_in"] += body_length
+        statistics["bytes_out"] += compressed_length
+        return compressed_data
+
+    @staticmethod
+    def _copy_array_data(formats: list, buffer: bytearray) -> None:
+        # formats starts with the byte order, so there is no padding and the
+        # offset of each _ArrayData is the size of the formats before it.
+        # The data is copied through a view, since assigning anything but a
+        # bytearray to a slice of a bytearray copies it first.
+        offset = 0
+        start = 0
+        with memoryview(buffer) as view:
+            for index, format in enumerate(formats):
+                if type(format) is _ArrayData:
+                    offset += struct.calcsize(
+                        "<" + "".join(formats[start:index]).lstrip("<")
+                    )
+                    view[offset : offset + len(format.view)] = format.view
+                    offset += len(format.view)
+                    start = index + 1
+
+    @staticmethod
+    def _get_struct(format: str) -> struct.Struct:
+        packer = BCapConverter._STRUCT_CACHE.get(format)
+        if packer is None:
+            if len(BCapConverter._STRUCT_CACHE) >= BCapConverter._STRUCT_CACHE_SIZE:
+                BCapConverter._STRUCT_CACHE.clear()
+            packer = struct.Struct(format)
+            BCapConverter._STRUCT_CACHE[format] = packer
+
+        return packer
+
+    def _plan_func_info_and_arg(
+        self, formats: list, values: list, func_id: int, args: any
+    ) -> int:
 
         # i : Function ID or Return code - 4bytes(int)
         # H : Number of Args - 2bytes(unsigned short)
-        stream.write(
-            struct.pack(
-                "<iH",
-                func_id,
-                len(args),
-            )
-        )
+        formats.append("iH")
+        values.append(func_id)
+        values.append(len(args))
+        size = 4 + 2
 
         for arg in args:
-            start_arg_pos = stream.tell()
-            # Prepare an area to write the following data length (argument length)
+            # I : Argument length(without itself) - 4bytes(unsigned int)
             # 1. Data type
             # 2. The number of elements
             # 3. Data
-            stream.write(b"\0\0\0\0")
-            self._serialize_arg(stream, arg)
-            end_arg_pos = stream.tell()
-            # Write the length without the argument length
-            stream.seek(start_arg_pos)
-            stream.write(struct.pack("<I", end_arg_pos - start_arg_pos - 4))
-            # Move to end
-            stream.seek(0, 2)
+            arg_type = type(arg)
+            if arg_type is int:
+                formats.append("IHIi")
+                values.extend((2 + 4 + 4, VarType.VT_I4, 1, arg))
+                size += 4 + 2 + 4 + 4
+            elif arg_type is str:
+                vnt_str = arg.encode("utf-16le")
+                str_length = len(vnt_str)
+                formats.append("IHII%ds" % str_length)
+                values.extend(
+                    (2 + 4 + 4 + str_length, VarType.VT_BSTR, 1, str_length, vnt_str)
+                )
+                size += 4 + 2 + 4 + 4 + str_length
+            elif arg is None:
+                formats.append("IHI")
+                values.extend((2 + 4, VarType.VT_EMPTY, 1))
+                size += 4 + 2 + 4
+            else:
+                formats.append("I")
+                index = len(values)
+                values.append(0)
+                arg_length = self._plan_arg(formats, values, arg)
+                values[index] = arg_length
+                size += 4 + arg_length
+
+        return size
 
-    def _serialize_arg(self, stream: io.BytesIO, arg: any) -> None:
+    def _plan_arg(self, formats: list, values: list, arg: any) -> int:
 
+        # H : Variant type - 2bytes(unsigned short)
+        # I : The number of elements - 4bytes(unsigned int)
         if arg is None:
-            stream.write(struct.pack("<HI", VarType.VT_EMPTY, 1))
+            formats.append("HI")
+            values.append(VarType.VT_EMPTY)
+            values.append(1)
+            return 2 + 4
         elif isinstance(arg, (list, tuple)):
             # Array(without bytes array)
             len_arg = len(arg)
             if len_arg == 0:
-                stream.write(struct.pack("<HI", VarType.VT_EMPTY, 1))
-            else:
-                arg_type = type(arg[0])
-                is_vnt_array = all(arg_type is type(x) for x in arg) is False
-
-                if is_vnt_array:
-                    # Variant array
-                    stream.write(
-                        struct.pack(
-                            "<HI", VarType.VT_VARIANT | VarType.VT_ARRAY, len_arg
-                        )
-                    )
-                    for e in arg:
-                        self._serialize_arg(stream, e)
-                elif arg_type in BCapConverter._DICT_TYPE_TO_VT:
-                    (var_type, format_char, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[
-                        arg_type
-                    ]
-                    stream.write(
-                        struct.pack("<HI", var_type | VarType.VT_ARRAY, len_arg)
-                    )
+                formats.append("HI")
+                values.append(VarType.VT_EMPTY)
+                values.append(1)
+                return 2 + 4
+
+            arg_type = type(arg[0])
+            is_vnt_array = all(arg_type is type(x) for x in arg) is False
+
+            if is_vnt_array:
+                # Variant array
+                formats.append("HI")
+                values.append(VarType.VT_VARIANT | VarType.VT_ARRAY)
+                values.append(len_arg)
+                size = 2 + 4
+                for e in arg:
+                    size += self._plan_arg(formats, values, e)
+                return size
+            elif arg_type in BCapConverter._DICT_TYPE_TO_VT:
+                (var_type, format_char, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[
+                    arg_type
+                ]
+                formats.append("HI")
+                values.append(var_type | VarType.VT_ARRAY)
+                values.append(len_arg)
+                size = 2 + 4
+                if var_type == VarType.VT_BSTR:
                     for e in arg:
-                        self._serialize_element(
-                            stream, var_type, format_char, is_ctype, e
+                        size += self._plan_element(
+                            formats, values, var_type, format_char, is_ctype, e
                         )
+                    return size
+
+                # Fixed size elements are packed as one run of the same format.
+                formats.append("%d%s" % (len_arg, format_char))
+                if var_type == VarType.VT_BOOL:
+                    values.extend([-1 if e else 0 for e in arg])
+                elif var_type == VarType.VT_DATE:
+                    values.extend([BCapConverter.datetime_to_vnt_date(e) for e in arg])
+                elif is_ctype:
+                    values.extend([e.value for e in arg])
                 else:
-                    raise BCapException(
-                        HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
-                        "Failed to serialize arguments.",
-                    )
+                    values.extend(arg)
+                return size + len_arg * BCapConverter._DICT_VT_TO_SIZE[var_type]
+            else:
+                raise BCapException(
+                    HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+                    "Failed to serialize arguments.",
+                )
         elif isinstance(arg, (bytes, bytearray)):
             # Array(bytes array)
             len_arg = len(arg)
-            stream.write(
-                struct.pack(
-                    "<HI%ds" % len_arg,
-                    VarType.VT_ARRAY | VarType.VT_UI1,
-                    len_arg,
-                    arg,
+            formats.append("HI%ds" % len_arg)
+            values.append(VarType.VT_ARRAY | VarType.VT_UI1)
+            values.append(len_arg)
+            values.append(arg)
+            return 2 + 4 + len_arg
+        elif numpy is not None and isinstance(arg, numpy.ndarray):
+            # Array(numpy.ndarray)
+            return self._plan_ndarray(formats, values, arg)
+        elif isinstance(arg, array.array):
+            # Array(array.array)
+            if arg.typecode not in BCapConverter._DICT_TYPECODE_TO_VT:
+                raise BCapException(
+                    HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+                    "Failed to serialize arguments.",
                 )
+
+            len_arg = len(arg)
+            if len_arg == 0:
+                formats.append("HI")
+                values.append(VarType.VT_EMPTY)
+                values.append(1)
+                return 2 + 4
+
+            if _IS_BIG_ENDIAN:
+                arg = array.array(arg.typecode, arg)
+                arg.byteswap()
+
+            formats.append("HI")
+            values.append(
+                BCapConverter._DICT_TYPECODE_TO_VT[arg.typecode] | VarType.VT_ARRAY
             )
+            values.append(len_arg)
+            return 2 + 4 + self._plan_array_data(formats, memoryview(arg))
         else:
             # Not array
             arg_type = type(arg)
@@ -287,123 +894,410 @@ class BCapConverter:
                 (var_type, format_char, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[
                     arg_type
                 ]
-                stream.write(struct.pack("<HI", var_type, 1))
-                self._serialize_element(stream, var_type, format_char, is_ctype, arg)
+                formats.append("HI")
+                values.append(var_type)
+                values.append(1)
+                return (
+                    2
+                    + 4
+                    + self._plan_element(
+                        formats, values, var_type, format_char, is_ctype, arg
+                    )
+                )
             else:
                 raise BCapException(
                     HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
                     "Failed to serialize arguments.",
                 )
 
-    def _serialize_element(
-        self, stream: io.BytesIO, var_type: int, format_char: str, is_ctype: bool, value
-    ) -> None:
-        if var_type == VarType.VT_DATE:
-            vnt_date = BCapConverter.datetime_to_vnt_date(value)
-            stream.write(struct.pack("<" + format_char, vnt_date))
-        elif var_type == VarType.VT_BSTR:
+    def _plan_ndarray(self, formats: list, values: list, arg: any) -> int:
+
+        var_type = BCapConverter._DICT_DTYPE_TO_VT.get(
+            (arg.dtype.kind, arg.dtype.itemsize)
+        )
+        if var_type is None or arg.ndim != 1:
+            raise BCapException(
+                HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+                "Failed to serialize arguments.",
+            )
+
+        len_arg = len(arg)
+        if len_arg == 0:
+            formats.append("HI")
+            values.append(VarType.VT_EMPTY)
+            values.append(1)
+            return 2 + 4
+
+        # Only non-contiguous or big endian arrays are copied before packing.
+        dtype = arg.dtype.newbyteorder("<")
+        if arg.dtype != dtype or not arg.flags.c_contiguous:
+            arg = numpy.ascontiguousarray(arg, dtype=dtype)
+        formats.append("HI")
+        values.append(var_type | VarType.VT_ARRAY)
+        values.append(len_arg)
+        return 2 + 4 + self._plan_array_data(formats, memoryview(arg.view(numpy.uint8)))
+
+    def _plan_array_data(self, formats: list, view: memoryview) -> int:
+        data = _ArrayData(view.cast("B"))
+        formats.append(data)
+        self._has_array_data = True
+        return len(data.view)
+
+    def _plan_element(
+        self,
+        formats: list,
+        values: list,
+        var_type: int,
+        format_char: str,
+        is_ctype: bool,
+        value,
+    ) -> int:
+        if var_type == VarType.VT_BSTR:
             if is_ctype:
                 vnt_str = value.value.encode("utf-16le")
             else:
                 vnt_str = value.encode("utf-16le")
 
             str_length = len(vnt_str)
-            stream.write(
-                struct.pack("<" + (format_char % str_length), str_length, vnt_str)
-            )
+            formats.append(format_char % str_length)
+            values.append(str_length)
+            values.append(vnt_str)
+            return 4 + str_length
+
+        formats.append(format_char)
+        if var_type == VarType.VT_DATE:
+            values.append(BCapConverter.datetime_to_vnt_date(value))
         elif var_type == VarType.VT_BOOL:
             if value:
-                stream.write(struct.pack("<" + format_char, -1))
+                values.append(-1)
             else:
-                stream.write(struct.pack("<" + format_char, 0))
+                values.append(0)
+        elif is_ctype:
+            values.append(value.value)
         else:
-            if is_ctype:
-                stream.write(struct.pack("<" + format_char, value.value))
-            else:
-                stream.write(struct.pack("<" + format_char, value))
+            values.append(value)
+
+        return BCapConverter._DICT_VT_TO_SIZE[var_type]
+
+    def calc_packet_size(self, args: any) -> int:
+        # Size of the uncompressed packet serialize() would produce, computed
+        # from the lengths of the arguments without encoding them.
+        # Header, message length, serial, version or retry, function ID,
+        # number of args and footer
+        size = 1 + 4 + 2 + 2 + 4 + 2 + 1
+        if self._is_tcp:
+            # Mode
+            size += 1
+
+        for arg in args:
+            # Argument length
+            size += 4 + self._calc_arg_size(arg)
+
+        return size
+
+    def _calc_arg_size(self, arg: any) -> int:
+
+        # Variant type and the number of elements
+        size = 2 + 4
+        arg_type = type(arg)
+        if arg_type is int:
+            return size + 4
+        elif arg_type is str:
+            return size + 4 + BCapConverter._calc_bstr_size(arg)
+        elif arg is None:
+            return size
+        elif isinstance(arg, (list, tuple)):
+            if not arg:
+                return size
+
+            arg_type = type(arg[0])
+            if all(arg_type is type(x) for x in arg) is False:
+                # Variant array
+                return size + sum(self._calc_arg_size(e) for e in arg)
+            elif arg_type in BCapConverter._DICT_TYPE_TO_VT:
+                (var_type, _, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[arg_type]
+                if var_type == VarType.VT_BSTR:
+                    if is_ctype:
+                        arg = [e.value for e in arg]
+                    return size + sum(
+                        4 + BCapConverter._calc_bstr_size(e) for e in arg
+                    )
+                return size + len(arg) * BCapConverter._DICT_VT_TO_SIZE[var_type]
+        elif isinstance(arg, (bytes, bytearray)):
+            return size + len(arg)
+        elif numpy is not None and isinstance(arg, numpy.ndarray):
+            return size + arg.nbytes
+        elif isinstance(arg, array.array):
+            return size + len(arg) * arg.itemsize
+        elif arg_type in BCapConverter._DICT_TYPE_TO_VT:
+            (var_type, _, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[arg_type]
+            if var_type == VarType.VT_BSTR:
+                if is_ctype:
+                    arg = arg.value
+                return size + 4 + BCapConverter._calc_bstr_size(arg)
+            return size + BCapConverter._DICT_VT_TO_SIZE[var_type]
+
+        raise BCapException(
+            HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+            "Failed to serialize arguments.",
+        )
+
+    @staticmethod
+    def _calc_bstr_size(value: str) -> int:
+        # UTF-16 takes 2 bytes per character, except surrogate pairs.
+        if value.isascii():
+            return 2 * len(value)
+        return len(value.encode("utf-16le"))
+
+    @staticmethod
+    def peek_serial(frame: any) -> Optional[int]:
+        # Returns the serial number in the header of a frame that may not be
+        # deserializable, or None if the frame is too short to hold one.
+        if len(frame) < BCapConverter._STRUCT_RECV_HEADER.size:
+            return None
+        return BCapConverter._STRUCT_RECV_HEADER.unpack_from(frame)[2]
+
+    @staticmethod
+    def extract_frames(buffer: bytearray) -> list:
+        # Cut every complete frame off the head of a TCP stream buffer.
+        # Incomplete data stays in the buffer for the next call.
+        frames = []
+        while len(buffer) >= BCapConverter._FRAME_HEADER_SIZE:
+            if buffer[0] != BCapConverter._SOH:
+                # Can not receive b-CAP SOH. Skip to the next SOH candidate.
+                index = buffer.find(BCapConverter.BCAP_SOH, 1)
+                if index < 0:
+                    index = len(buffer)
+                del buffer[:index]
+                continue
+
+            # Receive b-CAP message length.
+            (message_length,) = BCapConverter._STRUCT_LENGTH.unpack_from(buffer, 1)
+            if message_length < BCapConverter._MIN_MESSAGE_SIZE:
+                del buffer[:1]
+                continue
+
+            if len(buffer) < message_length:
+                break
+
+            if buffer[message_length - 1] != BCapConverter._EOT:
+                # Can not receive b-CAP EOT.
+                del buffer[:1]
+                continue
+
+            frames.append(bytes(buffer[:message_length]))
+            del buffer[:message_length]
+
+        return frames
 
     def deserialize(self, byte_array: bytes) -> Tuple[int, int, int, list]:
 
+        # The frame is parsed through a memoryview, so a frame handed over as
+        # a view of a receive buffer is not copied before it is decoded.
+        view = memoryview(byte_array)
+
         # < : Use little endian at b-CAP.
         # b : Header - 1byte(signed char)
-        # I : Message length(calculate later) - 4bytes(unsigned int)
+        # I : Message length - 4bytes(unsigned int)
         # H : Serial number - 2bytes(unsigned short)
         # H : Version(TCP) or retry(UDP) - 2bytes(unsigned short)
-        format = "<bIHH"
+        (
+            soh,
+            _,
+            serial,
+            version_or_retry,
+        ) = BCapConverter._STRUCT_RECV_HEADER.unpack_from(view)
+        header_length = BCapConverter._STRUCT_RECV_HEADER.size
+
         if self._is_tcp:
-            mode = byte_array[-2]
-            if len(byte_array) == 16:
-                # %ds : Function information and arguments
+            mode = view[-2]
+            if len(view) == 16:
+                # Function information and arguments
                 # b : Footer - 1byte(signed char)
-                format += "%dsb" % (len(byte_array) - (1 + 4 + 2 + 2 + 1))
-                (
-                    soh,
-                    message_length,
-                    serial,
-                    version_or_retry,
-                    function_info_and_arg,
-                    eot,
-                ) = struct.unpack(format, byte_array)
+                function_info_and_arg = view[header_length:-1]
             else:
-                # %ds : Function information and arguments
-                # b : Footer - 1byte(signed char)
+                # Function information and arguments
                 # b : Mode - 1byte(signed char)
-                format += "%ds2b" % (len(byte_array) - (1 + 4 + 2 + 2 + 1 + 1))
-                (
-                    soh,
-                    message_length,
-                    serial,
-                    version_or_retry,
-                    function_info_and_arg,
-                    mode,
-                    eot,
-                ) = struct.unpack(format, byte_array)
+                # b : Footer - 1byte(signed char)
+                function_info_and_arg = view[header_length:-2]
 
             if mode == 1:
-                # _ is the length of uncompressed data. This is not used.
-                _, compressed_data = struct.unpack(
-                    "<I%ds" % (len(function_info_and_arg) - 4), function_info_and_arg
+                # The first 4 bytes are the length of uncompressed data.
+                # This is not used.
+                function_info_and_arg = memoryview(
+                    zlib.decompress(function_info_and_arg[4:])
                 )
-                function_info_and_arg = zlib.decompress(compressed_data)
-            else:
-                pass
         else:
+            # Function information and arguments
             # b : Footer - 1byte(signed char)
-            format += "%dsb" % (len(byte_array) - (1 + 4 + 2 + 2 + 1))
-            (
-                soh,
-                _,
-                serial,
-                version_or_retry,
-                function_info_and_arg,
-                eot,
-            ) = struct.unpack(format, byte_array)
+            function_info_and_arg = view[header_length:-1]
+
+        if self._array_type == "view" and not isinstance(
+            function_info_and_arg.obj, bytes
+        ):
+            # Views outlive the frame, which may be a reused receive buffer.
+            function_info_and_arg = memoryview(bytes(function_info_and_arg))
+
+        hr, deserialized_args = self._deserialize_func_info_and_arg(
+            _BufferReader(function_info_and_arg)
+        )
+
+        return (serial, version_or_retry, hr, deserialized_args)
+
+    @staticmethod
+    def is_compressed_stream(buffer: any, offset: int) -> bool:
+        # Whether the body of a TCP frame starting at offset looks like the
+        # uncompressed data length followed by a zlib header. The mode byte
+        # comes at the end of the frame, so this is only a guess until the
+        # whole frame is received.
+        # CMF : Compression method 8 (deflate) with a window of up to 32KiB
+        # FLG : Check bits, without a preset dictionary
+        cmf = buffer[offset + 4]
+        flg = buffer[offset + 5]
+        return (
+            (cmf & 0x0F) == 8
+            and (cmf >> 4) <= 7
+            and (cmf * 256 + flg) % 31 == 0
+            and (flg & 0x20) == 0
+        )
+
+    def deserialize_compressed_stream(
+        self,
+        serial: int,
+        version_or_retry: int,
+        source: Callable[[], any],
+    ) -> Tuple[int, int, int, list]:
+
+        # The compressed body is pulled from source chunk by chunk, and the
+        # arguments are parsed from the decompressed data as it is produced,
+        # so the whole decompressed body is never held at once. source
+        # returns the compressed data after the uncompressed data length, and
+        # an empty buffer at the end of the body.
+        if self._array_type == "view":
+            # Views refer to the decompressed body, so it is kept as a whole.
+            decompressor = zlib.decompressobj()
+            body = b"".join(decompressor.decompress(c) for c in iter(source, b""))
+            body += decompressor.flush()
+            hr, deserialized_args = self._deserialize_func_info_and_arg(
+                _BufferReader(memoryview(body))
+            )
+            return (serial, version_or_retry, hr, deserialized_args)
+
+        stream = _InflateReader(source)
+        hr, deserialized_args = self._deserialize_func_info_and_arg(stream)
+        stream.close()
+
+        return (serial, version_or_retry, hr, deserialized_args)
+
+    def deserialize_into(
+        self,
+        source: Callable[[], any],
+        is_compressed: bool,
+        sink: Callable[[any], None],
+    ) -> Tuple[int, list]:
+
+        # Parses the function information and arguments of a TCP frame pulled
+        # from source, like deserialize_compressed_stream. If the first
+        # argument is a byte array or a string, its data is passed to sink
+        # chunk by chunk instead, and its length in bytes is returned in its
+        # place. sink receives memoryviews of bytes, or str for a string.
+        if is_compressed:
+            stream = _InflateReader(source)
+        else:
+            stream = _ChunkReader(source)
 
         # i : Return code - 4bytes(int)
         # H : Number of Args - 2bytes(unsigned short)
-        format = "<iH%ds" % (len(function_info_and_arg) - (4 + 2))
-        hr, number_of_args, args = struct.unpack(format, function_info_and_arg)
+        hr, number_of_args = BCapConverter._STRUCT_FUNC_INFO.unpack(
+            stream.read(BCapConverter._STRUCT_FUNC_INFO.size)
+        )
 
         deserialized_args = None
         if number_of_args > 0:
-            stream = io.BytesIO(args)
             deserialized_args = []
             for i in range(number_of_args):
                 # The length of argument data. This is not used.
                 stream.seek(4, 1)
-                deserialized_args.append(self._deserialize_args(stream))
+                # H : Variant type - 2bytes(unsigned short)
+                # I : The number of elements - 4bytes(unsigned int)
+                var_type, number_of_elements = struct.unpack(
+                    "<HI", stream.read(2 + 4)
+                )
+                if i == 0 and var_type == VarType.VT_ARRAY | VarType.VT_UI1:
+                    stream.copy_to(sink, number_of_elements)
+                    deserialized_args.append(number_of_elements)
+                elif i == 0 and var_type == VarType.VT_BSTR:
+                    (str_length,) = struct.unpack("<I", stream.read(4))
+                    # A chunk may end in the middle of a character.
+                    decoder = codecs.getincrementaldecoder("utf-16le")()
+                    stream.copy_to(
+                        lambda chunk: sink(decoder.decode(chunk)), str_length
+                    )
+                    decoder.decode(b"", True)
+                    deserialized_args.append(str_length)
+                else:
+                    deserialized_args.append(
+                        self._deserialize_value(stream, var_type, number_of_elements)
+                    )
 
-        return (serial, version_or_retry, hr, deserialized_args)
+        stream.close()
+
+        return (hr, deserialized_args)
+
+    def _deserialize_func_info_and_arg(self, stream: any) -> Tuple[int, list]:
+
+        # i : Return code - 4bytes(int)
+        # H : Number of Args - 2bytes(unsigned short)
+        hr, number_of_args = BCapConverter._STRUCT_FUNC_INFO.unpack(
+            stream.read(BCapConverter._STRUCT_FUNC_INFO.size)
+        )
 
-    def _deserialize_args(self, stream: io.BytesIO) -> any:
+        deserialized_args = None
+        if number_of_args > 0:
+            deserialized_args = []
+            for i in range(number_of_args):
+                # The length of argument data. This is only used to skip a view.
+                (arg_length,) = BCapConverter._STRUCT_LENGTH.unpack(stream.read(4))
+                arg_start = stream.tell()
+                deserialized_arg = self._deserialize_args(stream)
+                if isinstance(deserialized_arg, BCapArrayView):
+                    stream.seek(arg_start + arg_length)
+                deserialized_args.append(deserialized_arg)
+
+        return (hr, deserialized_args)
+
+    def _deserialize_args(self, stream: _BufferReader) -> any:
 
         # H : Variant type - 2bytes(unsigned short)
         # I : The number of elements - 4bytes(unsigned int)
         var_type, number_of_elements = struct.unpack("<HI", stream.read(2 + 4))
+        return self._deserialize_value(stream, var_type, number_of_elements)
+
+    def _deserialize_value(
+        self, stream: _BufferReader, var_type: int, number_of_elements: int
+    ) -> any:
+
         deserialized_args = None
         if (var_type & VarType.VT_ARRAY) != 0:
             # Array
             var_type = var_type ^ VarType.VT_ARRAY
+            if self._array_type == "view" and isinstance(stream, _BufferReader):
+                if var_type == VarType.VT_UI1:
+                    return stream.read(number_of_elements)
+                elif (
+                    var_type == VarType.VT_VARIANT
+                    or var_type in BCapConverter._DICT_VT_TO_TYPE
+                ):
+                    # The stream is left at the start of the array, and the
+                    # caller skips it.
+                    return BCapArrayView(
+                        self,
+                        stream._buffer,
+                        stream.tell(),
+                        var_type,
+                        number_of_elements,
+                    )
+
             if var_type == VarType.VT_VARIANT:
                 # Variant array
                 deserialized_array = []
@@ -412,8 +1306,11 @@ class BCapConverter:
                 deserialized_args = deserialized_array
             elif var_type == VarType.VT_UI1:
                 # Bytes array
-                (deserialized_args,) = struct.unpack(
-                    "<%ds" % number_of_elements, stream.read(number_of_elements)
+                deserialized_args = bytes(stream.read(number_of_elements))
+            elif var_type in BCapConverter._DICT_VT_TO_TYPECODE:
+                # Fixed size array
+                deserialized_args = self._deserialize_fixed_size_array(
+                    stream, var_type, number_of_elements
                 )
             elif var_type in BCapConverter._DICT_VT_TO_TYPE:
                 # Other array
@@ -442,7 +1339,73 @@ class BCapConverter:
 
         return deserialized_args
 
-    def _deserialize_element(self, stream: io.BytesIO, var_type) -> any:
+    @staticmethod
+    def _skip_element(buffer: memoryview, offset: int, var_type: int) -> int:
+        # Returns the offset after an element of a variant or string array.
+        if var_type == VarType.VT_BSTR:
+            (str_length,) = BCapConverter._STRUCT_LENGTH.unpack_from(buffer, offset)
+            return offset + 4 + str_length
+
+        var_type, number_of_elements = BCapConverter._STRUCT_ARG_TYPE.unpack_from(
+            buffer, offset
+        )
+        offset += BCapConverter._STRUCT_ARG_TYPE.size
+        if (var_type & VarType.VT_ARRAY) != 0:
+            var_type = var_type ^ VarType.VT_ARRAY
+            if var_type in (VarType.VT_VARIANT, VarType.VT_BSTR):
+                for i in range(number_of_elements):
+                    offset = BCapConverter._skip_element(buffer, offset, var_type)
+                return offset
+            elif var_type in BCapConverter._DICT_VT_TO_TYPE:
+                return (
+                    offset
+                    + BCapConverter._DICT_VT_TO_TYPE[var_type][1] * number_of_elements
+                )
+        elif var_type in [VarType.VT_EMPTY, VarType.VT_NULL]:
+            return offset
+        elif var_type == VarType.VT_BSTR:
+            return BCapConverter._skip_element(buffer, offset, var_type)
+        elif var_type in BCapConverter._DICT_VT_TO_TYPE:
+            return offset + BCapConverter._DICT_VT_TO_TYPE[var_type][1]
+
+        raise BCapException(
+            HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+            "Failed to deserialize arguments.",
+        )
+
+    def _deserialize_fixed_size_array(
+        self, stream: _BufferReader, var_type: int, number_of_elements: int
+    ) -> any:
+
+        if self._array_type == "numpy" and var_type != VarType.VT_DATE:
+            deserialized_array = numpy.empty(
+                number_of_elements, BCapConverter._DICT_VT_TO_DTYPE[var_type]
+            )
+            stream.readinto(deserialized_array)
+            if var_type == VarType.VT_BOOL:
+                return deserialized_array != 0
+            return deserialized_array
+
+        # The array is allocated first and filled in place, so no intermediate
+        # bytes object of the same size is created.
+        deserialized_array = (
+            array.array(BCapConverter._DICT_VT_TO_TYPECODE[var_type], [0])
+            * number_of_elements
+        )
+        stream.readinto(deserialized_array)
+        if _IS_BIG_ENDIAN:
+            deserialized_array.byteswap()
+
+        if var_type == VarType.VT_BOOL:
+            return [e != 0 for e in deserialized_array]
+        elif var_type == VarType.VT_DATE:
+            return [BCapConverter.vnt_date_to_datetime(e) for e in deserialized_array]
+        elif self._array_type == "array":
+            return deserialized_array
+        else:
+            return deserialized_array.tolist()
+
+    def _deserialize_element(self, stream: _BufferReader, var_type) -> any:
 
         format_char, value_length = BCapConverter._DICT_VT_TO_TYPE[var_type]
         deserialized_element = None
@@ -473,3 +1436,11 @@ class BCapConverter:
             raise BCapException(hr)
 
         return deserialized_result
+
+    def create_batch_response_object(self, hr, deserialized_result) -> any:
+        # In a batch one failed item must not hide the results of the others,
+        # so the exception is returned in place of the result.
+        try:
+            return self.create_response_object(hr, deserialized_result)
+        except BCapException as e:
+            return e
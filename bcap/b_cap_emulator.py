@@ -0,0 +1,535 @@
+import asyncio
+import random
+import struct
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+from .b_cap_converter import BCapConverter
+from .b_cap_exception import HResult, BCapException
+from .b_cap_functions import FUNCTION_NAMES, GETTER_NAME_PATTERN
+from .b_cap_udp import BCapUdp
+
+
+class _EmulatedObject:
+    def __init__(self, kind: str, name: str, path: str):
+        self.kind = kind
+        self.name = name
+        # The path identifies the object behind every handle to it, e.g.
+        # "Controller0/Arm0/I1", and keys its state.
+        self.path = path
+        self.tag = None
+        self.id = 0
+
+
+class _EmulatorTcpProtocol(asyncio.Protocol):
+    def __init__(self, emulator: "BCapEmulator"):
+        self._emulator = emulator
+        self._recv_buffer = bytearray()
+        self._transport = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        self._emulator._connection_made(self)
+
+    def connection_lost(self, exc: Exception) -> None:
+        self._emulator._connection_lost(self)
+
+    def data_received(self, data: bytes) -> None:
+        self._recv_buffer += data
+        for frame in BCapConverter.extract_frames(self._recv_buffer):
+            self._emulator._frame_received(frame, True, self.send)
+
+    def send(self, packet: bytes) -> None:
+        if not self._transport.is_closing():
+            self._transport.write(packet)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class _EmulatorUdpProtocol(asyncio.DatagramProtocol):
+    # The number of replies kept to answer retransmitted requests
+    _MAX_REPLIES = 1024
+    # H : Serial number - 2bytes(unsigned short)
+    # H : Retry - 2bytes(unsigned short)
+    _STRUCT_SERIAL_RETRY = struct.Struct("<HH")
+
+    def __init__(self, emulator: "BCapEmulator"):
+        self._emulator = emulator
+        self._transport = None
+        # {(address, serial): last reply, or None while it is executed}
+        self._replies = OrderedDict()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        if len(data) < 1 + 4 + _EmulatorUdpProtocol._STRUCT_SERIAL_RETRY.size:
+            self._emulator._frame_received(data, False, lambda packet: None)
+            return
+
+        (serial, retry) = _EmulatorUdpProtocol._STRUCT_SERIAL_RETRY.unpack_from(
+            data, 1 + 4
+        )
+        key = (address, serial)
+        if retry > 0 and key in self._replies:
+            # A retransmission of a request already received is answered with
+            # the reply to it, as a controller does, instead of running again.
+            reply = self._replies[key]
+            if reply is not None:
+                self._send(reply, address)
+            return
+
+        self._replies[key] = None
+        self._replies.move_to_end(key)
+        if len(self._replies) > _EmulatorUdpProtocol._MAX_REPLIES:
+            self._replies.popitem(last=False)
+        if not self._emulator._frame_received(
+            data,
+            False,
+            lambda packet: self._send(packet, address),
+            lambda packet: self._keep(key, packet),
+        ):
+            # The request was dropped or invalid, so it is run when it is sent
+            # again.
+            self._replies.pop(key, None)
+
+    def _keep(self, key: tuple, packet: bytes) -> None:
+        if key in self._replies:
+            self._replies[key] = packet
+
+    def _send(self, packet: bytes, address: tuple) -> None:
+        if not self._transport.is_closing():
+            self._transport.sendto(packet, address)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class BCapEmulator:
+    # A b-CAP server that keeps controllers, robots, variables and files in
+    # memory, to run clients without a controller. It serves TCP and UDP on
+    # the same port from one thread, so many clients can be connected at
+    # once, and can delay, drop and keep alive the responses of each
+    # function to emulate a network and a busy controller.
+
+    _ROBOT_NAMES = ["Arm0"]
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, seed=None):
+        self._host = host
+        self._port = port
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._udp = None
+        self._connections = set()
+        self._tcp_converter = BCapConverter(True, False)
+        self._udp_converter = BCapConverter(False, False)
+        self._profiles = {None: BCapEmulator._default_profile()}
+        self._objects = {}
+        self._next_handle = 1
+        self._values = {"variable": {}, "file": {}}
+        self._robots = {}
+        self._statistics = {
+            "connections": 0,
+            "requests": 0,
+            "responses": 0,
+            "errors": 0,
+            "keepalives": 0,
+            "dropped": 0,
+            "invalid": 0,
+        }
+
+    def __enter__(self) -> "BCapEmulator":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        ready = Event()
+        error = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(
+            target=self._run, args=(ready, error), name="BCapEmulator", daemon=True
+        )
+        self._thread.start()
+        ready.wait()
+        if error:
+            self._thread.join()
+            self._thread = None
+            raise error[0]
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def get_endpoint(self) -> str:
+        return "{}:{}".format(self._host, self._port)
+
+    def set_latency(
+        self, latency: float, jitter: float = 0.0, func_id: Optional[int] = None
+    ) -> None:
+        # Responses are delayed by latency plus a uniform random time up to
+        # jitter. func_id None sets the default of all functions.
+        if latency < 0 or jitter < 0:
+            raise ValueError()
+
+        self._set_profile(func_id, latency=latency, jitter=jitter)
+
+    def set_loss(self, rate: float, func_id: Optional[int] = None) -> None:
+        # Each UDP request and response is dropped with the probability rate.
+        if rate < 0 or rate > 1:
+            raise ValueError()
+
+        self._set_profile(func_id, loss=rate)
+
+    def set_executing(
+        self, duration: float, interval: float = 0.1, func_id: Optional[int] = None
+    ) -> None:
+        # Requests take duration to execute, during which S_EXECUTING is sent
+        # every interval, starting right away.
+        if duration < 0 or interval <= 0:
+            raise ValueError()
+
+        self._set_profile(func_id, executing=duration, interval=interval)
+
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0
+    ) -> None:
+        # Compresses the TCP responses.
+        self._tcp_converter.set_compression_parameters(enable, level, threshold)
+
+    def set_variable(self, path: str, value: any) -> None:
+        # Sets the value of the variable at path, such as "Controller0/I1".
+        with self._lock:
+            self._values["variable"][path] = value
+
+    def get_variable(self, path: str) -> any:
+        with self._lock:
+            return self._values["variable"].get(path)
+
+    def set_file(self, path: str, value: any) -> None:
+        # Sets the contents of the file at path, such as
+        # "Controller0/Program.pcs", as a string or bytes.
+        with self._lock:
+            self._values["file"][path] = value
+
+    def get_file(self, path: str) -> any:
+        with self._lock:
+            return self._values["file"].get(path)
+
+    def get_statistics(self) -> dict:
+        with self._lock:
+            statistics = dict(self._statistics)
+            statistics["handles"] = len(self._objects)
+            return statistics
+
+    def _run(self, ready: Event, error: list) -> None:
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                self._loop.create_server(
+                    lambda: _EmulatorTcpProtocol(self), self._host, self._port
+                )
+            )
+            self._port = self._server.sockets[0].getsockname()[1]
+            (_, self._udp) = self._loop.run_until_complete(
+                self._loop.create_datagram_endpoint(
+                    lambda: _EmulatorUdpProtocol(self),
+                    local_addr=(self._host, self._port),
+                )
+            )
+        except Exception as e:
+            error.append(e)
+            self._close()
+            ready.set()
+            return
+
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._close()
+
+    def _close(self) -> None:
+        for connection in list(self._connections):
+            connection.close()
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
+        if self._server is not None:
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._server = None
+        self._loop.close()
+
+    def _connection_made(self, connection: _EmulatorTcpProtocol) -> None:
+        self._connections.add(connection)
+        with self._lock:
+            self._statistics["connections"] += 1
+
+    def _connection_lost(self, connection: _EmulatorTcpProtocol) -> None:
+        self._connections.discard(connection)
+
+    @staticmethod
+    def _default_profile() -> dict:
+        return {
+            "latency": 0.0,
+            "jitter": 0.0,
+            "loss": 0.0,
+            "executing": 0.0,
+            "interval": 0.1,
+        }
+
+    def _set_profile(self, func_id: Optional[int], **settings) -> None:
+        with self._lock:
+            if func_id is None:
+                self._profiles[None].update(settings)
+            else:
+                profile = self._profiles.get(func_id, {})
+                profile.update(settings)
+                self._profiles[func_id] = profile
+
+    def _get_profile(self, func_id: int) -> dict:
+        with self._lock:
+            profile = dict(self._profiles[None])
+            profile.update(self._profiles.get(func_id, {}))
+            return profile
+
+    def _is_lost(self, profile: dict, is_tcp: bool) -> bool:
+        if is_tcp or profile["loss"] <= 0 or self._random.random() >= profile["loss"]:
+            return False
+
+        with self._lock:
+            self._statistics["dropped"] += 1
+        return True
+
+    def _frame_received(
+        self,
+        frame: bytes,
+        is_tcp: bool,
+        send: Callable[[bytes], None],
+        keep: Optional[Callable[[bytes], None]] = None,
+    ) -> bool:
+        # keep is given every response, even one that is then dropped. Returns
+        # whether the request was accepted, that is, neither invalid nor
+        # dropped.
+        converter = self._tcp_converter if is_tcp else self._udp_converter
+        try:
+            # The function ID of a request is where a response has the result.
+            (serial, version, func_id, args) = converter.deserialize(frame)
+        except Exception:
+            with self._lock:
+                self._statistics["invalid"] += 1
+            return False
+
+        profile = self._get_profile(func_id)
+        if self._is_lost(profile, is_tcp):
+            return False
+
+        with self._lock:
+            self._statistics["requests"] += 1
+
+        def respond(hr: int, result: any = None) -> None:
+            packet = converter.serialize(
+                serial, version, hr, [] if result is None else [result]
+            )
+            if not is_tcp and len(packet) > BCapUdp._MAX_PACKET_SIZE:
+                # The controller answers with an error when the response does
+                # not fit in a datagram.
+                packet = converter.serialize(
+                    serial, version, HResult.E_INVALID_PACKET, []
+                )
+            if keep is not None:
+                keep(packet)
+            if self._is_lost(profile, is_tcp):
+                return
+            send(packet)
+
+        def keepalive() -> None:
+            with self._lock:
+                self._statistics["keepalives"] += 1
+            respond(HResult.S_EXECUTING)
+
+        def complete() -> None:
+            try:
+                (hr, result) = (0, self._execute(func_id, args or []))
+            except BCapException as e:
+                (hr, result) = (e.hr, None)
+            except Exception:
+                (hr, result) = (HResult.E_FAIL, None)
+
+            with self._lock:
+                self._statistics["responses"] += 1
+                if hr < 0:
+                    self._statistics["errors"] += 1
+            respond(hr, result)
+
+        delay = profile["latency"]
+        if profile["jitter"] > 0:
+            delay += self._random.uniform(0, profile["jitter"])
+
+        elapsed = 0.0
+        while elapsed < profile["executing"]:
+            self._loop.call_later(delay + elapsed, keepalive)
+            elapsed += profile["interval"]
+
+        if delay + profile["executing"] > 0:
+            self._loop.call_later(delay + profile["executing"], complete)
+        else:
+            complete()
+        return True
+
+    def _execute(self, func_id: int, args: list) -> any:
+        name = FUNCTION_NAMES.get(func_id)
+        if name is None:
+            raise BCapException(HResult.E_NOTIMPL, "Not implemented.")
+
+        if name in ("service_start", "service_stop"):
+            return None
+        elif name == "controller_connect":
+            return self._add_object("controller", args[0], args[0])
+
+        with self._lock:
+            obj = self._objects.get(args[0]) if args else None
+        if obj is None:
+            raise BCapException(HResult.E_HANDLE, "Invalid handle.")
+
+        match = GETTER_NAME_PATTERN.match(name)
+        if match is not None:
+            kind = match.group(2)
+            return self._add_object(kind, args[1], obj.path + "/" + args[1])
+        elif name == "controller_disconnect" or name.endswith("_release"):
+            with self._lock:
+                del self._objects[args[0]]
+            return None
+        elif name.endswith("_names"):
+            return self._get_names(obj, name.split("_")[-2])
+        elif name.endswith("_get_name"):
+            return obj.name
+        elif name.endswith("_get_tag"):
+            return obj.tag
+        elif name.endswith("_put_tag"):
+            obj.tag = args[1]
+            return None
+        elif name.endswith("_get_id"):
+            return obj.id
+        elif name.endswith("_put_id"):
+            obj.id = args[1]
+            return None
+        elif name.endswith("_get_attribute"):
+            return 0
+        elif name.endswith("_get_help"):
+            return ""
+        elif name in ("variable_get_value", "file_get_value"):
+            return self._get_value(obj)
+        elif name in ("variable_put_value", "file_put_value"):
+            with self._lock:
+                self._values[obj.kind][obj.path] = args[1]
+            return None
+        elif name == "variable_get_date_time" or name.startswith("file_get_date_"):
+            return datetime.now()
+        elif name == "variable_get_microsecond":
+            return int(time.time() * 1e6) % 1000000
+        elif name == "file_get_size":
+            value = self._get_value(obj)
+            if isinstance(value, str):
+                return len(value.encode("utf-8"))
+            return 0 if value is None else len(value)
+        elif name == "file_get_type":
+            return "File"
+        elif name == "file_get_path":
+            return obj.path.split("/", 1)[-1]
+        elif name == "robot_execute":
+            return self._robot_execute(obj, args[1], args[2])
+        elif name == "robot_move":
+            self._robot_move(obj, args[2])
+            return None
+
+        # Other functions only take effect on a controller.
+        return None
+
+    def _add_object(self, kind: str, name: str, path: str) -> int:
+        with self._lock:
+            handle = self._next_handle
+            self._next_handle = handle % 0x7FFFFFFF + 1
+            self._objects[handle] = _EmulatedObject(kind, name, path)
+            return handle
+
+    def _get_names(self, obj: _EmulatedObject, kind: str) -> list:
+        if kind == "robot":
+            return list(BCapEmulator._ROBOT_NAMES)
+
+        # The variables or files that have a value under the object.
+        prefix = obj.path + "/"
+        with self._lock:
+            return sorted(
+                path[len(prefix) :]
+                for path in self._values.get(kind, {})
+                if path.startswith(prefix) and "/" not in path[len(prefix) :]
+            )
+
+    def _get_value(self, obj: _EmulatedObject) -> any:
+        with self._lock:
+            values = self._values.get(obj.kind, {})
+            if obj.path in values:
+                return values[obj.path]
+
+        # Variables of the controller language are 0 until they are put.
+        if obj.kind == "variable":
+            prefix = obj.name[:1].upper()
+            if prefix == "I":
+                return 0
+            elif prefix in ("F", "D"):
+                return 0.0
+            elif prefix == "S":
+                return ""
+            elif prefix in ("P", "J", "T", "V"):
+                return [0.0] * {"P": 7, "J": 8, "T": 10, "V": 3}[prefix]
+        elif obj.kind == "file":
+            return ""
+        return None
+
+    def _get_robot(self, obj: _EmulatedObject) -> dict:
+        with self._lock:
+            robot = self._robots.get(obj.path)
+            if robot is None:
+                robot = {"joints": [0.0] * 8, "position": [0.0] * 7}
+                self._robots[obj.path] = robot
+            return robot
+
+    def _robot_execute(self, obj: _EmulatedObject, command: str, param: any) -> any:
+        robot = self._get_robot(obj)
+        if command == "CurJnt":
+            return list(robot["joints"])
+        elif command in ("CurPos", "CurTrn"):
+            return list(robot["position"])
+        return None
+
+    def _robot_move(self, obj: _EmulatedObject, pose: any) -> None:
+        # The pose is a list of values, optionally with its type and option
+        # as in [[0, 45, 90, 0, 45, 0], "J", "@P"].
+        if isinstance(pose, list) and pose and isinstance(pose[0], list):
+            (values, pose_type) = (pose[0], pose[1] if len(pose) > 1 else "P")
+        elif isinstance(pose, list):
+            (values, pose_type) = (pose, "P")
+        else:
+            return
+
+        robot = self._get_robot(obj)
+        key = "joints" if pose_type == "J" else "position"
+        with self._lock:
+            robot[key][: len(values)] = [float(v) for v in values]
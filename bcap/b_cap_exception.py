@@ -3,9 +3,12 @@ from ctypes import c_int32
 
 class HResult:
     E_FAIL = c_int32(0x80004005).value
+    E_NOTIMPL = c_int32(0x80004001).value
     E_CAO_VARIANT_TYPE_NO_SUPPORT = c_int32(0x80000203).value
     S_EXECUTING = c_int32(0x00000900).value
     E_INVALID_PACKET = c_int32(0x80010000).value
+    E_HANDLE = c_int32(0x80070006).value
+    E_OUTOFMEMORY = c_int32(0x8007000E).value
 
 
 class BCapException(Exception):
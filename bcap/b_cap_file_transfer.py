@@ -0,0 +1,164 @@
+import mmap
+import os
+from typing import Callable, Optional, Union
+from .b_cap_client import BCapClient
+from .b_cap_exception import BCapException
+
+
+class BCapFileTransfer:
+    def __init__(self, client: BCapClient, encoding: str = "utf-8"):
+        # encoding is used to write the contents of text files, which the
+        # controller returns as strings.
+        self._client = client
+        self._encoding = encoding
+
+    def download(
+        self,
+        handle: int,
+        name: str,
+        destination: any,
+        option="",
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        # Copies the file name of the controller to destination, which is a
+        # path, a binary file object or a writable buffer such as an mmap.
+        # Returns the number of bytes written.
+        file_handle = BCapFileTransfer._value(
+            self._client.controller_get_file(handle, name, option)
+        )
+        try:
+            return self.download_handle(file_handle, destination, progress)
+        finally:
+            self._client.file_release(file_handle)
+
+    def download_handle(
+        self,
+        file_handle: int,
+        destination: any,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        total = BCapFileTransfer._value(self._client.file_get_size(file_handle))
+
+        if isinstance(destination, (str, os.PathLike)):
+            with open(destination, "wb") as f:
+                return self._download_to(file_handle, f.write, total, progress)
+        elif hasattr(destination, "write"):
+            return self._download_to(file_handle, destination.write, total, progress)
+
+        view = memoryview(destination).cast("B")
+        position = 0
+
+        def write(chunk: memoryview) -> None:
+            nonlocal position
+            if position + len(chunk) > len(view):
+                raise ValueError("The destination buffer is too small.")
+            view[position : position + len(chunk)] = chunk
+            position += len(chunk)
+
+        with view:
+            return self._download_to(file_handle, write, total, progress)
+
+    def upload(
+        self,
+        handle: int,
+        name: str,
+        source: any = None,
+        option="",
+        progress: Optional[Callable[[int, int], None]] = None,
+        text: Optional[str] = None,
+    ) -> None:
+        # Writes source, which is a path or a bytes-like object, to the file
+        # name of the controller. The string text is put as the text of the
+        # file instead when it is given.
+        BCapFileTransfer._check_source(source, text)
+        file_handle = BCapFileTransfer._value(
+            self._client.controller_get_file(handle, name, option)
+        )
+        try:
+            self.upload_handle(file_handle, source, progress, text)
+        finally:
+            self._client.file_release(file_handle)
+
+    def upload_handle(
+        self,
+        file_handle: int,
+        source: any = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+        text: Optional[str] = None,
+    ) -> None:
+        BCapFileTransfer._check_source(source, text)
+        if text is not None:
+            BCapFileTransfer._value(self._client.file_put_value(file_handle, text))
+            if progress is not None:
+                progress(len(text), len(text))
+            return
+        elif not isinstance(source, (str, os.PathLike)):
+            with memoryview(source).cast("B") as view:
+                self._upload_from(file_handle, view, progress)
+            return
+
+        with open(source, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # An empty file can not be mapped.
+                self._upload_from(file_handle, memoryview(b""), progress)
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                with memoryview(m) as view:
+                    self._upload_from(file_handle, view, progress)
+
+    @staticmethod
+    def _check_source(source: any, text: Optional[str]) -> None:
+        if (source is None) == (text is None):
+            raise ValueError("Either source or text must be given.")
+        if text is not None and not isinstance(text, str):
+            raise TypeError("text must be a string.")
+
+    def _download_to(
+        self,
+        file_handle: int,
+        write: Callable[[any], None],
+        total: int,
+        progress: Optional[Callable[[int, int], None]],
+    ) -> int:
+        written = 0
+
+        def sink(chunk: Union[memoryview, str]) -> None:
+            nonlocal written
+            if isinstance(chunk, str):
+                chunk = chunk.encode(self._encoding)
+            write(chunk)
+            written += len(chunk)
+            if progress is not None:
+                progress(written, total)
+
+        BCapFileTransfer._value(self._client.file_get_value_into(file_handle, sink))
+        return written
+
+    def _upload_from(
+        self,
+        file_handle: int,
+        view: memoryview,
+        progress: Optional[Callable[[int, int], None]],
+    ) -> None:
+        total = len(view)
+
+        def report(sent: int) -> None:
+            progress(sent, total)
+
+        BCapFileTransfer._value(
+            self._client.file_put_value_from(
+                file_handle, view, None if progress is None else report
+            )
+        )
+
+    @staticmethod
+    def _value(result: any) -> any:
+        if isinstance(result, tuple):
+            # should_return_hr is enabled.
+            (hr, value) = result
+            if hr < 0:
+                raise BCapException(hr)
+            return value
+
+        return result
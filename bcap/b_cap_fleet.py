@@ -0,0 +1,587 @@
+import errno
+import heapq
+import selectors
+import socket
+import struct
+import time
+from collections import namedtuple
+from threading import RLock
+from typing import Callable, Iterable, Optional, Union
+from .b_cap_exception import HResult, BCapException
+from .b_cap_converter import BCapConverter
+
+# name : Name of the controller
+# value : Result of the request, or the exception if the request failed
+# latency : Round trip time of the request in seconds
+BCapFleetResult = namedtuple("BCapFleetResult", ["name", "value", "latency"])
+
+
+class _FleetRequest:
+    def __init__(self, request_id: int, connection, serial: int, packet: bytearray):
+        self.request_id = request_id
+        self.connection = connection
+        self.serial = serial
+        self.packet = packet
+        self.retry_count = 0
+        self.timestamp = 0.0
+        self.deadline = 0.0
+
+
+class _FleetConnection:
+
+    _RECV_SIZE = 65536
+
+    def __init__(
+        self,
+        name: str,
+        protocol: str,
+        endpoint: str,
+        timeout: float,
+        retry: int,
+        should_return_hr: bool,
+    ):
+        self.name = name
+        self.is_tcp = protocol == "tcp"
+        self.address = BCapConverter.parse_endpoint(endpoint)
+        self.timeout = timeout
+        self.retry = retry
+        self.bcap_converter = BCapConverter(self.is_tcp, should_return_hr)
+        self.sock = None
+        self.error = None
+        self.is_connected = False
+        self.events = 0
+        self.serial = 1
+        self.send_buffer = bytearray()
+        self.recv_buffer = bytearray()
+        self.pending = {}
+
+    def next_serial(self) -> int:
+        serial = self.serial
+        if self.serial >= 0xFFFF:
+            self.serial = 1
+        else:
+            self.serial += 1
+        return serial
+
+    def recv_frames(self) -> list:
+        # Reads everything the socket holds without blocking and returns the
+        # complete b-CAP messages.
+        frames = []
+        while True:
+            try:
+                if self.is_tcp:
+                    data = self.sock.recv(_FleetConnection._RECV_SIZE)
+                    if not data:
+                        raise ConnectionResetError(
+                            "The b-CAP server closed the connection."
+                        )
+                    self.recv_buffer += data
+                else:
+                    data, address = self.sock.recvfrom(_FleetConnection._RECV_SIZE)
+                    if address[0] == self.address[0] and address[1] == self.address[1]:
+                        frames.append(data)
+            except (BlockingIOError, InterruptedError):
+                break
+
+        if self.is_tcp:
+            frames = BCapConverter.extract_frames(self.recv_buffer)
+
+        return frames
+
+
+class BCapFleet:
+
+    _RETRY_MIN = 1
+    _RETRY_MAX = 7
+    _MAX_PACKET_SIZE = 504
+    # Results of requests that were never waited for are dropped, oldest
+    # first, beyond this number.
+    _MAX_RESULTS = 4096
+    # h : Retry - 2bytes(short)
+    _STRUCT_RETRY = struct.Struct("<h")
+
+    def __init__(
+        self, timeout: float = 3.0, retry: int = 1, should_return_hr: bool = False
+    ):
+        self._timeout = timeout
+        self._retry = retry
+        self._should_return_hr = should_return_hr
+        self._lock = RLock()
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}
+        self._requests = {}
+        self._results = {}
+        self._deadlines = []
+        self._next_request_id = 1
+        # Settings applied to the connections added later as well
+        self._compression = None
+        self._array_type = None
+
+    def add(
+        self,
+        name: str,
+        endpoint: str,
+        protocol: str = "tcp",
+        timeout: Optional[float] = None,
+        retry: Optional[int] = None,
+    ) -> None:
+        if protocol not in ("tcp", "udp"):
+            raise ValueError()
+
+        if retry is None:
+            retry = self._retry
+        if retry < BCapFleet._RETRY_MIN or retry > BCapFleet._RETRY_MAX:
+            raise ValueError()
+
+        with self._lock:
+            if name in self._connections:
+                raise KeyError(name)
+
+            connection = _FleetConnection(
+                name,
+                protocol,
+                endpoint,
+                self._timeout if timeout is None else timeout,
+                retry,
+                self._should_return_hr,
+            )
+            if connection.is_tcp and self._compression is not None:
+                connection.bcap_converter.set_compression_parameters(
+                    *self._compression
+                )
+            if self._array_type is not None:
+                connection.bcap_converter.set_array_type(self._array_type)
+            self._connections[name] = connection
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            connection = self._connections.pop(name)
+            self._close(connection, ConnectionAbortedError("Disconnected."))
+
+    def get_names(self) -> list:
+        with self._lock:
+            return list(self._connections)
+
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        with self._lock:
+            self._compression = (enable, level, threshold, adaptive)
+            for connection in self._connections.values():
+                if connection.is_tcp:
+                    connection.bcap_converter.set_compression_parameters(
+                        enable, level, threshold, adaptive
+                    )
+
+    def set_array_type(self, array_type: str) -> None:
+        with self._lock:
+            self._array_type = array_type
+            for connection in self._connections.values():
+                connection.bcap_converter.set_array_type(array_type)
+
+    def connect(self, names: Optional[Iterable[str]] = None) -> dict:
+        # Every TCP connection is opened in parallel. The value of each result
+        # is None on success, or the exception that aborted the connection.
+        with self._lock:
+            results = {}
+            connecting = {}
+            for connection in self._select(names):
+                if connection.is_connected:
+                    results[connection.name] = BCapFleetResult(
+                        connection.name, None, 0.0
+                    )
+                    continue
+
+                timestamp = time.monotonic()
+                try:
+                    self._open(connection)
+                except Exception as e:
+                    self._close(connection, e)
+                    results[connection.name] = BCapFleetResult(connection.name, e, 0.0)
+                    continue
+
+                if connection.is_connected:
+                    results[connection.name] = BCapFleetResult(
+                        connection.name, None, time.monotonic() - timestamp
+                    )
+                else:
+                    connecting[connection] = (
+                        timestamp,
+                        timestamp + connection.timeout,
+                    )
+
+            while connecting:
+                now = time.monotonic()
+                for connection, (timestamp, deadline) in list(connecting.items()):
+                    if connection.is_connected or connection.sock is None:
+                        del connecting[connection]
+                        results[connection.name] = BCapFleetResult(
+                            connection.name,
+                            connection.error if connection.sock is None else None,
+                            now - timestamp,
+                        )
+                    elif deadline <= now:
+                        del connecting[connection]
+                        error = socket.timeout("timed out")
+                        self._close(connection, error)
+                        results[connection.name] = BCapFleetResult(
+                            connection.name, error, now - timestamp
+                        )
+
+                if connecting:
+                    timeout = min(deadline for _, deadline in connecting.values())
+                    self._poll(max(timeout - now, 0.0))
+
+            return results
+
+    def disconnect(self, names: Optional[Iterable[str]] = None) -> None:
+        with self._lock:
+            for connection in self._select(names):
+                self._close(connection, ConnectionAbortedError("Disconnected."))
+
+    def close(self) -> None:
+        with self._lock:
+            self.disconnect()
+            self._selector.close()
+
+    def submit(self, name: str, func_id: int, args: list) -> int:
+        with self._lock:
+            connection = self._connections[name]
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            self._send(request_id, connection, func_id, args)
+            return request_id
+
+    def wait(
+        self, request_ids: Iterable[int], timeout: Optional[float] = None
+    ) -> dict:
+        # Drives the selector loop until every request has finished, and
+        # returns the results of the requests that finished by the timeout.
+        # A result is returned once, and is dropped if _MAX_RESULTS requests
+        # finish after it before it is waited for.
+        with self._lock:
+            request_ids = list(request_ids)
+            if timeout is None:
+                end = None
+            else:
+                end = time.monotonic() + timeout
+
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if all(request_id not in self._requests for request_id in request_ids):
+                    break
+                if end is not None and end <= now:
+                    break
+
+                poll_end = end
+                if self._deadlines and (end is None or self._deadlines[0][0] < end):
+                    poll_end = self._deadlines[0][0]
+                self._poll(None if poll_end is None else max(poll_end - now, 0.0))
+
+            return {
+                request_id: self._results.pop(request_id)
+                for request_id in request_ids
+                if request_id in self._results
+            }
+
+    def execute(self, requests: dict, timeout: Optional[float] = None) -> dict:
+        # requests : {name: (func_id, args)}
+        with self._lock:
+            request_ids = {
+                self.submit(name, func_id, args): name
+                for name, (func_id, args) in requests.items()
+            }
+            results = self.wait(request_ids, timeout)
+            return {result.name: result for result in results.values()}
+
+    def broadcast(
+        self,
+        func_id: int,
+        args: Union[list, dict, Callable[[str], list]],
+        names: Optional[Iterable[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        # args is either the argument list shared by every controller, a dict
+        # of argument lists keyed by controller name, or a callable that takes
+        # the controller name and returns its argument list.
+        with self._lock:
+            if names is None:
+                names = list(self._connections)
+
+            requests = {}
+            for name in names:
+                if isinstance(args, dict):
+                    requests[name] = (func_id, args[name])
+                elif callable(args):
+                    requests[name] = (func_id, args(name))
+                else:
+                    requests[name] = (func_id, args)
+
+            return self.execute(requests, timeout)
+
+    def request(self, name: str, func_id: int, args: list) -> any:
+        with self._lock:
+            request_id = self.submit(name, func_id, args)
+            value = self.wait([request_id])[request_id].value
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+    def get_statistics(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "connected": connection.is_connected,
+                    "pending": len(connection.pending),
+                }
+                for name, connection in self._connections.items()
+            }
+
+    def _select(self, names: Optional[Iterable[str]]) -> list:
+        if names is None:
+            return list(self._connections.values())
+        return [self._connections[name] for name in names]
+
+    def _open(self, connection: _FleetConnection) -> None:
+        connection.error = None
+        connection.send_buffer.clear()
+        connection.recv_buffer.clear()
+        connection.serial = 1
+        if connection.is_tcp:
+            connection.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection.sock.setblocking(False)
+            result = connection.sock.connect_ex(connection.address)
+            if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise OSError(result, "Failed to connect.")
+
+            # The connection completes when the socket becomes writable.
+            connection.events = selectors.EVENT_WRITE
+            self._selector.register(connection.sock, connection.events, connection)
+        else:
+            connection.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            connection.sock.setblocking(False)
+            connection.is_connected = True
+            connection.events = selectors.EVENT_READ
+            self._selector.register(connection.sock, connection.events, connection)
+
+    def _close(self, connection: _FleetConnection, error: Exception) -> None:
+        connection.error = error
+        if connection.sock is not None:
+            try:
+                self._selector.unregister(connection.sock)
+            except (KeyError, ValueError):
+                pass
+
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+            connection.sock.close()
+            connection.sock = None
+
+        connection.is_connected = False
+        connection.events = 0
+        connection.send_buffer.clear()
+        connection.recv_buffer.clear()
+        pending = connection.pending
+        connection.pending = {}
+        for request in pending.values():
+            self._finish(request, error)
+
+    def _send(
+        self, request_id: int, connection: _FleetConnection, func_id: int, args: list
+    ) -> None:
+        serial = connection.next_serial()
+        if not connection.is_connected:
+            request = _FleetRequest(request_id, connection, serial, None)
+            self._requests[request_id] = request
+            self._finish(request, ConnectionError("Not connected."))
+            return
+
+        try:
+            # The version field is 1 on TCP, as BCapTcp sends, and the retry
+            # count 0 on UDP.
+            version = 1 if connection.is_tcp else 0
+            packet = connection.bcap_converter.serialize(
+                serial, version, func_id, args
+            )
+            if not connection.is_tcp and len(packet) > BCapFleet._MAX_PACKET_SIZE:
+                raise BCapException(
+                    HResult.E_INVALID_PACKET,
+                    "Serialized packet size is {0} bytes. In the case of UDP, the maximum value is {1} bytes".format(
+                        len(packet), BCapFleet._MAX_PACKET_SIZE
+                    ),
+                )
+        except Exception as e:
+            request = _FleetRequest(request_id, connection, serial, None)
+            self._requests[request_id] = request
+            self._finish(request, e)
+            return
+
+        request = _FleetRequest(request_id, connection, serial, packet)
+        request.timestamp = time.monotonic()
+        self._requests[request_id] = request
+        connection.pending[serial] = request
+        self._arm(request, request.timestamp)
+        self._transmit(connection, packet)
+
+    def _transmit(self, connection: _FleetConnection, packet: bytearray) -> None:
+        if not connection.is_tcp:
+            try:
+                connection.sock.sendto(packet, connection.address)
+            except (BlockingIOError, InterruptedError):
+                # Treated as a lost datagram and resent on the timeout.
+                pass
+            return
+
+        connection.send_buffer += packet
+        self._flush(connection)
+
+    def _flush(self, connection: _FleetConnection) -> None:
+        try:
+            while connection.send_buffer:
+                sent = connection.sock.send(connection.send_buffer)
+                del connection.send_buffer[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            self._close(connection, e)
+            return
+
+        # Write readiness is only watched while data is queued.
+        events = selectors.EVENT_READ
+        if connection.send_buffer:
+            events |= selectors.EVENT_WRITE
+        if events != connection.events:
+            connection.events = events
+            self._selector.modify(connection.sock, events, connection)
+
+    def _poll(self, timeout: Optional[float]) -> None:
+        if not self._selector.get_map():
+            if timeout:
+                time.sleep(timeout)
+            return
+
+        for key, mask in self._selector.select(timeout):
+            connection = key.data
+            if connection.sock is None:
+                continue
+
+            if not connection.is_connected:
+                self._connected(connection)
+                continue
+
+            if mask & selectors.EVENT_WRITE:
+                self._flush(connection)
+            if mask & selectors.EVENT_READ and connection.sock is not None:
+                self._readable(connection)
+
+    def _connected(self, connection: _FleetConnection) -> None:
+        result = connection.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if result != 0:
+            self._close(connection, OSError(result, "Failed to connect."))
+            return
+
+        connection.is_connected = True
+        connection.events = selectors.EVENT_READ
+        self._selector.modify(connection.sock, connection.events, connection)
+
+    def _readable(self, connection: _FleetConnection) -> None:
+        try:
+            frames = connection.recv_frames()
+        except OSError as e:
+            self._close(connection, e)
+            return
+
+        now = time.monotonic()
+        for frame in frames:
+            try:
+                (
+                    recv_serial,
+                    version,
+                    hr,
+                    deserialized_args,
+                ) = connection.bcap_converter.deserialize(frame)
+            except Exception as e:
+                # Only the request of the frame fails.
+                request = connection.pending.pop(BCapConverter.peek_serial(frame), None)
+                if request is not None:
+                    self._finish(request, e, now)
+                continue
+
+            request = connection.pending.get(recv_serial)
+            if request is None:
+                # A late reply to a request that has already timed out.
+                continue
+
+            if hr == HResult.S_EXECUTING:
+                # The server is still executing the request.
+                self._arm(request, now)
+                continue
+
+            del connection.pending[recv_serial]
+            if deserialized_args is None:
+                deserialized_result = None
+            else:
+                deserialized_result = deserialized_args[0]
+            self._finish(
+                request,
+                connection.bcap_converter.create_batch_response_object(
+                    hr, deserialized_result
+                ),
+                now,
+            )
+
+    def _arm(self, request: _FleetRequest, now: float) -> None:
+        request.deadline = now + request.connection.timeout
+        heapq.heappush(self._deadlines, (request.deadline, request.request_id))
+
+    def _expire(self, now: float) -> None:
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, request_id = heapq.heappop(self._deadlines)
+            request = self._requests.get(request_id)
+            if request is None or request.deadline != deadline:
+                # Finished, or the deadline was extended by S_EXECUTING.
+                continue
+
+            connection = request.connection
+            if connection.is_tcp:
+                connection.pending.pop(request.serial, None)
+                self._finish(request, socket.timeout("timed out"), now)
+                continue
+
+            request.retry_count += 1
+            if request.retry_count > connection.retry:
+                connection.pending.pop(request.serial, None)
+                self._finish(
+                    request,
+                    BCapException(
+                        HResult.E_FAIL, "The number of retries has been exceeded."
+                    ),
+                    now,
+                )
+                continue
+
+            # Resend with the same serial number, so a late reply to an earlier
+            # attempt still completes the request.
+            BCapFleet._STRUCT_RETRY.pack_into(
+                request.packet, 7, request.retry_count
+            )
+            self._arm(request, now)
+            self._transmit(connection, request.packet)
+
+    def _finish(
+        self, request: _FleetRequest, value: any, now: Optional[float] = None
+    ) -> None:
+        if now is None:
+            now = time.monotonic()
+        latency = now - request.timestamp if request.timestamp else 0.0
+        del self._requests[request.request_id]
+        self._results[request.request_id] = BCapFleetResult(
+            request.connection.name, value, latency
+        )
+        if len(self._results) > BCapFleet._MAX_RESULTS:
+            del self._results[next(iter(self._results))]
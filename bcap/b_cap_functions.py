@@ -0,0 +1,199 @@
+# The b-CAP functions, shared by the transports, the tools and the emulator.
+import re
+
+# The name of each b-CAP function ID, after the BCapClient method sending it.
+FUNCTION_NAMES = {
+    1: "service_start",
+    2: "service_stop",
+    3: "controller_connect",
+    4: "controller_disconnect",
+    5: "controller_get_extension",
+    6: "controller_get_file",
+    7: "controller_get_robot",
+    8: "controller_get_task",
+    9: "controller_get_variable",
+    10: "controller_get_command",
+    11: "controller_get_extension_names",
+    12: "controller_get_file_names",
+    13: "controller_get_robot_names",
+    14: "controller_get_task_names",
+    15: "controller_get_variable_names",
+    16: "controller_get_command_names",
+    17: "controller_execute",
+    18: "controller_get_message",
+    19: "controller_get_attribute",
+    20: "controller_get_help",
+    21: "controller_get_name",
+    22: "controller_get_tag",
+    23: "controller_put_tag",
+    24: "controller_get_id",
+    25: "controller_put_id",
+    26: "extension_get_variable",
+    27: "extension_get_variable_names",
+    28: "extension_execute",
+    29: "extension_get_attribute",
+    30: "extension_get_help",
+    31: "extension_get_name",
+    32: "extension_get_tag",
+    33: "extension_put_tag",
+    34: "extension_get_id",
+    35: "extension_put_id",
+    36: "extension_release",
+    37: "file_get_file",
+    38: "file_get_variable",
+    39: "file_get_file_names",
+    40: "file_get_variable_names",
+    41: "file_execute",
+    42: "file_copy",
+    43: "file_delete",
+    44: "file_move",
+    45: "file_run",
+    46: "file_get_date_created",
+    47: "file_get_date_last_accessed",
+    48: "file_get_date_last_modified",
+    49: "file_get_path",
+    50: "file_get_size",
+    51: "file_get_type",
+    52: "file_get_value",
+    53: "file_put_value",
+    54: "file_get_attribute",
+    55: "file_get_help",
+    56: "file_get_name",
+    57: "file_get_tag",
+    58: "file_put_tag",
+    59: "file_get_id",
+    60: "file_put_id",
+    61: "file_release",
+    62: "robot_get_variable",
+    63: "robot_get_variable_names",
+    64: "robot_execute",
+    65: "robot_accelerate",
+    66: "robot_change",
+    67: "robot_chuck",
+    68: "robot_drive",
+    69: "robot_go_home",
+    70: "robot_halt",
+    71: "robot_hold",
+    72: "robot_move",
+    73: "robot_rotate",
+    74: "robot_speed",
+    75: "robot_unchuck",
+    76: "robot_unhold",
+    77: "robot_get_attribute",
+    78: "robot_get_help",
+    79: "robot_get_name",
+    80: "robot_get_tag",
+    81: "robot_put_tag",
+    82: "robot_get_id",
+    83: "robot_put_id",
+    84: "robot_release",
+    85: "task_get_variable",
+    86: "task_get_variable_names",
+    87: "task_execute",
+    88: "task_start",
+    89: "task_stop",
+    90: "task_delete",
+    91: "task_get_file_name",
+    92: "task_get_attribute",
+    93: "task_get_help",
+    94: "task_get_name",
+    95: "task_get_tag",
+    96: "task_put_tag",
+    97: "task_get_id",
+    98: "task_put_id",
+    99: "task_release",
+    100: "variable_get_date_time",
+    101: "variable_get_value",
+    102: "variable_put_value",
+    103: "variable_get_attribute",
+    104: "variable_get_help",
+    105: "variable_get_name",
+    106: "variable_get_tag",
+    107: "variable_put_tag",
+    108: "variable_get_id",
+    109: "variable_put_id",
+    110: "variable_get_microsecond",
+    111: "variable_release",
+    112: "command_execute",
+    113: "command_cancel",
+    114: "command_get_timeout",
+    115: "command_put_timeout",
+    116: "command_get_state",
+    117: "command_get_parameters",
+    118: "command_put_parameters",
+    119: "command_get_result",
+    120: "command_get_attribute",
+    121: "command_get_help",
+    122: "command_get_name",
+    123: "command_get_tag",
+    124: "command_put_tag",
+    125: "command_get_id",
+    126: "command_put_id",
+    127: "command_release",
+    128: "message_reply",
+    129: "message_clear",
+    130: "message_get_date_time",
+    131: "message_get_description",
+    132: "message_get_destination",
+    133: "message_get_number",
+    134: "message_get_serial_number",
+    135: "message_get_source",
+    136: "message_get_value",
+    137: "message_release",
+}
+
+# The functions returning a new handle.
+HANDLE_GETTER_FUNC_IDS = frozenset(
+    (
+        3,  # controller_connect
+        5,  # controller_get_extension
+        6,  # controller_get_file
+        7,  # controller_get_robot
+        8,  # controller_get_task
+        9,  # controller_get_variable
+        10,  # controller_get_command
+        18,  # controller_get_message
+        26,  # extension_get_variable
+        37,  # file_get_file
+        38,  # file_get_variable
+        62,  # robot_get_variable
+        85,  # task_get_variable
+    )
+)
+
+# The names of the getters acquiring a handle under a parent handle by name. The
+# second group is the kind of the object.
+GETTER_NAME_PATTERN = re.compile(
+    r"^(controller|extension|file|robot|task)_get_"
+    r"(extension|file|robot|task|variable|command)$"
+)
+
+# The BCapClient method that acquires a handle under a parent handle by name
+# and the method that releases it.
+GETTER_TO_RELEASE = {
+    "controller_get_extension": "extension_release",
+    "controller_get_file": "file_release",
+    "controller_get_robot": "robot_release",
+    "controller_get_task": "task_release",
+    "controller_get_variable": "variable_release",
+    "controller_get_command": "command_release",
+    "extension_get_variable": "variable_release",
+    "file_get_file": "file_release",
+    "file_get_variable": "variable_release",
+    "robot_get_variable": "variable_release",
+    "task_get_variable": "variable_release",
+}
+
+# The functions releasing the handle given as their first argument.
+RELEASE_FUNC_IDS = frozenset(
+    (
+        4,  # controller_disconnect
+        36,  # extension_release
+        61,  # file_release
+        84,  # robot_release
+        99,  # task_release
+        111,  # variable_release
+        127,  # command_release
+        137,  # message_release
+    )
+)
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Union
+from .b_cap_client import BCapClient
+from .b_cap_functions import GETTER_TO_RELEASE
+
+
+class BCapHandleCache:
+    def __init__(self, client: BCapClient, capacity: int = 256):
+        if capacity < 1:
+            raise ValueError()
+
+        self._client = client
+        self._capacity = capacity
+        self._lock = Lock()
+        # {(parent handle, getter, name, option): (getter, handle, result)}
+        self._entries = OrderedDict()
+        # {handle: key of its entry}
+        self._keys = {}
+        # {key: event set when the acquisition in flight for the key ends}
+        self._pending = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def controller_get_extension(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return self._get("controller_get_extension", handle, name, option)
+
+    def controller_get_file(self, handle: int, name: str, option="") -> Union[int, any]:
+        return self._get("controller_get_file", handle, name, option)
+
+    def controller_get_robot(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return self._get("controller_get_robot", handle, name, option)
+
+    def controller_get_task(self, handle: int, name: str, option="") -> Union[int, any]:
+        return self._get("controller_get_task", handle, name, option)
+
+    def controller_get_variable(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return self._get("controller_get_variable", handle, name, option)
+
+    def controller_get_command(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return self._get("controller_get_command", handle, name, option)
+
+    def extension_get_variable(
+        self, handle: int, name: str, option=""
+    ) -> Union[int, any]:
+        return self._get("extension_get_variable", handle, name, option)
+
+    def file_get_file(self, handle: int, name: str, option="") -> Union[int, any]:
+        return self._get("file_get_file", handle, name, option)
+
+    def file_get_variable(self, handle: int, name: str, option="") -> Union[int, any]:
+        return self._get("file_get_variable", handle, name, option)
+
+    def robot_get_variable(self, handle: int, name: str, option="") -> Union[int, any]:
+        return self._get("robot_get_variable", handle, name, option)
+
+    def task_get_variable(self, handle: int, name: str, option="") -> Union[int, any]:
+        return self._get("task_get_variable", handle, name, option)
+
+    def release(self, handle: int) -> None:
+        # The handles cached under handle are released with it, even when
+        # handle itself was acquired elsewhere, such as by controller_connect.
+        with self._lock:
+            self._drop_pending(handle)
+            for key in list(self._entries):
+                if key in self._entries and (
+                    key[0] == handle or self._entries[key][1] == handle
+                ):
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            while self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def get_statistics(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "size": len(self._entries),
+                "capacity": self._capacity,
+            }
+
+    def _get(self, getter: str, handle: int, name: str, option: str) -> any:
+        key = (handle, getter, name, option)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._hits += 1
+                    self._touch(key)
+                    return entry[2]
+
+                # Concurrent misses for the same key wait for the acquisition
+                # in flight instead of acquiring the handle twice, and look
+                # the key up again once it ends.
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = Event()
+                    self._misses += 1
+                    break
+            pending.wait()
+
+        try:
+            # The round trip is made without the lock, so other keys are served
+            # meanwhile.
+            result = getattr(self._client, getter)(handle, name, option)
+            if isinstance(result, tuple):
+                # should_return_hr is enabled. Failed acquisitions are not cached.
+                hr, cached_handle = result
+                if hr < 0:
+                    return result
+            else:
+                cached_handle = result
+
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    self._entries[key] = (getter, cached_handle, result)
+                    self._keys[cached_handle] = key
+                    self._touch(key)
+                    while len(self._entries) > self._capacity:
+                        self._evictions += 1
+                        self._remove(next(iter(self._entries)))
+                    return result
+
+            # The parent was released or the cache cleared during the round
+            # trip, so the handle is released as the cached ones were.
+            self._release(getter, cached_handle)
+            return result
+        finally:
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+            pending.set()
+
+    def _touch(self, key: tuple) -> None:
+        # The parents of an entry are touched after it, so a parent is always
+        # more recent than its children and is not evicted while it still has
+        # children cached.
+        while key is not None:
+            self._entries.move_to_end(key)
+            parent = self._keys.get(key[0])
+            key = None if parent == key else parent
+
+    def _remove(self, key: tuple) -> None:
+        # The children of the entry are released before it.
+        (getter, cached_handle, _) = self._entries.pop(key)
+        if self._keys.get(cached_handle) == key:
+            del self._keys[cached_handle]
+        self._drop_pending(cached_handle)
+        for child in [k for k in self._entries if k[0] == cached_handle]:
+            if child in self._entries:
+                self._remove(child)
+        self._release(getter, cached_handle)
+
+    def _drop_pending(self, handle: int) -> None:
+        # Acquisitions in flight under handle are not cached when they end.
+        for key in [k for k in self._pending if k[0] == handle]:
+            del self._pending[key]
+
+    def _release(self, getter: str, handle: int) -> None:
+        try:
+            getattr(self._client, GETTER_TO_RELEASE[getter])(handle)
+        except Exception:
+            pass
@@ -0,0 +1,434 @@
+import struct
+from concurrent.futures import Future
+from threading import Lock, RLock
+from typing import Callable, Optional, Tuple
+from .b_cap_converter import BCapConverter, VarType
+from .b_cap_exception import HResult, BCapException
+from .b_cap_functions import (
+    FUNCTION_NAMES,
+    HANDLE_GETTER_FUNC_IDS,
+    RELEASE_FUNC_IDS,
+)
+from .b_cap_metrics import BCapMetrics
+from .b_cap_recorder import BCapRecorder
+from .b_cap_socket import BCapSocket
+from .b_cap_tcp import BCapTcp
+from .b_cap_udp import BCapUdp
+
+
+class BCapHybrid(BCapSocket):
+
+    # Header, function ID, number of arguments and argument length
+    _FIRST_ARG_OFFSET = 1 + 4 + 2 + 2 + 4 + 2 + 4
+    # H : Type - 2bytes(unsigned short)
+    # I : Number of elements - 4bytes(unsigned int)
+    # i : Handle - 4bytes(int)
+    _STRUCT_HANDLE_ARG = struct.Struct("<HIi")
+
+    # Functions sent to both sessions, so each has its own service running.
+    _BOTH_FUNC_IDS = frozenset(
+        (
+            1,  # service_start
+            2,  # service_stop
+        )
+    )
+
+    # Functions whose responses can exceed the UDP packet size limit even
+    # though their requests are small.
+    _TCP_FUNC_IDS = frozenset(
+        (
+            11,  # controller_get_extension_names
+            12,  # controller_get_file_names
+            13,  # controller_get_robot_names
+            14,  # controller_get_task_names
+            15,  # controller_get_variable_names
+            16,  # controller_get_command_names
+            20,  # controller_get_help
+            27,  # extension_get_variable_names
+            30,  # extension_get_help
+            39,  # file_get_file_names
+            40,  # file_get_variable_names
+            52,  # file_get_value
+            55,  # file_get_help
+            63,  # robot_get_variable_names
+            78,  # robot_get_help
+            86,  # task_get_variable_names
+            93,  # task_get_help
+            104,  # variable_get_help
+            121,  # command_get_help
+        )
+    )
+
+    def __init__(self, should_return_hr: bool):
+        # Both sessions talk to the same b-CAP server, but a handle is only
+        # valid on the session that acquired it. Handles are acquired on the
+        # UDP session, which is the handle the caller gets, and a request
+        # routed to TCP uses a twin of its handle, acquired on the TCP session
+        # by repeating the getters that led to the handle when it is first
+        # needed.
+        self._tcp = BCapTcp(should_return_hr)
+        self._udp = BCapUdp(should_return_hr)
+        self._should_return_hr = should_return_hr
+        self._bcap_converter = BCapConverter(False, should_return_hr)
+        self._lock = Lock()
+        self._handle_lock = RLock()
+        # {UDP handle: [getter function ID, getter args, TCP twin or None]}
+        self._handles = {}
+        # (handle, function ID) whose response did not fit in a datagram
+        self._large_responses = set()
+        self._reset_route_statistics()
+
+    def connect(self, endpoint: str, timeout: float, retry: int) -> None:
+        try:
+            self._tcp.connect(endpoint, timeout, retry)
+            self._udp.connect(endpoint, timeout, retry)
+        except Exception as e:
+            self.disconnect()
+            raise e
+
+    def disconnect(self) -> None:
+        self._tcp.disconnect()
+        self._udp.disconnect()
+        with self._handle_lock:
+            self._handles = {}
+            self._large_responses = set()
+        self._reset_route_statistics()
+
+    def set_timeout(self, timeout: float) -> None:
+        self._tcp.set_timeout(timeout)
+        self._udp.set_timeout(timeout)
+
+    def get_timeout(self) -> float:
+        return self._tcp.get_timeout()
+
+    def set_retry(self, retry: int) -> None:
+        self._udp.set_retry(retry)
+
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        # Only the TCP route carries packets large enough to compress.
+        self._tcp.set_compression(enable, level, threshold, adaptive)
+
+    def get_compression_statistics(self) -> dict:
+        return self._tcp.get_compression_statistics()
+
+    def set_array_type(self, array_type: str) -> None:
+        self._tcp.set_array_type(array_type)
+        self._udp.set_array_type(array_type)
+
+    def set_pipelining(self, enable: bool, window: int = 8) -> None:
+        self._tcp.set_pipelining(enable, window)
+
+    def set_metrics(self, metrics: Optional[BCapMetrics]) -> None:
+        self._tcp.set_metrics(metrics)
+        self._udp.set_metrics(metrics)
+
+    def set_recorder(self, recorder: Optional[BCapRecorder]) -> None:
+        self._tcp.set_recorder(recorder)
+        self._udp.set_recorder(recorder)
+
+    def set_max_message_size(self, size: Optional[int]) -> None:
+        self._tcp.set_max_message_size(size)
+
+    def get_retry_statistics(self) -> dict:
+        return self._udp.get_retry_statistics()
+
+    def get_route_statistics(self) -> dict:
+        with self._lock:
+            return {
+                route: dict(counters) for route, counters in self._counters.items()
+            }
+
+    def request(self, func_id: int, args: list) -> any:
+        if func_id in BCapHybrid._BOTH_FUNC_IDS:
+            self._udp.request(func_id, args)
+            return self._tcp.request(func_id, args)
+        elif func_id in HANDLE_GETTER_FUNC_IDS:
+            return self._acquire(func_id, args)
+        elif func_id in RELEASE_FUNC_IDS:
+            return self._release(func_id, args)
+
+        (route, routed_args) = self._route(func_id, args)
+        if route is self._tcp:
+            return self._tcp.request(func_id, routed_args)
+
+        return self._request_udp(
+            func_id, lambda: self._udp.request(func_id, args), lambda: args, None
+        )
+
+    def _request_udp(
+        self,
+        func_id: int,
+        send: Callable[[], any],
+        get_args: Callable[[], list],
+        size: Optional[int],
+    ) -> any:
+        # The request is counted on the route that finally served it. size is
+        # the size of the packet on UDP, if it is known without get_args.
+        def count_udp() -> None:
+            self._count_route(
+                func_id, get_args() if size is None else None, None, size
+            )
+
+        try:
+            result = send()
+            error = None
+        except BCapException as e:
+            if e.hr != HResult.E_INVALID_PACKET:
+                count_udp()
+                raise
+            error = e
+        except Exception:
+            count_udp()
+            raise
+
+        if error is None and not self._is_invalid_packet(result):
+            count_udp()
+            return result
+
+        # The response did not fit in a datagram, so the function is routed
+        # to TCP for this handle from now on. A function that only reads is
+        # sent again at once, while any other fails, since it may have run.
+        args = get_args()
+        with self._handle_lock:
+            self._large_responses.add((args[0], func_id))
+        if "_get_" not in FUNCTION_NAMES.get(func_id, ""):
+            count_udp()
+            if error is not None:
+                raise error
+            return result
+
+        self._count_route(func_id, args, "large_responses")
+        return self._tcp.request(func_id, self._to_tcp(args))
+
+    def request_into(
+        self, func_id: int, args: list, sink: Callable[[any], None]
+    ) -> any:
+        # Streamed transfers only exist on the TCP route.
+        return self._tcp.request_into(func_id, self._to_tcp(args), sink)
+
+    def serialize_request(
+        self, func_id: int, args: list
+    ) -> Tuple[BCapSocket, bytearray]:
+        # The packet is for the route the request would take. Packets for UDP
+        # are sent through request_serialized of this class, which moves them
+        # to TCP when they no longer fit in a datagram.
+        (route, routed_args) = self._route(func_id, args, False)
+        if route is self._tcp:
+            return self._tcp.serialize_request(func_id, routed_args)
+        return (self, self._udp.serialize_request(func_id, args)[1])
+
+    def request_serialized(self, func_id: int, packet: bytearray) -> any:
+        if len(packet) > BCapUdp._MAX_PACKET_SIZE or self._has_large_response(
+            func_id, packet
+        ):
+            # The arguments are decoded and routed again, since the handle in
+            # the packet is only valid on UDP.
+            return self.request(func_id, self._get_packet_args(packet))
+
+        return self._request_udp(
+            func_id,
+            lambda: self._udp.request_serialized(func_id, packet),
+            lambda: self._get_packet_args(packet),
+            len(packet),
+        )
+
+    def _has_large_response(self, func_id: int, packet: bytearray) -> bool:
+        # The handle is read from the plain VT_I4 first argument of the packet,
+        # so the packet is only decoded when its first argument is anything
+        # else.
+        offset = BCapHybrid._FIRST_ARG_OFFSET
+        handle = None
+        if len(packet) >= offset + BCapHybrid._STRUCT_HANDLE_ARG.size:
+            (var_type, count, value) = BCapHybrid._STRUCT_HANDLE_ARG.unpack_from(
+                packet, offset
+            )
+            if var_type == VarType.VT_I4 and count == 1:
+                handle = value
+
+        with self._handle_lock:
+            if handle is not None:
+                return (handle, func_id) in self._large_responses
+            if not any(key[1] == func_id for key in self._large_responses):
+                return False
+        args = self._get_packet_args(packet)
+        with self._handle_lock:
+            return bool(args) and (args[0], func_id) in self._large_responses
+
+    def _get_packet_args(self, packet: bytearray) -> list:
+        return self._bcap_converter.deserialize(packet)[3]
+
+    def request_from(
+        self,
+        func_id: int,
+        args: list,
+        payload: any,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> any:
+        return self._tcp.request_from(func_id, self._to_tcp(args), payload, progress)
+
+    def submit(self, func_id: int, args: list) -> Future:
+        if (
+            func_id in BCapHybrid._BOTH_FUNC_IDS
+            or func_id in HANDLE_GETTER_FUNC_IDS
+            or func_id in RELEASE_FUNC_IDS
+        ):
+            return super().submit(func_id, args)
+
+        (route, routed_args) = self._route(func_id, args)
+        if route is self._udp:
+            # Requests on UDP are synchronous, and fall back to TCP as in
+            # request.
+            future = Future()
+            try:
+                future.set_result(self.request(func_id, args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        return self._tcp.submit(func_id, routed_args)
+
+    def execute_many(self, requests: list) -> list:
+        # Requests that acquire or release handles, or run on both sessions,
+        # are sent one by one after the batches.
+        results = [None] * len(requests)
+        routes = {self._tcp: [], self._udp: []}
+        routed_requests = {}
+        singles = []
+        for index, (func_id, args) in enumerate(requests):
+            if (
+                func_id in BCapHybrid._BOTH_FUNC_IDS
+                or func_id in HANDLE_GETTER_FUNC_IDS
+                or func_id in RELEASE_FUNC_IDS
+            ):
+                singles.append(index)
+                continue
+
+            try:
+                (route, routed_args) = self._route(func_id, args)
+            except Exception as e:
+                results[index] = e
+                continue
+            if route is self._udp:
+                # Batches on UDP do not fall back to TCP.
+                self._count_route(func_id, args, None)
+            routes[route].append(index)
+            routed_requests[index] = (func_id, routed_args)
+
+        for route, indexes in routes.items():
+            if indexes:
+                for index, result in zip(
+                    indexes,
+                    route.execute_many([routed_requests[i] for i in indexes]),
+                ):
+                    results[index] = result
+
+        for index in singles:
+            try:
+                results[index] = self._bcap_converter.create_batch_response_object(
+                    0, self.request(*requests[index])
+                )
+            except BCapException as e:
+                results[index] = e
+
+        return results
+
+    def _acquire(self, func_id: int, args: list) -> any:
+        # Handles are acquired on the UDP session, where getters are small.
+        result = self._udp.request(func_id, args)
+        handle = result[1] if self._should_return_hr else result
+        if not self._is_invalid_packet(result) and (
+            not self._should_return_hr or result[0] >= 0
+        ):
+            with self._handle_lock:
+                # The server may hand out a released handle again.
+                self._handles[handle] = [func_id, list(args), None]
+                self._large_responses = {
+                    key for key in self._large_responses if key[0] != handle
+                }
+        return result
+
+    def _release(self, func_id: int, args: list) -> any:
+        with self._handle_lock:
+            entry = self._handles.pop(args[0], None)
+        if entry is not None and entry[2] is not None:
+            try:
+                self._tcp.request(func_id, [entry[2]] + list(args[1:]))
+            except Exception:
+                pass
+        return self._udp.request(func_id, args)
+
+    def _to_tcp(self, args: list) -> list:
+        # The arguments with the handle replaced by its twin on TCP.
+        return [self._get_tcp_handle(args[0])] + list(args[1:])
+
+    def _get_tcp_handle(self, handle: int) -> int:
+        with self._handle_lock:
+            entry = self._handles.get(handle)
+            if entry is None:
+                raise BCapException(
+                    HResult.E_HANDLE, "The handle was not acquired by this client."
+                )
+
+            if entry[2] is None:
+                (func_id, args, _) = entry
+                if func_id != 3:
+                    # controller_connect is the only getter without a parent.
+                    args = self._to_tcp(args)
+                result = self._tcp.request(func_id, args)
+                if self._should_return_hr:
+                    (hr, result) = result
+                    if hr < 0:
+                        raise BCapException(hr)
+                entry[2] = result
+            return entry[2]
+
+    def _is_invalid_packet(self, result: any) -> bool:
+        return self._should_return_hr and result[0] == HResult.E_INVALID_PACKET
+
+    def _route(
+        self, func_id: int, args: list, should_count: bool = True
+    ) -> Tuple[BCapSocket, list]:
+        # Returns the route of the request and its arguments for the route.
+        # Only requests routed to TCP are counted here, since those on UDP may
+        # still fall back to TCP.
+        size = self._bcap_converter.calc_packet_size(args)
+        if func_id in BCapHybrid._TCP_FUNC_IDS:
+            reason = "large_responses"
+        elif size > BCapUdp._MAX_PACKET_SIZE:
+            reason = "large_requests"
+        else:
+            with self._handle_lock:
+                is_large = (args[0], func_id) in self._large_responses
+            reason = "large_responses" if is_large else None
+
+        if reason is None:
+            return (self._udp, args)
+        if should_count:
+            self._count_route(func_id, args, reason, size)
+        return (self._tcp, self._to_tcp(args))
+
+    def _count_route(
+        self, func_id: int, args: list, reason: Optional[str], size: int = None
+    ) -> None:
+        if size is None:
+            size = self._bcap_converter.calc_packet_size(args)
+        with self._lock:
+            counters = self._counters["udp" if reason is None else "tcp"]
+            counters["requests"] += 1
+            counters["bytes"] += size
+            if reason is not None:
+                counters[reason] += 1
+
+    def _reset_route_statistics(self) -> None:
+        with self._lock:
+            self._counters = {
+                "udp": {"requests": 0, "bytes": 0},
+                "tcp": {
+                    "requests": 0,
+                    "bytes": 0,
+                    "large_requests": 0,
+                    "large_responses": 0,
+                },
+            }
@@ -0,0 +1,279 @@
+import time
+from typing import Optional
+from threading import Lock
+from .b_cap_functions import FUNCTION_NAMES
+
+# The latencies reported in snapshots and in the Prometheus text.
+_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# The phases of a request, in the order they happen.
+# serialize : Encoding the request packet
+# rtt : From sending the request to receiving the first frame of its response
+# executing : From the first S_EXECUTING keepalive to the response
+# deserialize : Decoding the response
+# latency : The whole request
+_PHASES = ("serialize", "rtt", "executing", "deserialize", "latency")
+
+_COUNTERS = ("calls", "errors", "retries", "keepalives", "bytes_out", "bytes_in")
+
+
+class _Histogram:
+    # A log-linear histogram of nanoseconds in the manner of HdrHistogram.
+    # Values are exact up to 2 ** _SUB_BUCKET_BITS, and above that each power
+    # of two is split into 2 ** (_SUB_BUCKET_BITS - 1) buckets, so a value is
+    # kept with a relative error below 2 %, whatever its magnitude, in a
+    # bucket found with a few integer operations.
+
+    _SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+        self._buckets = {}
+
+    def record(self, value: int) -> None:
+        shift = value.bit_length() - _Histogram._SUB_BUCKET_BITS
+        if shift > 0:
+            index = (shift << (_Histogram._SUB_BUCKET_BITS - 1)) + (value >> shift)
+        else:
+            index = value
+
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "_Histogram") -> None:
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+
+    def get_quantiles(self, quantiles: tuple) -> list:
+        values = []
+        if self.count == 0:
+            return [None] * len(quantiles)
+
+        buckets = sorted(self._buckets.items())
+        position = 0
+        seen = 0
+        for quantile in quantiles:
+            rank = max(1, round(quantile * self.count))
+            while seen + buckets[position][1] < rank:
+                seen += buckets[position][1]
+                position += 1
+            value = _Histogram._get_value(buckets[position][0])
+            values.append(min(max(value, self.min), self.max))
+
+        return values
+
+    @staticmethod
+    def _get_value(index: int) -> int:
+        # The middle of the bucket.
+        shift = (index >> (_Histogram._SUB_BUCKET_BITS - 1)) - 1
+        if shift <= 0:
+            return index
+        lower = (index - (shift << (_Histogram._SUB_BUCKET_BITS - 1))) << shift
+        return lower + (1 << (shift - 1))
+
+
+class _FunctionMetrics:
+    def __init__(self):
+        for counter in _COUNTERS:
+            setattr(self, counter, 0)
+        self.histograms = {phase: _Histogram() for phase in _PHASES}
+
+
+class _Measurement:
+    # The timestamps and counts of one request, filled in by the transport.
+
+    __slots__ = (
+        "func_id",
+        "start",
+        "serialized",
+        "sent",
+        "first_frame",
+        "last_frame",
+        "keepalive",
+        "deserialize_time",
+        "bytes_out",
+        "bytes_in",
+        "retries",
+        "keepalives",
+    )
+
+    def __init__(self, func_id: int):
+        self.func_id = func_id
+        self.start = time.perf_counter_ns()
+        self.serialized = None
+        self.sent = None
+        self.first_frame = None
+        self.last_frame = None
+        self.keepalive = None
+        self.deserialize_time = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+        self.keepalives = 0
+
+    def on_send(self, started: Optional[int], size: int) -> None:
+        # started is the time serialization started, or None if the packet
+        # was serialized before.
+        now = time.perf_counter_ns()
+        if started is not None and self.serialized is None:
+            self.serialized = now - started
+        if self.sent is None:
+            self.sent = now
+        self.bytes_out += size
+
+    def on_frame(self, size: int) -> None:
+        self.last_frame = time.perf_counter_ns()
+        if self.first_frame is None:
+            self.first_frame = self.last_frame
+        self.bytes_in += size
+
+    def add_frame(self, frame: "_Measurement") -> None:
+        # Adds the frame measured on frame, as the reader thread of pipelined
+        # requests does once it knows the request the frame belongs to.
+        if frame.first_frame is None:
+            return
+        if self.first_frame is None:
+            self.first_frame = frame.first_frame
+        self.last_frame = frame.last_frame
+        self.bytes_in += frame.bytes_in
+        if frame.deserialize_time is not None:
+            self.deserialize_time = frame.deserialize_time
+
+    def on_keepalive(self) -> None:
+        # Called for the S_EXECUTING frame received last.
+        self.keepalives += 1
+        if self.keepalive is None:
+            self.keepalive = self.last_frame
+
+
+class BCapMetrics:
+    # Counters and latency histograms of the requests of the clients it is
+    # set to with set_metrics, keyed by b-CAP function ID. Latencies are kept
+    # in nanoseconds and reported in seconds.
+
+    def __init__(self):
+        self._lock = Lock()
+        self._functions = {}
+
+    def begin(self, func_id: int) -> _Measurement:
+        return _Measurement(func_id)
+
+    def end(self, measurement: _Measurement, is_error: bool = False) -> None:
+        end = time.perf_counter_ns()
+        with self._lock:
+            metrics = self._functions.get(measurement.func_id)
+            if metrics is None:
+                metrics = _FunctionMetrics()
+                self._functions[measurement.func_id] = metrics
+
+            metrics.calls += 1
+            metrics.errors += is_error
+            metrics.retries += measurement.retries
+            metrics.keepalives += measurement.keepalives
+            metrics.bytes_out += measurement.bytes_out
+            metrics.bytes_in += measurement.bytes_in
+
+            histograms = metrics.histograms
+            histograms["latency"].record(end - measurement.start)
+            if measurement.serialized is not None:
+                histograms["serialize"].record(measurement.serialized)
+            if measurement.first_frame is not None and measurement.sent is not None:
+                histograms["rtt"].record(
+                    max(measurement.first_frame - measurement.sent, 0)
+                )
+            if measurement.keepalive is not None:
+                histograms["executing"].record(end - measurement.keepalive)
+            if measurement.deserialize_time is not None:
+                histograms["deserialize"].record(measurement.deserialize_time)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._functions = {}
+
+    def get_name(self, func_id: int) -> str:
+        return FUNCTION_NAMES.get(func_id, "func_{}".format(func_id))
+
+    def snapshot(self) -> dict:
+        # Returns {function ID: metrics} where metrics has the counters, the
+        # function name and, for each phase, its count, sum, min, max and
+        # quantiles in seconds.
+        result = {}
+        with self._lock:
+            for func_id, metrics in sorted(self._functions.items()):
+                entry = {"name": self.get_name(func_id)}
+                for counter in _COUNTERS:
+                    entry[counter] = getattr(metrics, counter)
+                for phase, histogram in metrics.histograms.items():
+                    entry[phase] = BCapMetrics._summarize(histogram)
+                result[func_id] = entry
+
+        return result
+
+    def to_prometheus(self, prefix: str = "bcap") -> str:
+        # Returns the metrics in the Prometheus text exposition format, with
+        # the phases as summaries.
+        snapshot = self.snapshot()
+        lines = []
+        for counter in _COUNTERS:
+            metric = "{}_{}_total".format(prefix, counter)
+            lines.append("# TYPE {} counter".format(metric))
+            for func_id, entry in snapshot.items():
+                lines.append(
+                    "{}{{{}}} {}".format(
+                        metric, BCapMetrics._labels(func_id, entry), entry[counter]
+                    )
+                )
+
+        for phase in _PHASES:
+            metric = "{}_{}_seconds".format(prefix, phase)
+            lines.append("# TYPE {} summary".format(metric))
+            for func_id, entry in snapshot.items():
+                labels = BCapMetrics._labels(func_id, entry)
+                summary = entry[phase]
+                for quantile, value in summary["quantiles"].items():
+                    if value is not None:
+                        lines.append(
+                            '{}{{{},quantile="{}"}} {!r}'.format(
+                                metric, labels, quantile, value
+                            )
+                        )
+                lines.append("{}_sum{{{}}} {!r}".format(metric, labels, summary["sum"]))
+                lines.append(
+                    "{}_count{{{}}} {}".format(metric, labels, summary["count"])
+                )
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _summarize(histogram: _Histogram) -> dict:
+        return {
+            "count": histogram.count,
+            "sum": histogram.sum / 1e9,
+            "min": None if histogram.min is None else histogram.min / 1e9,
+            "max": histogram.max / 1e9,
+            "quantiles": {
+                quantile: None if value is None else value / 1e9
+                for quantile, value in zip(
+                    _QUANTILES, histogram.get_quantiles(_QUANTILES)
+                )
+            },
+        }
+
+    @staticmethod
+    def _labels(func_id: int, entry: dict) -> str:
+        return 'func_id="{}",function="{}"'.format(func_id, entry["name"])
+
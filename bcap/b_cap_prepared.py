@@ -0,0 +1,81 @@
+import struct
+from threading import Lock
+from .b_cap_converter import BCapConverter
+from .b_cap_socket import BCapSocket
+
+
+class BCapPreparedRequest:
+    # A request serialized once by BCapClient.prepare. The arguments of the
+    # template given as ... are slots filled by each request, and the others
+    # stay encoded in the packet, so a request only encodes the values of its
+    # slots. They are copied into the packet in place while their sizes do
+    # not change, and the packet is spliced with the new lengths otherwise.
+
+    # SOH, message length, serial, version, function ID and number of args
+    _ARGS_OFFSET = 1 + 4 + 2 + 2 + 4 + 2
+    # I : Message length or argument length - 4bytes(unsigned int)
+    _STRUCT_LENGTH = struct.Struct("<I")
+
+    def __init__(self, b_cap_socket: BCapSocket, func_id: int, template: list):
+        self._func_id = func_id
+        self._slots = [i for i, arg in enumerate(template) if arg is ...]
+        (self._transport, self._packet) = b_cap_socket.serialize_request(
+            func_id, [None if arg is ... else arg for arg in template]
+        )
+        # The values of the slots are encoded alone, in a packet without the
+        # mode byte of TCP.
+        self._converter = BCapConverter(False, False)
+        self._spans = BCapPreparedRequest._find_spans(self._packet, len(template))
+        self._lock = Lock()
+
+    def request(self, *values) -> any:
+        # Sends the request with values in its slots, in order.
+        if len(values) != len(self._slots):
+            raise ValueError(
+                "The request has {} slots, {} values were given.".format(
+                    len(self._slots), len(values)
+                )
+            )
+
+        with self._lock:
+            if values:
+                self._fill(values)
+            return self._transport.request_serialized(self._func_id, self._packet)
+
+    def _fill(self, values: tuple) -> None:
+        encoded = self._converter.serialize(0, 0, self._func_id, list(values))
+        spans = BCapPreparedRequest._find_spans(encoded, len(values))
+        if all(
+            self._spans[slot][1] == size for slot, (_, size) in zip(self._slots, spans)
+        ):
+            packet = self._packet
+            for slot, (offset, size) in zip(self._slots, spans):
+                start = self._spans[slot][0]
+                packet[start : start + size] = encoded[offset : offset + size]
+            return
+
+        # A slot changed its size.
+        arguments = [self._packet[o : o + s] for (o, s) in self._spans]
+        for slot, (offset, size) in zip(self._slots, spans):
+            arguments[slot] = encoded[offset : offset + size]
+        (offset, size) = self._spans[-1]
+        end = offset + size
+        packet = (
+            self._packet[: BCapPreparedRequest._ARGS_OFFSET]
+            + b"".join(arguments)
+            + self._packet[end:]
+        )
+        BCapPreparedRequest._STRUCT_LENGTH.pack_into(packet, 1, len(packet))
+        self._packet = packet
+        self._spans = BCapPreparedRequest._find_spans(packet, len(arguments))
+
+    @staticmethod
+    def _find_spans(packet: bytearray, number_of_args: int) -> list:
+        # Returns the offset and size of each argument with its length.
+        spans = []
+        offset = BCapPreparedRequest._ARGS_OFFSET
+        for _ in range(number_of_args):
+            (length,) = BCapPreparedRequest._STRUCT_LENGTH.unpack_from(packet, offset)
+            spans.append((offset, 4 + length))
+            offset += 4 + length
+        return spans
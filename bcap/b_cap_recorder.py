@@ -0,0 +1,549 @@
+import io
+import os
+import socket
+import struct
+import time
+from collections import namedtuple
+from threading import Condition, Lock, Thread
+from typing import Callable, Iterator, Optional, Union
+from .b_cap_converter import BCapConverter, VarType
+from .b_cap_exception import HResult
+from .b_cap_functions import HANDLE_GETTER_FUNC_IDS
+from .b_cap_metrics import BCapMetrics, _Histogram
+
+# type : BCapRecorder.SESSION, SENT, RECEIVED or DROPPED
+# session : Index of the session in the capture, from 0
+# time : Monotonic time of the record in nanoseconds
+# data : Frame, "protocol endpoint" of a session, or number of dropped frames
+BCapRecord = namedtuple("BCapRecord", ["type", "session", "time", "data"])
+
+
+class BCapRecorder:
+    # Appends the frames sent and received by the transports it is set to
+    # with set_recorder to a capture file. The frames are copied to a buffer
+    # of at most max_buffer_size bytes and written by a thread, so recording
+    # never waits for the disk. Frames that do not fit in the buffer are
+    # dropped and counted in a DROPPED record.
+    #
+    # The capture is a MAGIC header followed by records of a _STRUCT_RECORD
+    # header and the data. A SESSION record starts a connection, and the
+    # records that follow with its session ID belong to it until another
+    # SESSION record reuses the ID.
+
+    MAGIC = b"BCAPCAP\x01"
+
+    SESSION = 0
+    SENT = 1
+    RECEIVED = 2
+    DROPPED = 3
+
+    # B : Type - 1byte(unsigned char)
+    # H : Session ID - 2bytes(unsigned short)
+    # q : Time - 8bytes(long long)
+    # I : Data length - 4bytes(unsigned int)
+    _STRUCT_RECORD = struct.Struct("<BHqI")
+    _STRUCT_DROPPED = struct.Struct("<I")
+
+    def __init__(
+        self,
+        destination: Union[str, os.PathLike, io.RawIOBase],
+        max_buffer_size: int = 4 * 1024 * 1024,
+        flush_interval: float = 0.1,
+    ):
+        # destination is a path, which is appended to, or a binary file object.
+        if max_buffer_size <= 0 or flush_interval <= 0:
+            raise ValueError()
+
+        if isinstance(destination, (str, os.PathLike)):
+            self._file = open(destination, "ab")
+            self._should_close = True
+        else:
+            self._file = destination
+            self._should_close = False
+        if self._file.tell() == 0:
+            self._file.write(BCapRecorder.MAGIC)
+
+        self._max_buffer_size = max_buffer_size
+        self._flush_interval = flush_interval
+        self._lock = Lock()
+        self._condition = Condition(self._lock)
+        self._buffer = bytearray()
+        self._next_session = 0
+        self._dropped = 0
+        self._statistics = {
+            "sessions": 0,
+            "frames": 0,
+            "bytes": 0,
+            "dropped": 0,
+            "dropped_bytes": 0,
+        }
+        self._writing = False
+        self._closing = False
+        self._error = None
+        self._thread = Thread(
+            target=self._write_loop, name="BCapRecorder", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> "BCapRecorder":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def open_session(self, protocol: str, endpoint: str) -> int:
+        # Returns the ID to record the frames of a new connection with.
+        data = "{} {}".format(protocol, endpoint).encode("utf-8")
+        with self._lock:
+            session = self._next_session
+            self._next_session = (session + 1) & 0xFFFF
+            self._statistics["sessions"] += 1
+            self._append(BCapRecorder.SESSION, session, data)
+        return session
+
+    def record(self, session: int, direction: int, *parts) -> None:
+        # Records the frame made of parts, which are bytes-like objects.
+        size = 0
+        for part in parts:
+            size += len(part)
+
+        with self._lock:
+            if (
+                self._closing
+                or len(self._buffer) + BCapRecorder._STRUCT_RECORD.size * 2 + size
+                > self._max_buffer_size
+            ):
+                self._dropped += 1
+                self._statistics["dropped"] += 1
+                self._statistics["dropped_bytes"] += size
+                return
+
+            if self._dropped:
+                self._append(
+                    BCapRecorder.DROPPED,
+                    session,
+                    BCapRecorder._STRUCT_DROPPED.pack(self._dropped),
+                )
+                self._dropped = 0
+            self._append(direction, session, *parts)
+            self._statistics["frames"] += 1
+            self._statistics["bytes"] += size
+            if len(self._buffer) >= self._max_buffer_size // 2:
+                # Written before the interval ends, to leave room.
+                self._condition.notify_all()
+
+    def flush(self) -> None:
+        # Waits until the frames recorded so far are written.
+        with self._condition:
+            while (self._buffer or self._writing) and self._thread.is_alive():
+                self._condition.notify_all()
+                self._condition.wait(self._flush_interval)
+        if self._error is not None:
+            raise self._error
+
+    def close(self) -> None:
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        if self._should_close:
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def get_statistics(self) -> dict:
+        with self._lock:
+            statistics = dict(self._statistics)
+            statistics["buffered_bytes"] = len(self._buffer)
+            return statistics
+
+    def _append(self, record_type: int, session: int, *parts) -> None:
+        size = 0
+        for part in parts:
+            size += len(part)
+        self._buffer += BCapRecorder._STRUCT_RECORD.pack(
+            record_type, session, time.monotonic_ns(), size
+        )
+        for part in parts:
+            self._buffer += part
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closing:
+                    self._condition.wait(self._flush_interval)
+                # The buffer is swapped, not copied, so recording goes on
+                # while it is written.
+                (buffer, self._buffer) = (self._buffer, bytearray())
+                self._writing = len(buffer) > 0
+                closing = self._closing
+
+            if buffer and self._error is None:
+                try:
+                    self._file.write(buffer)
+                    self._file.flush()
+                except Exception as e:
+                    self._error = e
+
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+            if closing and not buffer:
+                break
+
+
+class _ReplaySession:
+    def __init__(self, index: int, protocol: str, endpoint: str):
+        self.index = index
+        self.is_tcp = protocol == "tcp"
+        self.endpoint = endpoint
+        self.records = []
+
+
+class BCapReplayer:
+    # Sends the requests of a capture written by BCapRecorder again, on one
+    # connection per recorded session, and measures the responses. The
+    # handles returned by the server replace the recorded ones in the
+    # requests that follow, so a capture can be replayed against any
+    # controller.
+
+    def __init__(self, source: Union[str, os.PathLike]):
+        self._source = source
+
+    def records(self) -> Iterator[BCapRecord]:
+        with open(self._source, "rb") as f:
+            if f.read(len(BCapRecorder.MAGIC)) != BCapRecorder.MAGIC:
+                raise ValueError("Not a b-CAP capture.")
+
+            sessions = {}
+            count = 0
+            header_size = BCapRecorder._STRUCT_RECORD.size
+            while True:
+                header = f.read(header_size)
+                if len(header) < header_size:
+                    # A capture cut off while it was written ends here.
+                    return
+                (
+                    record_type,
+                    session,
+                    timestamp,
+                    size,
+                ) = BCapRecorder._STRUCT_RECORD.unpack(header)
+                data = f.read(size)
+                if len(data) < size:
+                    return
+
+                if record_type == BCapRecorder.SESSION:
+                    sessions[session] = count
+                    count += 1
+                elif session not in sessions:
+                    continue
+
+                if record_type == BCapRecorder.SESSION:
+                    data = data.decode("utf-8")
+                elif record_type == BCapRecorder.DROPPED:
+                    (data,) = BCapRecorder._STRUCT_DROPPED.unpack(data)
+                yield BCapRecord(record_type, sessions[session], timestamp, data)
+
+    def replay(
+        self,
+        endpoint: Optional[str] = None,
+        speed: float = 1.0,
+        timeout: float = 3.0,
+        remap_handles: bool = True,
+        retry: int = 1,
+    ) -> dict:
+        # Sends the requests at their recorded times divided by speed, or as
+        # fast as possible if speed is 0, to endpoint or to the recorded
+        # endpoints. Returns the counts and the latencies of the responses.
+        # UDP requests unanswered for timeout are sent again up to retry
+        # times, as BCapUdp does.
+        if speed < 0 or retry < 0:
+            raise ValueError()
+
+        sessions = []
+        start = None
+        for record in self.records():
+            if start is None:
+                start = record.time
+            if record.type == BCapRecorder.SESSION:
+                (protocol, _, recorded_endpoint) = record.data.partition(" ")
+                sessions.append(
+                    _ReplaySession(record.session, protocol, recorded_endpoint)
+                )
+            elif record.type in (BCapRecorder.SENT, BCapRecorder.RECEIVED):
+                sessions[record.session].records.append(record)
+
+        histogram = _Histogram()
+        statistics = {
+            "sessions": len(sessions),
+            "requests": 0,
+            "responses": 0,
+            "errors": 0,
+            "lost": 0,
+            "failed_sessions": 0,
+        }
+        lock = Lock()
+        began = time.monotonic_ns()
+
+        def run(session: _ReplaySession) -> None:
+            try:
+                _SessionReplay(
+                    session,
+                    endpoint or session.endpoint,
+                    timeout,
+                    remap_handles,
+                    retry,
+                ).run(start, began, speed, histogram, statistics, lock)
+            except OSError:
+                with lock:
+                    statistics["failed_sessions"] += 1
+
+        threads = [
+            Thread(target=run, args=(session,))
+            for session in sessions
+            if session.records
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        statistics["elapsed"] = (time.monotonic_ns() - began) / 1e9
+        statistics["latency"] = BCapMetrics._summarize(histogram)
+        return statistics
+
+
+class _SessionReplay:
+    # Header, function ID, number of arguments and argument length
+    _FIRST_ARG_OFFSET = 1 + 4 + 2 + 2 + 4 + 2 + 4
+    # H : Type - 2bytes(unsigned short)
+    # I : Number of elements - 4bytes(unsigned int)
+    # i : Handle - 4bytes(int)
+    _STRUCT_HANDLE_ARG = struct.Struct("<HIi")
+    # H : Retry - 2bytes(unsigned short)
+    _STRUCT_RETRY = struct.Struct("<H")
+    _UDP_RECV_BUFFER_SIZE = 1024 * 1024
+    # The number of UDP requests awaiting a response at once, so requests sent
+    # as fast as possible do not overrun the server.
+    _UDP_WINDOW = 8
+
+    def __init__(
+        self,
+        session: _ReplaySession,
+        endpoint: str,
+        timeout: float,
+        remap_handles: bool,
+        retry: int,
+    ):
+        self._session = session
+        self._address = BCapConverter.parse_endpoint(endpoint)
+        self._timeout = timeout
+        self._remap_handles = remap_handles
+        self._retry = retry
+        self._converter = BCapConverter(session.is_tcp, False)
+        self._sock = None
+        self._condition = Condition()
+        # {serial: send time} of the requests waiting for a response
+        self._pending = {}
+        # {serial: [packet, retry count]} of the UDP requests in _pending
+        self._retransmissions = {}
+        self._lost = 0
+        # {serial: (hr, result)} of the responses
+        self._results = {}
+
+    def run(
+        self,
+        start: int,
+        began: int,
+        speed: float,
+        histogram: _Histogram,
+        statistics: dict,
+        lock: Lock,
+    ) -> None:
+        session = self._session
+        converter = BCapConverter(session.is_tcp, False)
+        requests = []
+        recorded_results = {}
+        for record in session.records:
+            try:
+                message = converter.deserialize(record.data)
+            except Exception:
+                continue
+            if record.type == BCapRecorder.SENT:
+                requests.append((record, message))
+            elif message[2] != HResult.S_EXECUTING:
+                recorded_results[message[0]] = message[3][0] if message[3] else None
+
+        if session.is_tcp:
+            self._sock = socket.create_connection(self._address, self._timeout)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # Requests sent as fast as possible can be answered faster than
+            # the receiver runs.
+            self._sock.setsockopt(
+                socket.SOL_SOCKET,
+                socket.SO_RCVBUF,
+                _SessionReplay._UDP_RECV_BUFFER_SIZE,
+            )
+            self._sock.connect(self._address)
+        self._sock.settimeout(self._timeout)
+
+        local = _Histogram()
+        handles = {}
+        receiver = Thread(target=self._recv_loop, args=(local,), daemon=True)
+        receiver.start()
+        try:
+            for record, (serial, version, func_id, args) in requests:
+                if speed > 0:
+                    delay = began + (record.time - start) / speed - time.monotonic_ns()
+                    if delay > 0:
+                        time.sleep(delay / 1e9)
+
+                packet = record.data
+                if args and type(args[0]) is int and args[0] in handles:
+                    packet = self._remap(
+                        packet, serial, version, func_id, args, handles
+                    )
+                if session.is_tcp:
+                    with self._condition:
+                        self._pending.setdefault(serial, time.perf_counter_ns())
+                    self._sock.sendall(packet)
+                else:
+                    self._send_udp(serial, packet)
+
+                if self._remap_handles and func_id in HANDLE_GETTER_FUNC_IDS:
+                    # The handle is needed by the requests that follow.
+                    (_, result) = self._wait(serial)
+                    original = recorded_results.get(serial)
+                    if type(original) is int and type(result) is int:
+                        handles[original] = result
+
+            with self._condition:
+                self._wait_until(lambda: not self._pending)
+                lost = len(self._pending) + self._lost
+                errors = sum(1 for (hr, _) in self._results.values() if hr < 0)
+        finally:
+            try:
+                # The shutdown wakes up the receiver.
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+            receiver.join()
+
+        with lock:
+            statistics["requests"] += len(requests)
+            statistics["responses"] += local.count
+            statistics["errors"] += errors
+            statistics["lost"] += lost
+            histogram.merge(local)
+
+    def _remap(
+        self,
+        packet: bytes,
+        serial: int,
+        version: int,
+        func_id: int,
+        args: list,
+        handles: dict,
+    ) -> bytes:
+        # The handle is patched in place when it is the plain VT_I4 first
+        # argument of an uncompressed frame, so the other arguments are sent
+        # as recorded. Otherwise the request is serialized again.
+        offset = _SessionReplay._FIRST_ARG_OFFSET
+        is_compressed = self._session.is_tcp and packet[-2] == 1
+        if not is_compressed and len(packet) >= offset + 10:
+            (var_type, count, _) = _SessionReplay._STRUCT_HANDLE_ARG.unpack_from(
+                packet, offset
+            )
+            if var_type == VarType.VT_I4 and count == 1:
+                patched = bytearray(packet)
+                _SessionReplay._STRUCT_HANDLE_ARG.pack_into(
+                    patched, offset, var_type, count, handles[args[0]]
+                )
+                return patched
+
+        self._converter.set_compression_parameters(is_compressed)
+        args = [handles[args[0]]] + list(args[1:])
+        return self._converter.serialize(serial, version, func_id, args)
+
+    def _wait(self, serial: int) -> tuple:
+        with self._condition:
+            self._wait_until(lambda: serial in self._results)
+            return self._results.get(serial, (HResult.E_FAIL, None))
+
+    def _send_udp(self, serial: int, packet: bytes) -> None:
+        with self._condition:
+            self._wait_until(lambda: len(self._pending) < _SessionReplay._UDP_WINDOW)
+            if len(self._pending) >= _SessionReplay._UDP_WINDOW:
+                # The requests in the window never got an answer.
+                self._lost += 1
+                return
+            self._pending.setdefault(serial, time.perf_counter_ns())
+            self._retransmissions[serial] = [packet, 0]
+            self._sock.send(packet)
+
+    def _wait_until(self, is_done: Callable[[], bool]) -> None:
+        # Called with the condition held. Gives up when no response arrives
+        # for a whole timeout and no UDP request is left to send again.
+        while not is_done():
+            if not self._condition.wait(self._timeout) and not self._retransmit():
+                return
+
+    def _retransmit(self) -> bool:
+        # Sends the unanswered UDP requests again with their retry count, and
+        # counts those out of retries as lost. Returns whether any was sent.
+        retransmitted = False
+        for serial, entry in list(self._retransmissions.items()):
+            if serial not in self._pending:
+                del self._retransmissions[serial]
+            elif entry[1] >= self._retry:
+                del self._retransmissions[serial]
+                del self._pending[serial]
+                self._lost += 1
+            else:
+                entry[1] += 1
+                packet = bytearray(entry[0])
+                _SessionReplay._STRUCT_RETRY.pack_into(packet, 7, entry[1])
+                self._sock.send(packet)
+                retransmitted = True
+        return retransmitted
+
+    def _recv_loop(self, histogram: _Histogram) -> None:
+        buffer = bytearray()
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+
+            if self._session.is_tcp:
+                buffer += data
+                frames = BCapConverter.extract_frames(buffer)
+            else:
+                frames = [data]
+
+            for frame in frames:
+                try:
+                    (serial, _, hr, args) = self._converter.deserialize(frame)
+                except Exception:
+                    continue
+                if hr == HResult.S_EXECUTING:
+                    continue
+
+                now = time.perf_counter_ns()
+                with self._condition:
+                    sent = self._pending.pop(serial, None)
+                    if sent is None:
+                        continue
+                    self._retransmissions.pop(serial, None)
+                    histogram.record(now - sent)
+                    self._results[serial] = (hr, args[0] if args else None)
+                    self._condition.notify_all()
@@ -0,0 +1,258 @@
+import heapq
+import math
+import queue
+import time
+from collections import namedtuple
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+from .b_cap_client import BCapClient
+
+# item : Item ID returned by BCapSampler.add
+# value : Result of the request, or BCapException if the item failed
+# deadline : Scheduled time of the sample (time.monotonic)
+# timestamp : Time the request was sent (time.monotonic)
+# latency : Round trip time of the request in seconds
+BCapSample = namedtuple(
+    "BCapSample", ["item", "value", "deadline", "timestamp", "latency"]
+)
+
+
+class _SamplerItem:
+    def __init__(
+        self,
+        item_id: int,
+        func_id: int,
+        args: list,
+        period: float,
+        callback: Optional[Callable[[BCapSample], None]],
+    ):
+        self.item_id = item_id
+        self.func_id = func_id
+        self.args = args
+        self.period = period
+        self.callback = callback
+        self.deadline = 0.0
+        self.count = 0
+        self.missed = 0
+        self.errors = 0
+        self.callback_errors = 0
+        self.callback_error = None
+        self.jitter_max = 0.0
+        self.jitter_mean = 0.0
+        self.jitter_m2 = 0.0
+        self.latency_max = 0.0
+        self.latency_mean = 0.0
+
+    def record(self, jitter: float, latency: float) -> None:
+        # Welford's online algorithm keeps the mean and the variance without
+        # holding every sample.
+        self.count += 1
+        delta = jitter - self.jitter_mean
+        self.jitter_mean += delta / self.count
+        self.jitter_m2 += delta * (jitter - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.latency_mean += (latency - self.latency_mean) / self.count
+        self.latency_max = max(self.latency_max, latency)
+
+    def get_statistics(self) -> dict:
+        if self.count > 1:
+            jitter_stdev = math.sqrt(self.jitter_m2 / (self.count - 1))
+        else:
+            jitter_stdev = 0.0
+
+        return {
+            "func_id": self.func_id,
+            "period": self.period,
+            "count": self.count,
+            "missed": self.missed,
+            "errors": self.errors,
+            "callback_errors": self.callback_errors,
+            "callback_error": self.callback_error,
+            "jitter_mean": self.jitter_mean,
+            "jitter_max": self.jitter_max,
+            "jitter_stdev": jitter_stdev,
+            "latency_mean": self.latency_mean,
+            "latency_max": self.latency_max,
+        }
+
+
+class BCapSampler:
+    def __init__(self, client: BCapClient, queue_size: int = 1024, tick=0.001):
+        if queue_size < 1 or tick < 0:
+            raise ValueError()
+
+        self._client = client
+        self._tick = tick
+        self._lock = Lock()
+        self._items = {}
+        self._schedule = []
+        self._next_item_id = 1
+        self._samples = queue.Queue(queue_size)
+        self._dropped = 0
+        self._stop_event = Event()
+        self._wakeup_event = Event()
+        self._thread = None
+
+    def add(
+        self,
+        func_id: int,
+        args: list,
+        period: float,
+        callback: Optional[Callable[[BCapSample], None]] = None,
+    ) -> int:
+        if period <= 0:
+            raise ValueError()
+
+        with self._lock:
+            item_id = self._next_item_id
+            self._next_item_id += 1
+            item = _SamplerItem(item_id, func_id, args, period, callback)
+            item.deadline = time.monotonic()
+            self._items[item_id] = item
+            heapq.heappush(self._schedule, (item.deadline, item_id))
+
+        self._wakeup_event.set()
+        return item_id
+
+    def add_variable(
+        self,
+        handle: int,
+        period: float,
+        callback: Optional[Callable[[BCapSample], None]] = None,
+    ) -> int:
+        # variable_get_value
+        return self.add(101, [handle], period, callback)
+
+    def add_robot_execute(
+        self,
+        handle: int,
+        command: str,
+        period: float,
+        param=None,
+        callback: Optional[Callable[[BCapSample], None]] = None,
+    ) -> int:
+        # robot_execute
+        return self.add(64, [handle, command, param], period, callback)
+
+    def remove(self, item_id: int) -> None:
+        with self._lock:
+            # The schedule entry is skipped lazily once the item is gone.
+            del self._items[item_id]
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._wakeup_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def get(self, timeout: Optional[float] = None) -> BCapSample:
+        return self._samples.get(timeout=timeout)
+
+    def get_statistics(self) -> dict:
+        with self._lock:
+            items = {
+                item_id: item.get_statistics() for item_id, item in self._items.items()
+            }
+
+        return {"items": items, "dropped": self._dropped}
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            with self._lock:
+                if self._schedule:
+                    delay = self._schedule[0][0] - time.monotonic()
+                else:
+                    delay = None
+
+            if delay is None or delay > 0:
+                self._wakeup_event.wait(delay)
+                self._wakeup_event.clear()
+                continue
+
+            self._sample(self._collect_due_items())
+
+    def _collect_due_items(self) -> list:
+        # Every item due within one tick is read in the same batch.
+        now = time.monotonic()
+        due_items = []
+        with self._lock:
+            while self._schedule and self._schedule[0][0] <= now + self._tick:
+                deadline, item_id = heapq.heappop(self._schedule)
+                item = self._items.get(item_id)
+                if item is None or item.deadline != deadline:
+                    continue
+
+                # Periods that have already passed are skipped instead of being
+                # read in a burst, and are counted as missed deadlines.
+                if now - deadline >= item.period:
+                    skipped = int((now - deadline) // item.period)
+                    item.missed += skipped
+                    deadline += skipped * item.period
+
+                due_items.append((item, deadline))
+                item.deadline = deadline + item.period
+                heapq.heappush(self._schedule, (item.deadline, item_id))
+
+        return due_items
+
+    def _sample(self, due_items: list) -> None:
+        if not due_items:
+            return
+
+        timestamp = time.monotonic()
+        try:
+            results = self._client.execute_many(
+                [(item.func_id, item.args) for item, _ in due_items]
+            )
+        except Exception as e:
+            results = [e] * len(due_items)
+        finished = time.monotonic()
+        latency = finished - timestamp
+
+        for (item, deadline), result in zip(due_items, results):
+            with self._lock:
+                if isinstance(result, Exception):
+                    item.errors += 1
+                if finished > deadline + item.period:
+                    # The result arrived after the next deadline.
+                    item.missed += 1
+                item.record(max(timestamp - deadline, 0.0), latency)
+
+            sample = BCapSample(item.item_id, result, deadline, timestamp, latency)
+            if item.callback is None:
+                self._put(sample)
+                continue
+
+            try:
+                item.callback(sample)
+            except Exception as e:
+                # A failing callback must not stop the other items, so its
+                # last exception is kept in the statistics of its item.
+                with self._lock:
+                    item.callback_errors += 1
+                    item.callback_error = e
+
+    def _put(self, sample: BCapSample) -> None:
+        # The oldest sample is dropped when the consumer falls behind, so the
+        # queue always holds the latest telemetry.
+        while True:
+            try:
+                self._samples.put_nowait(sample)
+                return
+            except queue.Full:
+                try:
+                    self._samples.get_nowait()
+                    self._dropped += 1
+                except queue.Empty:
+                    pass
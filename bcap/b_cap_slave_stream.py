@@ -0,0 +1,186 @@
+import gc
+import struct
+import time
+from collections import deque
+from threading import Event, Lock
+from typing import Callable, Iterable, Optional
+from .b_cap_client import BCapClient
+from .b_cap_metrics import BCapMetrics, _Histogram
+
+
+class BCapSlaveStream:
+    # Sends the targets of slave mode to a robot with robot_execute
+    # "slvMove" on a fixed period. The packet is serialized once, and each
+    # cycle only the values of the target are written into it, so a cycle
+    # allocates nothing to encode the request.
+
+    _FUNC_ID = 64  # robot_execute
+    # The targets are sent after sleeping until this long before the cycle,
+    # and then spinning until the cycle starts.
+    _SPIN_TIME = 0.001
+
+    def __init__(
+        self,
+        client: BCapClient,
+        handle: int,
+        period: float = 0.008,
+        size: int = 6,
+        command: str = "slvMove",
+    ):
+        # size is the number of values of a target, such as 6 joints.
+        if period <= 0 or size < 1:
+            raise ValueError()
+
+        self._client = client
+        self._handle = handle
+        self._period = period
+        self._size = size
+        self._struct_target = struct.Struct("<{}d".format(size))
+        # The values are found in the packet by a pattern no target has.
+        marker = [-1e308] * size
+        (self._transport, self._packet) = client.serialize_request(
+            BCapSlaveStream._FUNC_ID, [handle, command, marker]
+        )
+        self._offset = self._packet.rfind(self._struct_target.pack(*marker))
+        if self._offset < 0:
+            raise ValueError("The target is not an array of doubles.")
+
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._reset_statistics()
+
+    def change_mode(self, mode: int) -> any:
+        # Enters slave mode with mode, such as 0x202 for joint targets in
+        # mode 2, or leaves it with 0.
+        return self._client.robot_execute(self._handle, "slvChangeMode", mode)
+
+    def run(
+        self,
+        targets: Iterable,
+        callback: Optional[Callable[[int, any], None]] = None,
+        disable_gc: bool = True,
+    ) -> dict:
+        # Sends a target every period until targets is exhausted or stop is
+        # called, and returns the statistics. callback is called with the
+        # cycle number and the result of each slvMove.
+        #
+        # A deque of targets is used as a ring buffer filled by another
+        # thread: a target is taken from its left end each cycle, and the
+        # last target is sent again while it is empty.
+        #
+        # A cycle that starts before the previous one has returned is an
+        # overrun, and is sent at once. Cycles whose whole period has passed
+        # are skipped rather than sent in a burst, and are counted as missed.
+        # The garbage collector is disabled while the stream runs unless
+        # disable_gc is False.
+        self._stop_event.clear()
+        is_gc_enabled = gc.isenabled()
+        if disable_gc:
+            gc.disable()
+        try:
+            if isinstance(targets, deque):
+                self._run(self._drain(targets), callback)
+            else:
+                self._run(iter(targets), callback)
+        finally:
+            if disable_gc and is_gc_enabled:
+                gc.enable()
+
+        return self.get_statistics()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def get_statistics(self) -> dict:
+        # rtt is the round trip of slvMove, lateness is how late each cycle
+        # was sent, and jitter is the mean difference between consecutive
+        # round trips, all in seconds.
+        with self._lock:
+            return {
+                "period": self._period,
+                "cycles": self._cycles,
+                "overruns": self._overruns,
+                "missed": self._missed,
+                "held": self._held,
+                "rtt": BCapMetrics._summarize(self._rtt),
+                "lateness": BCapMetrics._summarize(self._lateness),
+                "jitter": self._jitter_sum / 1e9 / max(self._cycles - 1, 1),
+                "jitter_max": self._jitter_max / 1e9,
+            }
+
+    def reset_statistics(self) -> None:
+        with self._lock:
+            self._reset_statistics()
+
+    def _reset_statistics(self) -> None:
+        self._cycles = 0
+        self._overruns = 0
+        self._missed = 0
+        self._held = 0
+        self._rtt = _Histogram()
+        self._lateness = _Histogram()
+        self._jitter_sum = 0
+        self._jitter_max = 0
+
+    def _drain(self, targets: deque):
+        target = None
+        while True:
+            try:
+                target = targets.popleft()
+            except IndexError:
+                if target is None:
+                    # Nothing to hold yet.
+                    yield None
+                    continue
+                with self._lock:
+                    self._held += 1
+            yield target
+
+    def _run(self, targets, callback: Optional[Callable[[int, any], None]]) -> None:
+        period = int(self._period * 1e9)
+        spin = int(BCapSlaveStream._SPIN_TIME * 1e9)
+        pack_into = self._struct_target.pack_into
+        request = self._transport.request_serialized
+        packet = self._packet
+        offset = self._offset
+        previous_rtt = None
+        deadline = time.perf_counter_ns()
+        for target in targets:
+            if self._stop_event.is_set():
+                break
+
+            if target is not None:
+                pack_into(packet, offset, *target)
+                started = time.perf_counter_ns()
+                result = request(BCapSlaveStream._FUNC_ID, packet)
+                finished = time.perf_counter_ns()
+
+                rtt = finished - started
+                with self._lock:
+                    cycle = self._cycles
+                    self._cycles += 1
+                    self._rtt.record(rtt)
+                    self._lateness.record(max(started - deadline, 0))
+                    if previous_rtt is not None:
+                        jitter = abs(rtt - previous_rtt)
+                        self._jitter_sum += jitter
+                        self._jitter_max = max(self._jitter_max, jitter)
+                previous_rtt = rtt
+                if callback is not None:
+                    callback(cycle, result)
+
+            deadline += period
+            now = time.perf_counter_ns()
+            if now > deadline:
+                skipped = (now - deadline) // period
+                with self._lock:
+                    self._overruns += 1
+                    self._missed += skipped
+                deadline += skipped * period
+                continue
+
+            remaining = deadline - now
+            if remaining > spin:
+                self._stop_event.wait((remaining - spin) / 1e9)
+            while time.perf_counter_ns() < deadline:
+                pass
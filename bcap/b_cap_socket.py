@@ -1,4 +1,8 @@
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import Future
+from typing import Callable, Optional, Tuple
+from .b_cap_metrics import BCapMetrics
+from .b_cap_recorder import BCapRecorder
 
 
 class BCapSocket(metaclass=ABCMeta):
@@ -14,6 +18,71 @@ class BCapSocket(metaclass=ABCMeta):
     def request(self, func_id: int, args: list) -> any:
         pass
 
+    @abstractmethod
+    def request_into(
+        self, func_id: int, args: list, sink: Callable[[any], None]
+    ) -> any:
+        pass
+
+    @abstractmethod
+    def request_from(
+        self,
+        func_id: int,
+        args: list,
+        payload: any,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> any:
+        pass
+
+    @abstractmethod
+    def serialize_request(
+        self, func_id: int, args: list
+    ) -> Tuple["BCapSocket", bytearray]:
+        pass
+
+    @abstractmethod
+    def request_serialized(self, func_id: int, packet: bytearray) -> any:
+        pass
+
+    @abstractmethod
+    def execute_many(self, requests: list) -> list:
+        pass
+
+    def submit(self, func_id: int, args: list) -> Future:
+        future = Future()
+        try:
+            future.set_result(self.request(func_id, args))
+        except Exception as e:
+            future.set_exception(e)
+
+        return future
+
+    @abstractmethod
+    def set_metrics(self, metrics: Optional[BCapMetrics]) -> None:
+        pass
+
+    @abstractmethod
+    def set_recorder(self, recorder: Optional[BCapRecorder]) -> None:
+        pass
+
+    def _measure(
+        self, func_id: int, exchange: Callable[..., Tuple[int, any]], *args
+    ) -> Tuple[int, any]:
+        # Runs exchange with its request recorded to the metrics. The send
+        # and receive methods fill in the measurement while it is set.
+        # A transport with metrics keeps the BCapMetrics set to it in
+        # _metrics and the measurement of the request in _measurement.
+        metrics = self._metrics
+        self._measurement = metrics.begin(func_id)
+        hr = None
+        try:
+            (hr, deserialized_result) = exchange(*args)
+        finally:
+            metrics.end(self._measurement, hr is None or hr < 0)
+            self._measurement = None
+
+        return (hr, deserialized_result)
+
     @abstractmethod
     def get_timeout(self) -> float:
         pass
@@ -27,5 +96,31 @@ class BCapSocket(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def set_compression(self, enable: bool, level: int = -1) -> None:
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def get_compression_statistics(self) -> dict:
+        pass
+
+    @abstractmethod
+    def set_array_type(self, array_type: str) -> None:
+        pass
+
+    @abstractmethod
+    def set_pipelining(self, enable: bool, window: int = 8) -> None:
+        pass
+
+    @abstractmethod
+    def set_max_message_size(self, size: Optional[int]) -> None:
+        pass
+
+    @abstractmethod
+    def get_retry_statistics(self) -> dict:
+        pass
+
+    @abstractmethod
+    def get_route_statistics(self) -> dict:
         pass
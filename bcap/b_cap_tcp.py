@@ -1,20 +1,68 @@
+import select
 import socket
 import struct
-from threading import RLock
-from typing import Tuple
-from .b_cap_exception import HResult
+import time
+import zlib
+from concurrent.futures import Future, wait
+from threading import Lock, RLock, Semaphore, Thread
+from typing import Callable, Optional, Tuple
+from .b_cap_exception import HResult, BCapException
 from .b_cap_converter import BCapConverter
+from .b_cap_metrics import BCapMetrics, _Measurement
+from .b_cap_recorder import BCapRecorder
 from .b_cap_socket import BCapSocket
 
 
 class BCapTcp(BCapSocket):
+
+    _SOH = BCapConverter.BCAP_SOH[0]
+    _EOT = BCapConverter.BCAP_EOT[0]
+    # SOH and message length
+    _HEADER_SIZE = 1 + 4
+    # Header, serial, version, return code, number of args and EOT
+    _MIN_MESSAGE_SIZE = 1 + 4 + 2 + 2 + 4 + 2 + 1
+    _INITIAL_BUFFER_SIZE = 4096
+    # Frames of at least this size are decompressed while they are received.
+    _STREAM_MIN_SIZE = 64 * 1024
+    _STREAM_CHUNK_SIZE = 64 * 1024
+    # A receive buffer grown beyond this size is shrunk once it is idle.
+    _MAX_IDLE_BUFFER_SIZE = 1024 * 1024
+    # Header, serial, version, uncompressed data length and zlib header
+    _STREAM_PROBE_SIZE = 1 + 4 + 2 + 2 + 4 + 2
+    _STRUCT_LENGTH = struct.Struct("<I")
+    _STRUCT_SERIAL_VERSION = struct.Struct("<HH")
+    _PIPELINE_WINDOW_MAX = 0xFFFE
+    # Serial numbers run from 1 to 0xFFFF.
+    _MAX_BATCH_SIZE = 0xFFFE
+
     def __init__(self, should_return_hr: bool):
         self._version = 1
         self._sock = None
+        self._should_return_hr = should_return_hr
+        self._max_message_size = None
+        self._metrics = None
+        self._measurement = None
+        self._recorder = None
+        self._record_session = None
         self._lock = RLock()
         self._bcap_converter = BCapConverter(True, should_return_hr)
-        self._recv_buffer = []
+        # Serialized requests are patched in place, so they are never
+        # compressed.
+        self._plain_converter = BCapConverter(True, should_return_hr)
+        self._recv_buffer = bytearray(BCapTcp._INITIAL_BUFFER_SIZE)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._recv_size = 0
+        self._recv_frame_length = 0
         self._send_flags = 0
+        self._pipeline_window = 0
+        self._pipeline_thread = None
+        self._pipeline_semaphore = None
+        self._pipeline_wakeup = None
+        self._pipeline_stopping = False
+        self._pipeline_error = None
+        self._pending_lock = Lock()
+        self._pending = {}
+        self._batch_lock = Lock()
 
         if hasattr(socket, "MSG_NOSIGNAL"):
             self._send_flags |= socket.MSG_NOSIGNAL
@@ -27,6 +75,10 @@ class BCapTcp(BCapSocket):
                 self.set_timeout(timeout)
                 host, port = BCapConverter.parse_endpoint(endpoint)
                 self._sock.connect((host, port))
+                if self._recorder is not None:
+                    self._open_record_session()
+                if self._pipeline_window > 0:
+                    self._start_pipeline()
             except Exception as e:
                 self.disconnect()
                 raise e
@@ -40,9 +92,14 @@ class BCapTcp(BCapSocket):
                 except Exception:
                     pass
 
+                # The shutdown wakes up the reader thread if it is receiving.
+                self._stop_pipeline(ConnectionAbortedError("Disconnected."))
                 self._sock.close()
                 self._sock = None
 
+            self._recv_size = 0
+            self._recv_frame_length = 0
+
     def set_timeout(self, timeout: float) -> None:
         with self._lock:
             self._sock.settimeout(timeout)
@@ -53,71 +110,919 @@ class BCapTcp(BCapSocket):
     def set_retry(self, retry: int) -> None:
         raise NotImplementedError()
 
-    def set_compression(self, enable: bool, level: int = -1) -> None:
+    def get_retry_statistics(self) -> dict:
+        raise NotImplementedError()
+
+    def get_route_statistics(self) -> dict:
+        raise NotImplementedError()
+
+    def set_compression(
+        self, enable: bool, level: int = -1, threshold: int = 0, adaptive: bool = False
+    ) -> None:
+        with self._lock:
+            self._bcap_converter.set_compression_parameters(
+                enable, level, threshold, adaptive
+            )
+
+    def get_compression_statistics(self) -> dict:
         with self._lock:
-            self._bcap_converter.set_compression_parameters(enable, level)
+            return self._bcap_converter.get_compression_statistics()
+
+    def set_array_type(self, array_type: str) -> None:
+        with self._lock:
+            self._bcap_converter.set_array_type(array_type)
+
+    def set_metrics(self, metrics: Optional[BCapMetrics]) -> None:
+        with self._lock:
+            self._metrics = metrics
+
+    def set_recorder(self, recorder: Optional[BCapRecorder]) -> None:
+        # The frames are recorded from the next one. None stops recording.
+        with self._lock:
+            self._recorder = recorder
+            self._record_session = None
+            if recorder is not None and self._sock:
+                self._open_record_session()
+
+    def set_max_message_size(self, size: Optional[int]) -> None:
+        # Responses longer than size bytes are not buffered. They are drained
+        # from the socket and fail with E_OUTOFMEMORY, except the payload of
+        # request_into, which is never buffered as a whole. None is no limit.
+        if size is not None and size < BCapTcp._MIN_MESSAGE_SIZE:
+            raise ValueError()
+
+        with self._lock:
+            self._max_message_size = size
+
+    def set_pipelining(self, enable: bool, window: int = 8) -> None:
+        if window < 1 or window > BCapTcp._PIPELINE_WINDOW_MAX:
+            raise ValueError()
+
+        with self._lock:
+            # Let the requests in flight complete before the reader stops.
+            with self._pending_lock:
+                pending = [future for (future, _) in self._pending.values()]
+            wait(pending)
+            self._stop_pipeline(ConnectionAbortedError("Pipelining was reset."))
+
+            if enable:
+                self._pipeline_window = window
+                if self._sock:
+                    self._start_pipeline()
+            else:
+                self._pipeline_window = 0
 
     def request(self, func_id: int, args: list) -> any:
         with self._lock:
-            serial = self._serial
-            self._send(serial, self._version, func_id, args)
-            if self._serial >= 0xFFFF:
-                self._serial = 1
+            if self._pipeline_thread is None:
+                if self._metrics is None:
+                    (hr, deserialized_result) = self._exchange(func_id, args)
+                else:
+                    (hr, deserialized_result) = self._measure(
+                        func_id, self._exchange, func_id, args
+                    )
+
+                return self._bcap_converter.create_response_object(
+                    hr, deserialized_result
+                )
+
+        return self.submit(func_id, args).result()
+
+    def request_into(
+        self, func_id: int, args: list, sink: Callable[[any], None]
+    ) -> any:
+        # A byte array or string result is passed to sink chunk by chunk as it
+        # is received, and its length in bytes is returned in its place.
+        with self._lock:
+            if self._pipeline_thread is None:
+                if self._metrics is None:
+                    (hr, deserialized_result) = self._exchange_into(
+                        func_id, args, sink
+                    )
+                else:
+                    (hr, deserialized_result) = self._measure(
+                        func_id, self._exchange_into, func_id, args, sink
+                    )
+
+                return self._bcap_converter.create_response_object(
+                    hr, deserialized_result
+                )
+
+        # The reader thread of the pipeline receives whole frames.
+        result = self.request(func_id, args)
+        if self._should_return_hr:
+            return (result[0], BCapTcp._sink_value(result[1], sink))
+        return BCapTcp._sink_value(result, sink)
+
+    def request_from(
+        self,
+        func_id: int,
+        args: list,
+        payload: any,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> any:
+        # payload is appended to args as a byte array and sent from its own
+        # buffer, such as a memory-mapped file, without being copied.
+        # progress is called with the number of payload bytes sent.
+        view = memoryview(payload).cast("B")
+        with self._lock:
+            if self._pipeline_thread is None:
+                if self._metrics is None:
+                    (hr, deserialized_result) = self._exchange_from(
+                        func_id, args, view, progress
+                    )
+                else:
+                    (hr, deserialized_result) = self._measure(
+                        func_id, self._exchange_from, func_id, args, view, progress
+                    )
+
+                return self._bcap_converter.create_response_object(
+                    hr, deserialized_result
+                )
+
+        result = self.request(func_id, list(args) + [bytes(view)])
+        if progress is not None:
+            progress(len(view))
+        return result
+
+    def serialize_request(
+        self, func_id: int, args: list
+    ) -> Tuple[BCapSocket, bytearray]:
+        # Returns the transport to send the request with request_serialized
+        # and the uncompressed packet, whose argument values may be patched in
+        # place between requests.
+        with self._lock:
+            packet = self._plain_converter.serialize(0, self._version, func_id, args)
+        return (self, bytearray(packet))
+
+    def request_serialized(self, func_id: int, packet: bytearray) -> any:
+        # The serial number is written to packet, which is sent as it is.
+        with self._lock:
+            if self._pipeline_thread is None:
+                if self._metrics is None:
+                    (hr, deserialized_result) = self._exchange_serialized(packet)
+                else:
+                    (hr, deserialized_result) = self._measure(
+                        func_id, self._exchange_serialized, packet
+                    )
+
+                return self._bcap_converter.create_response_object(
+                    hr, deserialized_result
+                )
+
+        return self._submit(
+            func_id,
+            lambda serial, measurement: self._send_serialized(
+                serial, packet, measurement
+            ),
+        ).result()
+
+    def submit(self, func_id: int, args: list) -> Future:
+        if self._pipeline_thread is None or self._pipeline_semaphore is None:
+            return super().submit(func_id, args)
+
+        return self._submit(
+            func_id,
+            lambda serial, measurement: self._send(
+                serial, self._version, func_id, args, measurement
+            ),
+        )
+
+    def _submit(
+        self, func_id: int, send: Callable[[int, Optional[_Measurement]], None]
+    ) -> Future:
+        semaphore = self._pipeline_semaphore
+        if self._pipeline_thread is None or semaphore is None:
+            raise ConnectionAbortedError("Pipelining was reset.")
+
+        # Wait for a free slot in the window before sending.
+        semaphore.acquire()
+        future = Future()
+        try:
+            with self._lock:
+                if semaphore is not self._pipeline_semaphore:
+                    raise ConnectionAbortedError("Pipelining was reset.")
+                if self._pipeline_error is not None:
+                    raise self._pipeline_error
+
+                serial = self._next_serial()
+                # The measurement is kept with the future, and the reader
+                # thread adds the frames of the response to it by serial
+                # number.
+                metrics = self._metrics
+                if metrics is None:
+                    measurement = None
+                else:
+                    measurement = metrics.begin(func_id)
+                with self._pending_lock:
+                    self._pending[serial] = (future, measurement)
+                try:
+                    send(serial, measurement)
+                except Exception:
+                    with self._pending_lock:
+                        self._pending.pop(serial, None)
+                    raise
+        except Exception:
+            semaphore.release()
+            raise
+
+        if metrics is not None:
+            future.add_done_callback(
+                lambda f: metrics.end(measurement, BCapTcp._is_failed(f))
+            )
+
+        return future
+
+    def execute_many(self, requests: list) -> list:
+        with self._lock:
+            if self._pipeline_thread is None:
+                return self._execute_many(requests)
+
+        results = []
+        for future in self._submit_many(requests):
+            exception = future.exception()
+            if exception is None:
+                results.append(future.result())
+            elif isinstance(exception, BCapException):
+                results.append(exception)
             else:
-                self._serial += 1
+                raise exception
 
-            (hr, deserialized_result) = self._recv(serial)
+        return results
 
-            return self._bcap_converter.create_response_object(hr, deserialized_result)
+    def _execute_many(self, requests: list) -> list:
+        # The batch is sent in chunks that fit in the serial number space, so
+        # no two requests in flight share a serial number.
+        results = []
+        for start in range(0, len(requests), BCapTcp._MAX_BATCH_SIZE):
+            results += self._execute_chunk(
+                requests[start : start + BCapTcp._MAX_BATCH_SIZE]
+            )
+        return results
 
-    def _send(self, serial: int, version: int, func_id: int, args: list) -> None:
-        serialized_packet = self._bcap_converter.serialize(
-            serial, version, func_id, args
+    def _execute_chunk(self, requests: list) -> list:
+        results = [None] * len(requests)
+        waiting = {}
+        packets = []
+        for index, (func_id, args) in enumerate(requests):
+            try:
+                packet = self._bcap_converter.serialize(
+                    self._serial, self._version, func_id, args
+                )
+            except BCapException as e:
+                results[index] = e
+                continue
+
+            waiting[self._next_serial()] = index
+            packets.append(packet)
+
+        if self._recorder is not None:
+            for packet in packets:
+                self._recorder.record(self._record_session, BCapRecorder.SENT, packet)
+
+        # All packets go out with a single send, then the responses are
+        # matched by serial number in whatever order they arrive.
+        self._sock.sendall(b"".join(packets), self._send_flags)
+
+        while waiting:
+            (
+                recv_serial,
+                version,
+                hr,
+                deserialized_args,
+            ) = self._recv_message()
+            if hr == HResult.S_EXECUTING:
+                continue
+
+            index = waiting.pop(recv_serial, None)
+            if index is None:
+                continue
+
+            if deserialized_args is None:
+                deserialized_result = None
+            else:
+                deserialized_result = deserialized_args[0]
+            results[index] = self._bcap_converter.create_batch_response_object(
+                hr, deserialized_result
+            )
+
+        return results
+
+    def _submit_many(self, requests: list) -> list:
+        semaphore = self._pipeline_semaphore
+        if semaphore is None:
+            raise ConnectionAbortedError("Pipelining was reset.")
+
+        futures = []
+        # Only one batch at a time collects window slots, otherwise two batches
+        # holding part of the window each could wait for each other forever.
+        with self._batch_lock:
+            for start in range(0, len(requests), self._pipeline_window):
+                chunk = requests[start : start + self._pipeline_window]
+                for _ in chunk:
+                    semaphore.acquire()
+
+                packets = []
+                serials = []
+                with self._lock:
+                    if semaphore is not self._pipeline_semaphore:
+                        for _ in chunk:
+                            semaphore.release()
+                        raise ConnectionAbortedError("Pipelining was reset.")
+
+                    for func_id, args in chunk:
+                        future = Future()
+                        futures.append(future)
+                        try:
+                            packet = self._bcap_converter.serialize(
+                                self._serial, self._version, func_id, args
+                            )
+                        except BCapException as e:
+                            semaphore.release()
+                            future.set_exception(e)
+                            continue
+
+                        serial = self._next_serial()
+                        with self._pending_lock:
+                            self._pending[serial] = (future, None)
+                        serials.append(serial)
+                        packets.append(packet)
+
+                    try:
+                        if self._recorder is not None:
+                            for packet in packets:
+                                self._recorder.record(
+                                    self._record_session, BCapRecorder.SENT, packet
+                                )
+                        self._sock.sendall(b"".join(packets), self._send_flags)
+                    except Exception as e:
+                        for serial in serials:
+                            with self._pending_lock:
+                                entry = self._pending.pop(serial, None)
+                            if entry is not None:
+                                semaphore.release()
+                                entry[0].set_exception(e)
+
+        return futures
+
+    def _next_serial(self) -> int:
+        serial = self._serial
+        if self._serial >= 0xFFFF:
+            self._serial = 1
+        else:
+            self._serial += 1
+
+        return serial
+
+    def _start_pipeline(self) -> None:
+        self._pipeline_semaphore = Semaphore(self._pipeline_window)
+        self._pipeline_wakeup = socket.socketpair()
+        self._pipeline_stopping = False
+        self._pipeline_error = None
+        self._pipeline_thread = Thread(
+            target=self._pipeline_loop,
+            args=(self._sock, self._pipeline_wakeup[0]),
+            daemon=True,
         )
-        self._sock.sendall(serialized_packet, self._send_flags)
+        self._pipeline_thread.start()
 
-    def _recv(self, serial: int) -> Tuple[int, any]:
-        recv_buffer = b""
+    def _stop_pipeline(self, error: Exception) -> None:
+        if self._pipeline_thread is None:
+            return
 
-        while True:
-            buffer_size = len(recv_buffer)
-            if buffer_size < 1:
-                recv_buffer = self._sock.recv(1)
+        self._pipeline_stopping = True
+        self._pipeline_wakeup[1].send(b"\0")
+        self._pipeline_thread.join()
+        self._pipeline_thread = None
+        for sock in self._pipeline_wakeup:
+            sock.close()
+        self._pipeline_wakeup = None
+        self._fail_pending(error)
+        self._pipeline_semaphore = None
+
+    def _pipeline_loop(self, sock: socket.socket, wakeup: socket.socket) -> None:
+        # While pipelining, _measurement belongs to this thread and measures
+        # the frame being received, which is then added to the measurement
+        # of its request.
+        try:
+            self._receive_pipelined(sock, wakeup)
+        finally:
+            self._measurement = None
+
+    def _receive_pipelined(self, sock: socket.socket, wakeup: socket.socket) -> None:
+        while not self._pipeline_stopping:
+            metrics = self._metrics
+            frame = None if metrics is None else metrics.begin(None)
+            self._measurement = frame
+            try:
+                with self._pending_lock:
+                    is_idle = len(self._pending) == 0
+                if is_idle and self._recv_size == 0:
+                    # Nothing is awaited, so block without the socket timeout
+                    # until data arrives or the pipeline is stopped.
+                    readable, _, _ = select.select([sock, wakeup], [], [])
+                    if wakeup in readable:
+                        break
+
+                (
+                    recv_serial,
+                    version,
+                    hr,
+                    deserialized_args,
+                ) = self._recv_message()
+            except socket.timeout as e:
+                # No data arrived for a whole timeout period while requests
+                # are outstanding.
+                self._fail_pending(e)
+                continue
+            except Exception as e:
+                if self._recv_frame_length > 0:
+                    # The frame was received whole but could not be
+                    # deserialized, so only its request fails and the stream
+                    # is still in step.
+                    (recv_serial, _) = BCapTcp._STRUCT_SERIAL_VERSION.unpack_from(
+                        self._recv_buffer, 5
+                    )
+                    self._fail_serial(recv_serial, e)
+                    continue
+
+                # A socket or framing error breaks the stream.
+                self._pipeline_error = e
+                self._fail_pending(e)
+                break
 
-            if recv_buffer[:1] != BCapConverter.BCAP_SOH:
-                # Can not receive b-CAP SOH.
-                recv_buffer = recv_buffer[1:]
+            if hr == HResult.S_EXECUTING:
+                with self._pending_lock:
+                    entry = self._pending.get(recv_serial)
+                if entry is not None and entry[1] is not None and frame is not None:
+                    entry[1].add_frame(frame)
+                    entry[1].on_keepalive()
                 continue
 
-            buffer_size = len(recv_buffer)
-            if buffer_size < 5:
-                recv_buffer = b"".join([recv_buffer, self._sock.recv(5 - buffer_size)])
+            with self._pending_lock:
+                entry = self._pending.pop(recv_serial, None)
+            if entry is None:
+                continue
+            self._pipeline_semaphore.release()
 
-            # Receive b-CAP message length.
-            (message_length,) = struct.unpack("<I", recv_buffer[1:5])
+            (future, measurement) = entry
+            if measurement is not None and frame is not None:
+                measurement.add_frame(frame)
 
-            buffer_size = len(recv_buffer)
-            if buffer_size < message_length:
-                recv_buffer = b"".join(
-                    [recv_buffer, self._sock.recv(message_length - buffer_size)]
+            if deserialized_args is None:
+                deserialized_result = None
+            else:
+                deserialized_result = deserialized_args[0]
+
+            try:
+                future.set_result(
+                    self._bcap_converter.create_response_object(
+                        hr, deserialized_result
+                    )
                 )
+            except Exception as e:
+                future.set_exception(e)
 
-            if recv_buffer[-1:] != BCapConverter.BCAP_EOT:
-                # Can not receive b-CAP EOT.
-                continue
+    def _fail_serial(self, serial: int, error: Exception) -> None:
+        with self._pending_lock:
+            entry = self._pending.pop(serial, None)
+        if entry is not None:
+            self._pipeline_semaphore.release()
+            entry[0].set_exception(error)
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+
+        for future, _ in pending.values():
+            self._pipeline_semaphore.release()
+            future.set_exception(error)
+
+    def _exchange(self, func_id: int, args: list) -> Tuple[int, any]:
+        serial = self._next_serial()
+        self._send(serial, self._version, func_id, args, self._measurement)
+        return self._recv(serial)
+
+    def _exchange_serialized(self, packet: bytearray) -> Tuple[int, any]:
+        serial = self._next_serial()
+        self._send_serialized(serial, packet, self._measurement)
+        return self._recv(serial)
+
+    def _exchange_into(
+        self, func_id: int, args: list, sink: Callable[[any], None]
+    ) -> Tuple[int, any]:
+        serial = self._next_serial()
+        self._send(serial, self._version, func_id, args, self._measurement)
+        return self._recv_into(serial, sink)
+
+    def _exchange_from(
+        self,
+        func_id: int,
+        args: list,
+        payload: memoryview,
+        progress: Optional[Callable[[int], None]],
+    ) -> Tuple[int, any]:
+        serial = self._next_serial()
+        self._send_with_payload(serial, func_id, args, payload, progress)
+        return self._recv(serial)
+
+    @staticmethod
+    def _is_failed(future: Future) -> bool:
+        if future.exception() is not None:
+            return True
+        result = future.result()
+        return isinstance(result, tuple) and result[0] < 0
 
+    def _send(
+        self,
+        serial: int,
+        version: int,
+        func_id: int,
+        args: list,
+        measurement: Optional[_Measurement],
+    ) -> None:
+        if measurement is not None:
+            started = time.perf_counter_ns()
+        serialized_packet = self._bcap_converter.serialize(
+            serial, version, func_id, args
+        )
+        if measurement is not None:
+            measurement.on_send(started, len(serialized_packet))
+        if self._recorder is not None:
+            self._recorder.record(
+                self._record_session, BCapRecorder.SENT, serialized_packet
+            )
+        self._sock.sendall(serialized_packet, self._send_flags)
+
+    def _send_serialized(
+        self, serial: int, packet: bytearray, measurement: Optional[_Measurement]
+    ) -> None:
+        BCapTcp._STRUCT_SERIAL_VERSION.pack_into(packet, 5, serial, self._version)
+        if measurement is not None:
+            measurement.on_send(None, len(packet))
+        if self._recorder is not None:
+            self._recorder.record(self._record_session, BCapRecorder.SENT, packet)
+        self._sock.sendall(packet, self._send_flags)
+
+    def _send_with_payload(
+        self,
+        serial: int,
+        func_id: int,
+        args: list,
+        payload: memoryview,
+        progress: Optional[Callable[[int], None]],
+    ) -> None:
+        measurement = self._measurement
+        if measurement is not None:
+            started = time.perf_counter_ns()
+        (head, tail) = self._bcap_converter.serialize_with_payload(
+            serial, self._version, func_id, args, len(payload)
+        )
+        if measurement is not None:
+            measurement.on_send(started, len(head) + len(payload) + len(tail))
+        if self._recorder is not None:
+            self._recorder.record(
+                self._record_session, BCapRecorder.SENT, head, payload, tail
+            )
+        self._sock.sendall(head, self._send_flags)
+        for offset in range(0, len(payload), BCapTcp._STREAM_CHUNK_SIZE):
+            chunk = payload[offset : offset + BCapTcp._STREAM_CHUNK_SIZE]
+            self._sock.sendall(chunk, self._send_flags)
+            if progress is not None:
+                progress(offset + len(chunk))
+        self._sock.sendall(tail, self._send_flags)
+
+    def _recv(self, serial: int) -> Tuple[int, any]:
+        while True:
             (
                 recv_serial,
                 version,
                 hr,
                 deserialized_args,
-            ) = self._bcap_converter.deserialize(recv_buffer)
+            ) = self._recv_message()
 
-            recv_buffer = b""
-            if (recv_serial == serial) and (hr != HResult.S_EXECUTING):
-                break
+            if recv_serial == serial:
+                if hr != HResult.S_EXECUTING:
+                    break
+                if self._measurement is not None:
+                    self._measurement.on_keepalive()
 
         if deserialized_args is None:
             return (hr, None)
 
         return (hr, deserialized_args[0])
+
+    def _recv_into(
+        self, serial: int, sink: Callable[[any], None]
+    ) -> Tuple[int, any]:
+        while True:
+            self._recv_release()
+            message_length = self._recv_header()
+            self._recv_fill(BCapTcp._STREAM_PROBE_SIZE)
+            (recv_serial, version) = BCapTcp._STRUCT_SERIAL_VERSION.unpack_from(
+                self._recv_buffer, 1 + 4
+            )
+            body = BCapConverter._STRUCT_RECV_HEADER.size
+            if recv_serial == serial:
+                # An uncompressed response with the one value has 1 as the
+                # number of args, which a zlib header never starts with, so the
+                # mode is known before the end of the frame. A response without
+                # args may lack the mode and is received as a whole.
+                argc = self._recv_buffer[body + 4 : body + 6]
+                if argc == b"\x01\x00":
+                    is_compressed = False
+                elif BCapConverter.is_compressed_stream(self._recv_buffer, body):
+                    is_compressed = True
+                else:
+                    is_compressed = None
+
+                if is_compressed is not None:
+                    (hr, deserialized_args) = self._recv_streamed(
+                        message_length, is_compressed, sink
+                    )
+                    if hr == HResult.S_EXECUTING:
+                        if self._measurement is not None:
+                            self._measurement.on_keepalive()
+                        continue
+                    if deserialized_args is None:
+                        return (hr, None)
+                    return (hr, deserialized_args[0])
+
+            message = self._recv_body(message_length)
+            if message is None:
+                continue
+
+            (recv_serial, version, hr, deserialized_args) = message
+            if recv_serial != serial:
+                continue
+            if hr == HResult.S_EXECUTING:
+                if self._measurement is not None:
+                    self._measurement.on_keepalive()
+                continue
+
+            if deserialized_args is None:
+                return (hr, None)
+            return (hr, BCapTcp._sink_value(deserialized_args[0], sink))
+
+    def _recv_streamed(
+        self, message_length: int, is_compressed: bool, sink: Callable[[any], None]
+    ) -> Tuple[int, list]:
+        # The frame is read from the buffer and then straight from the socket
+        # in bounded chunks, so it is never buffered as a whole.
+        body = BCapConverter._STRUCT_RECV_HEADER.size
+        # Mode and footer
+        end = message_length - 2
+        if is_compressed:
+            # The uncompressed data length is not used.
+            source = self._recv_source(body + 4, end)
+        else:
+            source = self._recv_source(body, end)
+
+        try:
+            (hr, deserialized_args) = self._bcap_converter.deserialize_into(
+                source, is_compressed, sink
+            )
+        except Exception:
+            # The rest of the frame is drained to keep the stream in sync.
+            for _ in iter(source, b""):
+                pass
+            self._recv_trailer(message_length)
+            raise
+
+        mode = self._recv_trailer(message_length)
+        if mode != (1 if is_compressed else 0):
+            raise BCapException(HResult.E_INVALID_PACKET, "Invalid mode.")
+
+        return (hr, deserialized_args)
+
+    def _recv_source(self, start: int, end: int) -> Callable[[], memoryview]:
+        position = start
+        chunk = None
+
+        def source() -> memoryview:
+            nonlocal position, chunk
+            if position >= end:
+                return b""
+
+            if position < self._recv_size:
+                # The part of the frame that is already buffered.
+                chunk_start = position
+                position = min(self._recv_size, end)
+                return self._recv_view[chunk_start:position]
+
+            if chunk is None:
+                chunk = memoryview(
+                    bytearray(min(BCapTcp._STREAM_CHUNK_SIZE, end - position))
+                )
+            view = chunk[: min(len(chunk), end - position)]
+            self._recv_exact(view)
+            position += len(view)
+            return view
+
+        return source
+
+    def _recv_trailer(self, message_length: int) -> int:
+        # Returns the mode of the frame and drops the frame from the buffer.
+        source = self._recv_source(message_length - 2, message_length)
+        trailer = b"".join(bytes(chunk) for chunk in iter(source, b""))
+        self._recv_discard(min(self._recv_size, message_length))
+        if trailer[1] != BCapTcp._EOT:
+            raise BCapException(HResult.E_INVALID_PACKET, "Can not receive b-CAP EOT.")
+        return trailer[0]
+
+    @staticmethod
+    def _sink_value(value: any, sink: Callable[[any], None]) -> any:
+        if isinstance(value, str):
+            sink(value)
+            return BCapConverter._calc_bstr_size(value)
+        elif isinstance(value, (bytes, bytearray)):
+            sink(memoryview(value))
+            return len(value)
+
+        return value
+
+    def _recv_message(self) -> Tuple[int, int, int, list]:
+        # The frame returned last time is released here, so its view must not
+        # be used after the next call.
+        self._recv_release()
+
+        while True:
+            message_length = self._recv_header()
+            message = self._recv_body(message_length)
+            if message is not None:
+                if self._recorder is not None and self._recv_frame_length > 0:
+                    # Frames dropped or streamed without being buffered as a
+                    # whole are not recorded.
+                    self._recorder.record(
+                        self._record_session,
+                        BCapRecorder.RECEIVED,
+                        self._recv_view[: self._recv_frame_length],
+                    )
+                return message
+
+    def _recv_body(self, message_length: int) -> Optional[Tuple[int, int, int, list]]:
+        if (
+            self._max_message_size is not None
+            and message_length > self._max_message_size
+        ):
+            return self._recv_oversized(message_length)
+
+        if message_length >= BCapTcp._STREAM_MIN_SIZE:
+            message = self._recv_compressed_message(message_length)
+            if message is not None:
+                self._recv_frame_length = message_length
+                return message
+
+        self._recv_fill(message_length)
+        if self._recv_buffer[message_length - 1] != BCapTcp._EOT:
+            # Can not receive b-CAP EOT.
+            self._recv_discard(1)
+            return None
+
+        self._recv_frame_length = message_length
+        measurement = self._measurement
+        if measurement is None:
+            return self._bcap_converter.deserialize(self._recv_view[:message_length])
+
+        started = time.perf_counter_ns()
+        message = self._bcap_converter.deserialize(self._recv_view[:message_length])
+        measurement.deserialize_time = time.perf_counter_ns() - started
+        return message
+
+    def _recv_oversized(self, message_length: int) -> Tuple[int, int, int, list]:
+        # The frame is dropped without being buffered, and the request fails
+        # with the serial number taken from its header.
+        self._recv_fill(BCapConverter._STRUCT_RECV_HEADER.size)
+        (serial, version) = BCapTcp._STRUCT_SERIAL_VERSION.unpack_from(
+            self._recv_buffer, 1 + 4
+        )
+        for _ in iter(self._recv_source(self._recv_size, message_length), b""):
+            pass
+        self._recv_discard(min(self._recv_size, message_length))
+        return (serial, version, HResult.E_OUTOFMEMORY, None)
+
+    def _recv_release(self) -> None:
+        self._recv_discard(self._recv_frame_length)
+        self._recv_frame_length = 0
+        if (
+            len(self._recv_buffer) > BCapTcp._MAX_IDLE_BUFFER_SIZE
+            and self._recv_size <= BCapTcp._INITIAL_BUFFER_SIZE
+        ):
+            # The buffer grown for a large frame is given back.
+            buffer = bytearray(BCapTcp._INITIAL_BUFFER_SIZE)
+            buffer[: self._recv_size] = self._recv_view[: self._recv_size]
+            self._recv_buffer = buffer
+            self._recv_view = memoryview(buffer)
+
+    def _recv_compressed_message(
+        self, message_length: int
+    ) -> Optional[Tuple[int, int, int, list]]:
+        # Large compressed responses are decompressed and parsed while the rest
+        # of the frame is still arriving. Whether the frame is compressed is
+        # only known from the mode byte at its end, so the start of the body
+        # is checked for a zlib header, and the frame is parsed again as a
+        # whole if the guess turns out to be wrong.
+        self._recv_fill(BCapTcp._STREAM_PROBE_SIZE)
+        body = BCapConverter._STRUCT_RECV_HEADER.size
+        if not BCapConverter.is_compressed_stream(self._recv_buffer, body):
+            return None
+
+        # The buffer is grown once, so the chunks are received in place.
+        self._recv_reserve(message_length)
+        position = body + 4
+        # Mode and footer
+        end = message_length - 2
+
+        def source() -> memoryview:
+            nonlocal position
+            start = position
+            position = min(position + BCapTcp._STREAM_CHUNK_SIZE, end)
+            self._recv_fill(position)
+            return self._recv_view[start:position]
+
+        (serial, version) = BCapTcp._STRUCT_SERIAL_VERSION.unpack_from(
+            self._recv_buffer, 5
+        )
+        try:
+            message = self._bcap_converter.deserialize_compressed_stream(
+                serial, version, source
+            )
+        except (zlib.error, struct.error, EOFError, ValueError, BCapException):
+            message = None
+
+        self._recv_fill(message_length)
+        if (
+            self._recv_buffer[message_length - 1] != BCapTcp._EOT
+            or self._recv_buffer[message_length - 2] != 1
+        ):
+            return None
+
+        return message
+
+    def _recv_header(self) -> int:
+        while True:
+            self._recv_fill(BCapTcp._HEADER_SIZE)
+            if self._recv_buffer[0] != BCapTcp._SOH:
+                # Can not receive b-CAP SOH. Skip to the next SOH candidate.
+                index = self._recv_buffer.find(
+                    BCapConverter.BCAP_SOH, 1, self._recv_size
+                )
+                if index < 0:
+                    index = self._recv_size
+                self._recv_discard(index)
+                continue
+
+            # Receive b-CAP message length.
+            (message_length,) = BCapTcp._STRUCT_LENGTH.unpack_from(
+                self._recv_buffer, 1
+            )
+            if message_length < BCapTcp._MIN_MESSAGE_SIZE:
+                self._recv_discard(1)
+                continue
+
+            if self._measurement is not None:
+                self._measurement.on_frame(message_length)
+            return message_length
+
+    def _open_record_session(self) -> None:
+        (host, port) = self._sock.getpeername()[:2]
+        self._record_session = self._recorder.open_session(
+            "tcp", "{}:{}".format(host, port)
+        )
+
+    def _recv_reserve(self, size: int) -> None:
+        if size > len(self._recv_buffer):
+            buffer = bytearray(max(size, len(self._recv_buffer) * 2))
+            buffer[: self._recv_size] = self._recv_view[: self._recv_size]
+            self._recv_buffer = buffer
+            self._recv_view = memoryview(buffer)
+
+    def _recv_fill(self, size: int) -> None:
+        self._recv_reserve(size)
+
+        # Only the missing bytes of the current frame are requested, so the
+        # buffer never holds data beyond the frame being assembled.
+        while self._recv_size < size:
+            received = self._sock.recv_into(
+                self._recv_view[self._recv_size : size], size - self._recv_size
+            )
+            if received == 0:
+                raise ConnectionResetError("The b-CAP server closed the connection.")
+            self._recv_size += received
+
+    def _recv_exact(self, view: memoryview) -> None:
+        received = 0
+        while received < len(view):
+            size = self._sock.recv_into(view[received:])
+            if size == 0:
+                raise ConnectionResetError("The b-CAP server closed the connection.")
+            received += size
+
+    def _recv_discard(self, size: int) -> None:
+        remaining = self._recv_size - size
+        if remaining > 0:
+            self._recv_buffer[:remaining] = bytes(
+                self._recv_view[size : self._recv_size]
+            )
+        self._recv_size = max(remaining, 0)
@@ -1,9 +1,12 @@
 import socket
 import struct
+import time
 from threading import RLock
-from typing import Tuple
+from typing import Container, Optional, Tuple
 from .b_cap_exception import HResult, BCapException
 from .b_cap_converter import BCapConverter
+from .b_cap_metrics import BCapMetrics
+from .b_cap_recorder import BCapRecorder
 from .b_cap_socket import BCapSocket
 
 
@@ -12,12 +15,37 @@ class BCapUdp(BCapSocket):
     _RETRY_MIN = 1
     _RETRY_MAX = 7
     _MAX_PACKET_SIZE = 504
+    # Serial numbers run from 1 to 0xFFFF.
+    _MAX_BATCH_SIZE = 0xFFFE
+    # h : Retry - 2bytes(short)
+    _STRUCT_RETRY = struct.Struct("<h")
+    # H : Serial - 2bytes(unsigned short)
+    # h : Retry - 2bytes(short)
+    _STRUCT_SERIAL_RETRY = struct.Struct("<Hh")
+    # Lower bound of the retransmission timeout. RFC 6298 recommends 1 second,
+    # which is far longer than the round trip on a controller network.
+    _RTO_MIN = 0.01
+    # Clock granularity G of RFC 6298
+    _RTO_GRANULARITY = 0.001
 
     def __init__(self, should_return_hr: bool):
         self._sock = None
         self._lock = RLock()
         self._bcap_converter = BCapConverter(False, should_return_hr)
         self._retry = 1
+        self._timeout = None
+        self._srtt = None
+        self._rttvar = None
+        self._rto = None
+        self._requests = 0
+        self._retransmissions = 0
+        self._failures = 0
+        self._late_replies = 0
+        self._keepalives = 0
+        self._metrics = None
+        self._measurement = None
+        self._recorder = None
+        self._record_session = None
 
     def connect(self, endpoint: str, timeout: float, retry: int) -> None:
         with self._lock:
@@ -27,6 +55,8 @@ class BCapUdp(BCapSocket):
                 self._host, self._port = BCapConverter.parse_endpoint(endpoint)
                 self.set_timeout(timeout)
                 self.set_retry(retry)
+                if self._recorder is not None:
+                    self._open_record_session()
             except Exception as e:
                 self.disconnect()
                 raise e
@@ -35,6 +65,10 @@ class BCapUdp(BCapSocket):
         with self._lock:
             self._serial = 1
             self._version = 1
+            # The round trip is estimated again for the next endpoint.
+            self._srtt = None
+            self._rttvar = None
+            self._rto = self._timeout
             if self._sock:
                 try:
                     self._sock.shutdown(socket.SHUT_RDWR)
@@ -47,6 +81,8 @@ class BCapUdp(BCapSocket):
     def set_timeout(self, timeout: float):
         with self._lock:
             self._sock.settimeout(timeout)
+            self._timeout = timeout
+            self._update_rto()
 
     def get_timeout(self) -> float:
         return self._sock.gettimeout()
@@ -56,38 +92,354 @@ class BCapUdp(BCapSocket):
             raise ValueError()
         self._retry = retry
 
-    def set_compression(self, enable: bool, level=-1):
+    def set_compression(self, enable: bool, level=-1, threshold=0, adaptive=False):
         raise NotImplementedError()
 
+    def get_compression_statistics(self) -> dict:
+        raise NotImplementedError()
+
+    def set_array_type(self, array_type: str) -> None:
+        with self._lock:
+            self._bcap_converter.set_array_type(array_type)
+
+    def set_pipelining(self, enable: bool, window: int = 8) -> None:
+        raise NotImplementedError()
+
+    def get_route_statistics(self) -> dict:
+        raise NotImplementedError()
+
+    def set_max_message_size(self, size):
+        raise NotImplementedError()
+
+    def set_metrics(self, metrics: Optional[BCapMetrics]) -> None:
+        with self._lock:
+            self._metrics = metrics
+
+    def set_recorder(self, recorder: Optional[BCapRecorder]) -> None:
+        with self._lock:
+            self._recorder = recorder
+            self._record_session = None
+            if recorder is not None and self._sock:
+                self._open_record_session()
+
+    def serialize_request(
+        self, func_id: int, args: list
+    ) -> Tuple[BCapSocket, bytearray]:
+        with self._lock:
+            packet = self._serialize(0, 0, func_id, args)
+        return (self, bytearray(packet))
+
+    def request_serialized(self, func_id: int, packet: bytearray) -> any:
+        if len(packet) > BCapUdp._MAX_PACKET_SIZE:
+            raise BCapException(
+                HResult.E_INVALID_PACKET,
+                "Serialized packet size is {0} bytes. In the case of UDP, the "
+                "maximum value is {1} bytes".format(
+                    len(packet), BCapUdp._MAX_PACKET_SIZE
+                ),
+            )
+
+        with self._lock:
+            if self._metrics is None:
+                (hr, deserialized_result) = self._exchange_serialized(packet)
+            else:
+                (hr, deserialized_result) = self._measure(
+                    func_id, self._exchange_serialized, packet
+                )
+
+            return self._bcap_converter.create_response_object(hr, deserialized_result)
+
+    def request_into(self, func_id, args, sink):
+        raise NotImplementedError()
+
+    def request_from(self, func_id, args, payload, progress=None):
+        raise NotImplementedError()
+
+    def get_retry_statistics(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "retransmissions": self._retransmissions,
+                "failures": self._failures,
+                "late_replies": self._late_replies,
+                "keepalives": self._keepalives,
+                "srtt": self._srtt,
+                "rttvar": self._rttvar,
+                "rto": self._rto,
+            }
+
     def request(self, func_id: int, args: list) -> any:
+        with self._lock:
+            if self._metrics is None:
+                (hr, deserialized_result) = self._exchange(func_id, args)
+            else:
+                (hr, deserialized_result) = self._measure(
+                    func_id, self._exchange, func_id, args
+                )
 
-        retry = self._serial
-        retry_count = 0
+            return self._bcap_converter.create_response_object(hr, deserialized_result)
+
+    def _exchange(self, func_id: int, args: list) -> Tuple[int, any]:
+        with self._lock:
+            serial = self._next_serial()
+            packet = self._serialize(serial, 0, func_id, args)
+            return self._exchange_packet(serial, packet)
+
+    def _exchange_serialized(self, packet: bytearray) -> Tuple[int, any]:
+        with self._lock:
+            serial = self._next_serial()
+            BCapUdp._STRUCT_SERIAL_RETRY.pack_into(packet, 5, serial, 0)
+            return self._exchange_packet(serial, packet)
+
+    def _exchange_packet(self, serial: int, packet: bytearray) -> Tuple[int, any]:
+        with self._lock:
+            self._requests += 1
 
+            # A retransmission reuses the serial number and counts up the retry
+            # field, so a late reply to an earlier attempt still completes the
+            # request. The request is retransmitted whenever the retransmission
+            # timeout expires, but it only fails once the configured timeout
+            # has run out retry + 1 times.
+            retry_count = 0
+            retransmissions = 0
+            timestamp = time.monotonic()
+            expiry = self._get_deadline(timestamp, self._timeout)
+            deadline = self._get_deadline(timestamp, self._rto)
+            should_send = True
+            try:
+                while True:
+                    try:
+                        if should_send:
+                            should_send = False
+                            self._send(packet)
+                        self._wait(deadline)
+                        (recv_serial, hr, deserialized_args) = self._recv_any(
+                            (serial,)
+                        )
+                    except BCapException:
+                        raise
+                    except Exception as e:
+                        (retry_count, expiry) = self._count_retry(
+                            e, retry_count, expiry
+                        )
+                        if retry_count > self._retry:
+                            self._failures += 1
+                            raise BCapException(
+                                HResult.E_FAIL, "The number of retries has been exceeded."
+                            )
+
+                        retransmissions += 1
+                        self._retransmissions += 1
+                        if self._measurement is not None:
+                            self._measurement.retries += 1
+                        BCapUdp._STRUCT_RETRY.pack_into(
+                            packet, 7, min(retransmissions, 0x7FFF)
+                        )
+                        deadline = self._get_retransmit_deadline(expiry)
+                        should_send = True
+                        continue
+
+                    if recv_serial != serial:
+                        # A reply to a request that has already been given up.
+                        self._late_replies += 1
+                        continue
+
+                    if hr == HResult.S_EXECUTING:
+                        # The server is still executing the request, so the full
+                        # timeout is waited for instead of retransmitting.
+                        self._keepalives += 1
+                        if self._measurement is not None:
+                            self._measurement.on_keepalive()
+                        expiry = self._get_deadline(time.monotonic(), self._timeout)
+                        deadline = expiry
+                        continue
+
+                    if retransmissions == 0:
+                        # Karn's algorithm: a retransmitted request is ambiguous,
+                        # so only first attempts are sampled.
+                        self._sample_rtt(time.monotonic() - timestamp)
+                    break
+            finally:
+                self._sock.settimeout(self._timeout)
+
+            if deserialized_args is None:
+                return (hr, None)
+            return (hr, deserialized_args[0])
+
+    def execute_many(self, requests: list) -> list:
+        # The batch is sent in chunks that fit in the serial number space, so
+        # no two requests in flight share a serial number.
         with self._lock:
-            while True:
+            results = []
+            for start in range(0, len(requests), BCapUdp._MAX_BATCH_SIZE):
+                results += self._execute_chunk(
+                    requests[start : start + BCapUdp._MAX_BATCH_SIZE]
+                )
+            return results
+
+    def _execute_chunk(self, requests: list) -> list:
+        results = [None] * len(requests)
+        waiting = {}
+        for index, (func_id, args) in enumerate(requests):
+            serial = self._serial
+            try:
+                packet = self._serialize(serial, 0, func_id, args)
+            except BCapException as e:
+                results[index] = e
+                continue
+
+            self._next_serial()
+            waiting[serial] = (index, packet)
+
+        # Datagrams can not be coalesced, so they are sent back to back and
+        # the replies are matched by serial number in any order. Retries
+        # are counted as in request.
+        self._requests += len(waiting)
+        retry_count = 0
+        retransmissions = 0
+        timestamp = time.monotonic()
+        expiry = self._get_deadline(timestamp, self._timeout)
+        deadline = self._get_deadline(timestamp, self._rto)
+        should_send = True
+        try:
+            while waiting:
                 try:
-                    serial = self._serial
-                    self._send(serial, retry, func_id, args)
-                    if self._serial >= 0xFFFF:
-                        self._serial = 1
-                    else:
-                        self._serial += 1
-                    (hr, deserialized_result) = self._recv(serial)
-                    return self._bcap_converter.create_response_object(
-                        hr, deserialized_result
-                    )
+                    if should_send:
+                        should_send = False
+                        for _, packet in waiting.values():
+                            self._send(packet)
+                    self._wait(deadline)
+                    (recv_serial, hr, deserialized_args) = self._recv_any(waiting)
                 except BCapException:
                     raise
-                except Exception:
-                    retry_count += 1
+                except Exception as e:
+                    (retry_count, expiry) = self._count_retry(
+                        e, retry_count, expiry
+                    )
                     if retry_count > self._retry:
-                        raise BCapException(
-                            HResult.E_FAIL, "The number of retries has been exceeded."
+                        self._failures += len(waiting)
+                        for index, _ in waiting.values():
+                            results[index] = BCapException(
+                                HResult.E_FAIL,
+                                "The number of retries has been exceeded.",
+                            )
+                        break
+
+                    # Resend what is still missing with the same serial number.
+                    retransmissions += 1
+                    self._retransmissions += len(waiting)
+                    for _, packet in waiting.values():
+                        BCapUdp._STRUCT_RETRY.pack_into(
+                            packet, 7, min(retransmissions, 0x7FFF)
                         )
+                    deadline = self._get_retransmit_deadline(expiry)
+                    should_send = True
+                    continue
+
+                if hr == HResult.S_EXECUTING:
+                    if recv_serial in waiting:
+                        self._keepalives += 1
+                        expiry = self._get_deadline(time.monotonic(), self._timeout)
+                        deadline = expiry
+                    continue
+
+                entry = waiting.pop(recv_serial, None)
+                if entry is None:
+                    self._late_replies += 1
+                    continue
+
+                if retransmissions == 0:
+                    self._sample_rtt(time.monotonic() - timestamp)
+
+                if deserialized_args is None:
+                    deserialized_result = None
+                else:
+                    deserialized_result = deserialized_args[0]
+                results[entry[0]] = self._bcap_converter.create_batch_response_object(
+                    hr, deserialized_result
+                )
+        finally:
+            self._sock.settimeout(self._timeout)
+
+        return results
+
+    def _next_serial(self) -> int:
+        serial = self._serial
+        if self._serial >= 0xFFFF:
+            self._serial = 1
+        else:
+            self._serial += 1
+        return serial
+
+    def _sample_rtt(self, rtt: float) -> None:
+        # RFC 6298 with alpha = 1/8 and beta = 1/4.
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        self._update_rto()
+
+    def _update_rto(self) -> None:
+        # Until the first sample, the configured timeout is used as is. The
+        # configured timeout is also the upper bound of the retransmission
+        # timeout, so adaptation never waits longer than before.
+        if self._srtt is None or self._timeout is None:
+            self._rto = self._timeout
+            return
 
-    def _send(self, serial: int, retry: int, func_id: int, args: list) -> None:
+        rto = self._srtt + max(BCapUdp._RTO_GRANULARITY, 4 * self._rttvar)
+        self._rto = min(max(rto, BCapUdp._RTO_MIN), self._timeout)
+
+    def _back_off(self) -> None:
+        # The timeout is doubled on each expiration and kept until the next
+        # valid sample.
+        if self._rto is not None:
+            self._rto = min(self._rto * 2, self._timeout)
+
+    def _count_retry(
+        self, error: Exception, retry_count: int, expiry: Optional[float]
+    ) -> Tuple[int, Optional[float]]:
+        # Returns the retry count and the expiry of the configured timeout
+        # after error. An expired retransmission timeout only retransmits
+        # early, while the expiry of the configured timeout, or any other error
+        # of the socket or of a reply, counts a retry as before.
+        now = time.monotonic()
+        if isinstance(error, socket.timeout):
+            self._back_off()
+            if expiry is None or now < expiry:
+                return (retry_count, expiry)
+        return (retry_count + 1, self._get_deadline(now, self._timeout))
+
+    def _get_retransmit_deadline(self, expiry: Optional[float]) -> Optional[float]:
+        deadline = self._get_deadline(time.monotonic(), self._rto)
+        if deadline is None or expiry is None:
+            return expiry
+        return min(deadline, expiry)
+
+    def _get_deadline(self, now: float, timeout: float) -> float:
+        if timeout is None:
+            return None
+        return now + timeout
+
+    def _wait(self, deadline: float) -> None:
+        if deadline is None:
+            self._sock.settimeout(None)
+            return
+
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise socket.timeout("timed out")
+        self._sock.settimeout(timeout)
+
+    def _serialize(self, serial: int, retry: int, func_id: int, args: list) -> bytes:
+        measurement = self._measurement
+        if measurement is not None:
+            started = time.perf_counter_ns()
         serialized_packet = self._bcap_converter.serialize(serial, retry, func_id, args)
+        if measurement is not None:
+            measurement.serialized = time.perf_counter_ns() - started
         message_length = len(serialized_packet)
         if message_length > BCapUdp._MAX_PACKET_SIZE:
             raise BCapException(
@@ -97,25 +449,53 @@ class BCapUdp(BCapSocket):
                 ),
             )
 
-        self._sock.sendto(serialized_packet, (self._host, self._port))
+        return serialized_packet
 
-    def _recv(self, serial: int) -> Tuple[int, any]:
+    def _send(self, packet: bytes) -> None:
+        if self._measurement is not None:
+            self._measurement.on_send(None, len(packet))
+        if self._recorder is not None:
+            self._recorder.record(self._record_session, BCapRecorder.SENT, packet)
+        self._sock.sendto(packet, (self._host, self._port))
+
+    def _recv_any(self, serials: Container[int]) -> Tuple[int, int, any]:
         while True:
             data, address = self._sock.recvfrom(65565)
             if address[0] != self._host or address[1] != self._port:
                 continue
+            if (
+                len(data) >= 5
+                and BCapConverter._STRUCT_LENGTH.unpack_from(data, 1)[0] > len(data)
+            ):
+                if BCapConverter.peek_serial(data) not in serials:
+                    # A reply to a request that has already been given up.
+                    self._late_replies += 1
+                    continue
+                # A response too large for a datagram, which comes back the
+                # same way however many times it is retried.
+                raise BCapException(
+                    HResult.E_INVALID_PACKET, "The response was truncated."
+                )
 
+            if self._recorder is not None:
+                self._recorder.record(self._record_session, BCapRecorder.RECEIVED, data)
+            measurement = self._measurement
+            if measurement is not None:
+                measurement.on_frame(len(data))
             (
                 recv_serial,
                 version,
                 hr,
                 deserialized_args,
             ) = self._bcap_converter.deserialize(data)
+            if measurement is not None:
+                measurement.deserialize_time = (
+                    time.perf_counter_ns() - measurement.last_frame
+                )
 
-            if (recv_serial == serial) and (hr != HResult.S_EXECUTING):
-                break
-
-        if deserialized_args is None:
-            return (hr, None)
+            return (recv_serial, hr, deserialized_args)
 
-        return (hr, deserialized_args[0])
+    def _open_record_session(self) -> None:
+        self._record_session = self._recorder.open_session(
+            "udp", "{}:{}".format(self._host, self._port)
+        )
@@ -0,0 +1,297 @@
+# Usage: python -m bcap.bench [endpoint] [options]
+#
+# Drives a controller with concurrent BCapClients running a mix of calls for
+# a duration and reports the calls/sec, the latency percentiles, the UDP
+# retries and the client CPU time per call. Without an endpoint, the calls
+# are run against a BCapEmulator started in the process.
+#
+#   --mix variable_get_value=80,robot_execute=15,variable_put_value=5
+#   --json FILE      write the results, to compare runs
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from threading import Barrier, Thread
+from . import BCapClient, BCapEmulator, BCapException
+from .b_cap_metrics import BCapMetrics, _Histogram
+
+DEFAULT_MIX = "variable_get_value=80,robot_execute=15,variable_put_value=5"
+
+# The calls of the mix, run on the handles of a worker. variable_put_value
+# writes back the value read when the worker started, so the run does not
+# change the controller.
+OPERATIONS = {
+    "variable_get_value": lambda w: w.client.variable_get_value(w.variable),
+    "variable_put_value": lambda w: w.client.variable_put_value(w.variable, w.value),
+    "robot_execute": lambda w: w.client.robot_execute(w.robot, "CurJnt"),
+    "controller_get_robot_names": lambda w: w.client.controller_get_robot_names(
+        w.controller
+    ),
+}
+
+
+def parse_mix(text: str) -> dict:
+    # Returns {operation: weight} of "name=weight,...".
+    mix = {}
+    for item in text.split(","):
+        (name, _, weight) = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(
+                "Unknown operation {}, expected one of {}.".format(
+                    name, ", ".join(OPERATIONS)
+                )
+            )
+        mix[name] = float(weight or 1)
+        if mix[name] < 0:
+            raise ValueError("The weight of {} is negative.".format(name))
+
+    if sum(mix.values()) <= 0:
+        raise ValueError("The mix is empty.")
+    return mix
+
+
+class _Worker:
+    def __init__(self, index: int, arguments: argparse.Namespace, mix: dict):
+        self.random = random.Random(arguments.seed + index)
+        self.arguments = arguments
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.client = None
+        self.controller = None
+        self.robot = None
+        self.variable = None
+        self.value = None
+        self.error = None
+        self.calls = {name: 0 for name in mix}
+        self.errors = {name: 0 for name in mix}
+        self.histograms = {name: _Histogram() for name in mix}
+        self.retries = 0
+        self.cpu_time = 0.0
+
+    def open(self) -> None:
+        arguments = self.arguments
+        self.client = BCapClient(arguments.protocol)
+        self.client.connect(arguments.endpoint, arguments.timeout, arguments.retry)
+        if arguments.compression and arguments.protocol != "udp":
+            self.client.set_compression(True, threshold=arguments.compression)
+        self.client.service_start(arguments.service_option)
+        self.controller = self.client.controller_connect(
+            arguments.controller,
+            arguments.provider,
+            arguments.machine,
+            arguments.option,
+        )
+        if "robot_execute" in self.operations:
+            self.robot = self.client.controller_get_robot(
+                self.controller, arguments.robot
+            )
+        self.variable = self.client.controller_get_variable(
+            self.controller, arguments.variable
+        )
+        self.value = self.client.variable_get_value(self.variable)
+
+    def close(self) -> None:
+        if self.client is None:
+            return
+        try:
+            if self.variable is not None:
+                self.client.variable_release(self.variable)
+            if self.robot is not None:
+                self.client.robot_release(self.robot)
+            if self.controller is not None:
+                self.client.controller_disconnect(self.controller)
+        except Exception:
+            pass
+        self.client.disconnect()
+
+    def run(self, barrier: Barrier) -> None:
+        try:
+            self.open()
+        except Exception as e:
+            self.error = e
+        barrier.wait()
+        if self.error is not None:
+            return
+
+        arguments = self.arguments
+        start = time.perf_counter() + arguments.warmup
+        end = start + arguments.duration
+        measuring = False
+        retries = 0
+        cpu_time = 0.0
+        choices = self.random.choices
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            elif not measuring and now >= start:
+                measuring = True
+                retries = self._get_retries()
+                cpu_time = time.thread_time()
+
+            name = choices(self.operations, self.weights)[0]
+            began = time.perf_counter_ns()
+            try:
+                OPERATIONS[name](self)
+                is_error = False
+            except (BCapException, OSError):
+                is_error = True
+            if measuring:
+                self.histograms[name].record(time.perf_counter_ns() - began)
+                self.calls[name] += 1
+                self.errors[name] += is_error
+
+        if measuring:
+            self.cpu_time = time.thread_time() - cpu_time
+            self.retries = self._get_retries() - retries
+
+    def _get_retries(self) -> int:
+        try:
+            return self.client.get_retry_statistics()["retransmissions"]
+        except NotImplementedError:
+            # TCP does not retry.
+            return 0
+
+
+def run(arguments: argparse.Namespace, mix: dict) -> dict:
+    workers = [_Worker(i, arguments, mix) for i in range(arguments.concurrency)]
+    barrier = Barrier(len(workers))
+    threads = [Thread(target=worker.run, args=(barrier,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for worker in workers:
+        worker.close()
+
+    errors = [worker.error for worker in workers if worker.error is not None]
+    if errors:
+        raise errors[0]
+
+    operations = {}
+    latency = _Histogram()
+    for name in mix:
+        histogram = _Histogram()
+        for worker in workers:
+            histogram.merge(worker.histograms[name])
+        latency.merge(histogram)
+        operations[name] = {
+            "calls": sum(worker.calls[name] for worker in workers),
+            "errors": sum(worker.errors[name] for worker in workers),
+            "latency": BCapMetrics._summarize(histogram),
+        }
+
+    calls = latency.count
+    cpu_time = sum(worker.cpu_time for worker in workers)
+    return {
+        "calls": calls,
+        "errors": sum(entry["errors"] for entry in operations.values()),
+        "calls_per_sec": calls / arguments.duration,
+        "retries": sum(worker.retries for worker in workers),
+        "cpu_per_call": cpu_time / calls if calls else None,
+        "latency": BCapMetrics._summarize(latency),
+        "operations": operations,
+    }
+
+
+def print_results(results: dict) -> None:
+    columns = ("calls", "errors", "p50 ms", "p90 ms", "p99 ms", "p99.9 ms", "max ms")
+    header = "{:<28}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}"
+    print(header.format("operation", *columns))
+    rows = list(results["operations"].items()) + [("total", results)]
+    for name, entry in rows:
+        summary = entry["latency"]
+        values = list(summary["quantiles"].values()) + [summary["max"]]
+        print(
+            "{:<28}{:>10}{:>8}".format(name, entry["calls"], entry["errors"])
+            + "".join(
+                "{:>10}".format("-" if v is None else "{:.3f}".format(v * 1e3))
+                for v in values
+            )
+        )
+
+    print()
+    print("calls/sec     {:.1f}".format(results["calls_per_sec"]))
+    print("retries       {}".format(results["retries"]))
+    if results["cpu_per_call"] is not None:
+        print("CPU/call      {:.1f} us".format(results["cpu_per_call"] * 1e6))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput and latency of a mix of b-CAP calls."
+    )
+    parser.add_argument(
+        "endpoint", nargs="?", help="host:port, or an emulator in the process"
+    )
+    parser.add_argument("--protocol", default="tcp", choices=("tcp", "udp", "auto"))
+    parser.add_argument("-c", "--concurrency", type=int, default=1)
+    parser.add_argument("-d", "--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument(
+        "--compression",
+        type=int,
+        default=0,
+        metavar="THRESHOLD",
+        help="compress TCP packets larger than THRESHOLD bytes",
+    )
+    parser.add_argument("--timeout", type=float, default=3.0)
+    parser.add_argument("--retry", type=int, default=3)
+    parser.add_argument("--service-option", default="")
+    parser.add_argument("--controller", default="")
+    parser.add_argument("--provider", default="CaoProv.DENSO.VRC")
+    parser.add_argument("--machine", default="localhost")
+    parser.add_argument("--option", default="")
+    parser.add_argument("--robot", default="Arm")
+    parser.add_argument("--variable", default="I1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json")
+    arguments = parser.parse_args()
+
+    if arguments.concurrency < 1 or arguments.duration <= 0 or arguments.warmup < 0:
+        parser.error("The concurrency and the duration must be positive.")
+    try:
+        mix = parse_mix(arguments.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    emulator = None
+    if arguments.endpoint is None:
+        emulator = BCapEmulator(seed=arguments.seed)
+        emulator.start()
+        arguments.endpoint = emulator.get_endpoint()
+
+    try:
+        results = run(arguments, mix)
+    finally:
+        if emulator is not None:
+            emulator.stop()
+
+    print_results(results)
+
+    if arguments.json:
+        settings = dict(vars(arguments))
+        settings["mix"] = mix
+        settings["emulator"] = emulator is not None
+        with open(arguments.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "settings": settings,
+                    "results": results,
+                },
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+# Run from the repository root: python -m benchmarks.bench_converter
+#
+# Measures BCapConverter.serialize and deserialize for every VarType, as a
+# scalar and as arrays of 1 to 100k elements, and for variant arrays, nested
+# arrays, strings of several lengths and compressed TCP frames.
+#
+#   --save FILE      write the results as a JSON baseline
+#   --compare FILE   compare the results with a baseline
+#   -k PATTERN       run only the cases whose name contains PATTERN
+import argparse
+import ctypes
+import gc
+import json
+import platform
+import struct
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+from bcap.b_cap_converter import BCapConverter, VarType
+
+ARRAY_SIZES = (1, 10, 100, 1000, 10000, 100000)
+BSTR_LENGTHS = (0, 16, 256, 4096, 65536)
+
+# The Python type sent for each VarType, as a function of the element index.
+ELEMENTS = {
+    "VT_I2": lambda i: ctypes.c_short(i % 0x7FFF),
+    "VT_I4": lambda i: i,
+    "VT_R4": lambda i: ctypes.c_float(i * 0.5),
+    "VT_R8": lambda i: i * 0.5,
+    "VT_DATE": lambda i: datetime(2020, 1, 1) + timedelta(seconds=i),
+    "VT_BSTR": lambda i: "Name{}".format(i),
+    "VT_BOOL": lambda i: i % 2 == 0,
+    "VT_UI1": lambda i: ctypes.c_ubyte(i & 0xFF),
+    "VT_UI2": lambda i: ctypes.c_ushort(i & 0xFFFF),
+    "VT_UI4": lambda i: ctypes.c_uint(i),
+    "VT_I8": lambda i: ctypes.c_longlong(-i),
+    "VT_UI8": lambda i: ctypes.c_ulonglong(i),
+}
+
+# VarTypes that the client never sends but can receive, with the struct
+# format of an element.
+RECEIVE_ONLY = {
+    "VT_CY": (VarType.VT_CY, "q"),
+    "VT_ERROR": (VarType.VT_ERROR, "i"),
+}
+
+# The frames with these compressed too, to compare both TCP modes.
+COMPRESSED_MIN_ELEMENTS = 1000
+
+
+def build_cases() -> list:
+    # Returns (name, func_id, args, number of elements) to serialize.
+    cases = [("VT_EMPTY", 101, [None], 1)]
+    for name, element in ELEMENTS.items():
+        cases.append((name, 102, [1, element(1)], 1))
+        for size in ARRAY_SIZES:
+            if name == "VT_UI1":
+                args = [1, bytes(i & 0xFF for i in range(size))]
+            else:
+                args = [1, [element(i) for i in range(size)]]
+            cases.append(("{}[{}]".format(name, size), 102, args, size))
+
+    for length in BSTR_LENGTHS:
+        cases.append(("VT_BSTR len {}".format(length), 102, [1, "x" * length], length))
+
+    for size in ARRAY_SIZES:
+        variants = [ELEMENTS["VT_I4"], ELEMENTS["VT_BSTR"], ELEMENTS["VT_R8"]]
+        args = [1, [variants[i % 3](i) for i in range(size)]]
+        cases.append(("VT_VARIANT[{}]".format(size), 102, args, size))
+
+    cases.append(
+        (
+            "nested robot_move",
+            72,
+            [3, 1, [[0.0, 45.0, 90.0, 0.0, 45.0, 0.0], "J", "@P"], ""],
+            8,
+        )
+    )
+    for size in ARRAY_SIZES[:-1]:
+        # A variant array of a label and [int, [float, float, float]] rows.
+        # A list of lists only is not a variant array, so the label is needed.
+        rows = [[i, [i * 0.5, i * 1.5, i * 2.5]] for i in range(size)]
+        args = [1, ["rows"] + rows]
+        cases.append(("nested rows[{}]".format(size), 102, args, size * 4))
+
+    return cases
+
+
+def build_receive_only_frames() -> list:
+    # Returns (name, frame, number of elements) of hand-built responses.
+    frames = []
+    for name, (var_type, format_char) in RECEIVE_ONLY.items():
+        for size in (None,) + ARRAY_SIZES:
+            count = 1 if size is None else size
+            data = struct.pack("<%d%s" % (count, format_char), *range(count))
+            if size is None:
+                frames.append((name, _frame(var_type, 1, data), 1))
+            else:
+                frames.append(
+                    (
+                        "{}[{}]".format(name, size),
+                        _frame(var_type | VarType.VT_ARRAY, count, data),
+                        count,
+                    )
+                )
+
+    frames.append(("VT_NULL", _frame(VarType.VT_NULL, 1, b""), 1))
+    return frames
+
+
+def _frame(var_type: int, number_of_elements: int, data: bytes) -> bytes:
+    arg = struct.pack("<HI", var_type, number_of_elements) + data
+    body = struct.pack("<iHI", 0, 1, len(arg)) + arg
+    # Header, serial, version, body, mode and EOT
+    length = 1 + 4 + 2 + 2 + len(body) + 1 + 1
+    return b"\x01" + struct.pack("<IHH", length, 1, 1) + body + b"\x00\x04"
+
+
+def measure(function, elements: int, seconds: float) -> dict:
+    # Picks a number of calls that takes about seconds, then takes the best
+    # of three runs.
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= seconds / 10 or number >= 1 << 20:
+            break
+        number *= 10
+    number = max(1, int(number * seconds / 3 / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=3, number=number)) / number
+
+    result = {
+        "ops_per_sec": 1.0 / best,
+        "ns_per_element": best * 1e9 / max(elements, 1),
+    }
+    result.update(measure_memory(function))
+    return result
+
+
+def measure_memory(function) -> dict:
+    # CPython has no counter of allocations, so two figures are reported:
+    # the memory blocks still allocated after the call, which are the objects
+    # of its result, and the peak of the memory traced during the call.
+    function()
+    gc.collect()
+    blocks = []
+    for _ in range(3):
+        before = sys.getallocatedblocks()
+        result = function()
+        blocks.append(sys.getallocatedblocks() - before)
+        del result
+
+    tracemalloc.start()
+    function()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"blocks": max(0, min(blocks)), "peak_bytes": peak}
+
+
+def run(pattern: str = "", seconds: float = 0.05, array_type: str = "list") -> dict:
+    converters = {}
+    for mode in ("tcp", "tcp+zlib"):
+        converter = BCapConverter(True, False)
+        converter.set_compression_parameters(mode == "tcp+zlib")
+        converter.set_array_type(array_type)
+        converters[mode] = converter
+
+    jobs = []
+    for name, func_id, args, elements in build_cases():
+        modes = ["tcp"]
+        if elements >= COMPRESSED_MIN_ELEMENTS:
+            modes.append("tcp+zlib")
+        for mode in modes:
+            converter = converters[mode]
+            frame = bytes(converter.serialize(1, 1, func_id, args))
+            jobs.append(
+                (
+                    "serialize/{}/{}".format(mode, name),
+                    lambda c=converter, f=func_id, a=args: c.serialize(1, 1, f, a),
+                    elements,
+                )
+            )
+            jobs.append(
+                (
+                    "deserialize/{}/{}".format(mode, name),
+                    lambda c=converter, f=frame: c.deserialize(f),
+                    elements,
+                )
+            )
+
+    for name, frame, elements in build_receive_only_frames():
+        jobs.append(
+            (
+                "deserialize/tcp/{}".format(name),
+                lambda c=converters["tcp"], f=frame: c.deserialize(f),
+                elements,
+            )
+        )
+
+    results = {}
+    for name, function, elements in jobs:
+        if pattern in name:
+            results[name] = measure(function, elements, seconds)
+            print_result(name, results[name])
+
+    return results
+
+
+def print_result(name: str, result: dict, baseline: dict = None) -> None:
+    line = "{:<44}{:>14.0f}{:>12.1f}{:>9}{:>12}".format(
+        name,
+        result["ops_per_sec"],
+        result["ns_per_element"],
+        result["blocks"],
+        result["peak_bytes"],
+    )
+    if baseline is not None:
+        line += "{:>+9.1f}%".format(
+            (result["ops_per_sec"] / baseline["ops_per_sec"] - 1) * 100
+        )
+    print(line)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    # Returns the names of the cases whose ops/sec dropped by more than
+    # threshold from the baseline.
+    print()
+    print(
+        "{:<44}{:>14}{:>12}{:>9}{:>12}{:>10}".format(
+            "case", "ops/sec", "ns/elem", "blocks", "peak bytes", "change"
+        )
+    )
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        print_result(name, result, baseline[name])
+        if result["ops_per_sec"] < baseline[name]["ops_per_sec"] * (1 - threshold):
+            regressions.append(name)
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark BCapConverter.serialize and deserialize."
+    )
+    parser.add_argument("-k", dest="pattern", default="")
+    parser.add_argument("--time", type=float, default=0.05)
+    parser.add_argument(
+        "--array-type", default="list", choices=("list", "array", "numpy", "view")
+    )
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    arguments = parser.parse_args()
+
+    print(
+        "{:<44}{:>14}{:>12}{:>9}{:>12}".format(
+            "case", "ops/sec", "ns/elem", "blocks", "peak bytes"
+        )
+    )
+    results = run(arguments.pattern, arguments.time, arguments.array_type)
+
+    if arguments.save:
+        with open(arguments.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "array_type": arguments.array_type,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                },
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+
+    if arguments.compare:
+        with open(arguments.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, arguments.threshold)
+        if regressions:
+            print()
+            print(
+                "Slower than the baseline by more than {:.0%}:".format(
+                    arguments.threshold
+                )
+            )
+            for name in regressions:
+                print("  " + name)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# Run from the repository root: python -m benchmarks.bench_serialize
+import ctypes
+import io
+import struct
+import timeit
+import zlib
+from datetime import datetime
+from bcap.b_cap_converter import BCapConverter, VarType
+from bcap.b_cap_exception import BCapException, HResult
+
+
+class StreamConverter(BCapConverter):
+    # The io.BytesIO based encoder that BCapConverter.serialize replaced.
+    # It is kept here as the "before" side of the benchmark and as the
+    # reference for the byte-identical check.
+
+    def serialize(
+        self, serial: int, version_or_retry: int, func_id: int, args: any
+    ) -> bytes:
+
+        stream = io.BytesIO()
+        stream.write(BCapConverter.BCAP_SOH)
+        stream.write(struct.pack("<IHh", 0, serial, version_or_retry))
+
+        if self._is_comress and self._is_tcp:
+            func_info_and_arg_stream = io.BytesIO()
+            self._serialize_func_info_and_arg(func_info_and_arg_stream, func_id, args)
+            uncompressed_data_length = func_info_and_arg_stream.tell()
+            compressed_data = zlib.compress(
+                func_info_and_arg_stream.getvalue(), self._compress_level
+            )
+            stream.write(struct.pack("<I", uncompressed_data_length))
+            stream.write(compressed_data)
+        else:
+            self._serialize_func_info_and_arg(stream, func_id, args)
+
+        if self._is_tcp:
+            if self._is_comress is True:
+                stream.write(b"\x01")
+            else:
+                stream.write(b"\x00")
+
+        stream.write(BCapConverter.BCAP_EOT)
+
+        packet_length = stream.tell()
+        stream.seek(1)
+        stream.write(struct.pack("<I", packet_length))
+
+        return stream.getvalue()
+
+    def _serialize_func_info_and_arg(
+        self, stream: io.BytesIO, func_id: int, args: any
+    ) -> None:
+        stream.write(struct.pack("<iH", func_id, len(args)))
+
+        for arg in args:
+            start_arg_pos = stream.tell()
+            stream.write(b"\0\0\0\0")
+            self._serialize_arg(stream, arg)
+            end_arg_pos = stream.tell()
+            stream.seek(start_arg_pos)
+            stream.write(struct.pack("<I", end_arg_pos - start_arg_pos - 4))
+            stream.seek(0, 2)
+
+    def _serialize_arg(self, stream: io.BytesIO, arg: any) -> None:
+        if arg is None:
+            stream.write(struct.pack("<HI", VarType.VT_EMPTY, 1))
+        elif isinstance(arg, (list, tuple)):
+            len_arg = len(arg)
+            if len_arg == 0:
+                stream.write(struct.pack("<HI", VarType.VT_EMPTY, 1))
+            else:
+                arg_type = type(arg[0])
+                is_vnt_array = all(arg_type is type(x) for x in arg) is False
+
+                if is_vnt_array:
+                    stream.write(
+                        struct.pack(
+                            "<HI", VarType.VT_VARIANT | VarType.VT_ARRAY, len_arg
+                        )
+                    )
+                    for e in arg:
+                        self._serialize_arg(stream, e)
+                elif arg_type in BCapConverter._DICT_TYPE_TO_VT:
+                    (var_type, format_char, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[
+                        arg_type
+                    ]
+                    stream.write(
+                        struct.pack("<HI", var_type | VarType.VT_ARRAY, len_arg)
+                    )
+                    for e in arg:
+                        self._serialize_element(
+                            stream, var_type, format_char, is_ctype, e
+                        )
+                else:
+                    raise BCapException(
+                        HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+                        "Failed to serialize arguments.",
+                    )
+        elif isinstance(arg, (bytes, bytearray)):
+            len_arg = len(arg)
+            stream.write(
+                struct.pack(
+                    "<HI%ds" % len_arg,
+                    VarType.VT_ARRAY | VarType.VT_UI1,
+                    len_arg,
+                    arg,
+                )
+            )
+        else:
+            arg_type = type(arg)
+            if arg_type in BCapConverter._DICT_TYPE_TO_VT:
+                (var_type, format_char, is_ctype) = BCapConverter._DICT_TYPE_TO_VT[
+                    arg_type
+                ]
+                stream.write(struct.pack("<HI", var_type, 1))
+                self._serialize_element(stream, var_type, format_char, is_ctype, arg)
+            else:
+                raise BCapException(
+                    HResult.E_CAO_VARIANT_TYPE_NO_SUPPORT,
+                    "Failed to serialize arguments.",
+                )
+
+    def _serialize_element(
+        self, stream: io.BytesIO, var_type: int, format_char: str, is_ctype: bool, value
+    ) -> None:
+        if var_type == VarType.VT_DATE:
+            vnt_date = BCapConverter.datetime_to_vnt_date(value)
+            stream.write(struct.pack("<" + format_char, vnt_date))
+        elif var_type == VarType.VT_BSTR:
+            if is_ctype:
+                vnt_str = value.value.encode("utf-16le")
+            else:
+                vnt_str = value.encode("utf-16le")
+
+            str_length = len(vnt_str)
+            stream.write(
+                struct.pack("<" + (format_char % str_length), str_length, vnt_str)
+            )
+        elif var_type == VarType.VT_BOOL:
+            if value:
+                stream.write(struct.pack("<" + format_char, -1))
+            else:
+                stream.write(struct.pack("<" + format_char, 0))
+        else:
+            if is_ctype:
+                stream.write(struct.pack("<" + format_char, value.value))
+            else:
+                stream.write(struct.pack("<" + format_char, value))
+
+
+CASES = {
+    "service_start": (1, ["WDT=400"]),
+    "variable_get_value": (101, [12]),
+    "variable_put_value": (102, [12, 3.5]),
+    "robot_execute_curjnt": (64, [3, "CurJnt", None]),
+    "robot_move": (72, [3, 1, [[0.0, 45.0, 90.0, 0.0, 45.0, 0.0], "J", "@P"], ""]),
+    "controller_connect": (
+        3,
+        ["Controller0", "CaoProv.DENSO.RC8", "", "@IfNotMember"],
+    ),
+    "mixed_scalars": (
+        17,
+        [
+            1,
+            "Command",
+            [True, ctypes.c_short(2), ctypes.c_double(1.5), datetime(2020, 1, 1)],
+        ],
+    ),
+    "float_array_64": (102, [12, [float(i) for i in range(64)]]),
+    "bytes_1k": (53, [4, bytes(range(256)) * 4]),
+}
+
+
+def run(number: int = 20000, repeat: int = 5) -> None:
+    print(
+        "{:<24}{:>12}{:>12}{:>10}".format("case", "before(us)", "after(us)", "speedup")
+    )
+    for is_tcp, is_compress in ((True, False), (False, False), (True, True)):
+        before = StreamConverter(is_tcp, False)
+        after = BCapConverter(is_tcp, False)
+        before.set_compression_parameters(is_compress)
+        after.set_compression_parameters(is_compress)
+        print(
+            "-- {}{}".format(
+                "tcp" if is_tcp else "udp", " compressed" if is_compress else ""
+            )
+        )
+        for name, (func_id, args) in CASES.items():
+            packet_before = before.serialize(1, 1, func_id, args)
+            packet_after = bytes(after.serialize(1, 1, func_id, args))
+            if is_compress:
+                # The deflate window is sized to the body, so compressed
+                # packets are compared after decoding.
+                packet_before = after.deserialize(packet_before)
+                packet_after = after.deserialize(packet_after)
+            if packet_after != packet_before:
+                raise AssertionError("{} is not identical.".format(name))
+
+            t_before = min(
+                timeit.repeat(
+                    lambda: before.serialize(1, 1, func_id, args),
+                    number=number,
+                    repeat=repeat,
+                )
+            )
+            t_after = min(
+                timeit.repeat(
+                    lambda: after.serialize(1, 1, func_id, args),
+                    number=number,
+                    repeat=repeat,
+                )
+            )
+            print(
+                "{:<24}{:>12.2f}{:>12.2f}{:>9.2f}x".format(
+                    name,
+                    t_before / number * 1e6,
+                    t_after / number * 1e6,
+                    t_before / t_after,
+                )
+            )
+
+
+if __name__ == "__main__":
+    run()
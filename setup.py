@@ -23,5 +23,6 @@ setup(
     ],
     license=license,
     packages=find_packages(),
-    python_requires=">=3.6",
+    python_requires=">=3.7",
+    extras_require={"numpy": ["numpy"]},
 )